@@ -28,11 +28,20 @@
 import pwem
 import os
 import fnmatch
+import time
+import tempfile
+import threading
+import subprocess
 import pyworkflow.utils as pwutils
 from pwem import Config as emConfig
 
 from pyworkflow.utils import Environ
 from .constants import *
+from .utils.scratch import ScratchRun
+from .utils.database import getDatabaseMirror
+from .utils.governor import HostSemaphore, getHostSlots
+from .utils.process import runProcess
+from .utils.telemetry import makeRecord, appendRecord
 
 
 
@@ -47,6 +56,9 @@ class Plugin(pwem.Plugin):
     _homeVar = ROSETTA_DIC['home']
     _pathVars = [ROSETTA_DIC['home']]
     _supportedVersions = [ROSETTA_DIC['version']]
+    # Time to get the database of the next program launched by each thread, and mirrors already logged
+    _databaseTimes = threading.local()
+    _loggedMirrors = set()
 
 
     @classmethod
@@ -54,6 +66,15 @@ class Plugin(pwem.Plugin):
         """ Return and write a variable in the config file. Set the Rosetta path on the computer
         """
         cls._defineVar(ROSETTA_DIC['home'], cls.getRosettaDir())
+        cls._defineVar(ROSETTA_SCRATCH, '')
+        cls._defineVar(ROSETTA_DB_CACHE, '')
+        cls._defineVar(ROSETTA_DB_CACHE_SUBSET, '')
+        cls._defineVar(ROSETTA_HOST_CPUS, '')
+        cls._defineVar(ROSETTA_HOST_MEMORY, '')
+        cls._defineVar(ROSETTA_PROCESS_MEMORY, '2')
+        cls._defineVar(ROSETTA_LOCK_DIR, os.path.join(tempfile.gettempdir(), 'scipion_rosetta_slots'))
+        cls._defineVar(ROSETTA_PROFILE, '')
+        cls._defineVar(ROSETTA_CALIBRATION, os.path.join('~', '.config', 'scipion', 'rosetta_calibration.jsonl'))
 
 
     @classmethod
@@ -80,12 +101,124 @@ class Plugin(pwem.Plugin):
                             progName)
 
     @classmethod
-    def runRosettaProgram(cls, program, args=None, extraEnvDict=None, cwd=None):
-        """ Internal shortcut function to launch a Rosetta program. """
+    def runRosettaProgram(cls, program, args=None, extraEnvDict=None, cwd=None,
+                          inputFiles=None, outputFiles=None, appendFiles=None, monitor=None,
+                          metricsFile=None, tags=None, numberOfMpi=1, hostConfig=None):
+        """ Internal shortcut function to launch a Rosetta program.
+        If ROSETTA_SCRATCH is defined and the outputs of the program are declared (outputFiles: glob patterns,
+        appendFiles: files whose content is appended to the ones in cwd), the inputFiles are staged into a
+        node-local scratch directory, the program runs there and only the declared outputs are copied back to cwd.
+        If monitor is passed, it is periodically called with the resident memory (bytes) of the running program.
+        If metricsFile is passed, a record with the resources used by the program (tagged with the tags dictionary)
+        is appended to it, with the time to prepare the database mirror got by this thread for it (getDatabasePath).
+        If numberOfMpi > 1, the (MPI build of the) program is launched with the MPI command of the hostConfig. It takes
+        a host slot per rank and does not use the scratch directory, since its ranks may run in other nodes.
+        """
         env = cls.getEnviron()
         if extraEnvDict is not None:
             env.update(extraEnvDict)
-        pwutils.runJob(None, program, args, env=env, cwd=cwd)
+        # Time to prepare the database mirror passed to this program, if any
+        databaseTime, cls._databaseTimes.seconds = getattr(cls._databaseTimes, 'seconds', None), None
+
+        slot, waitTime, semaphore = None, 0.0, cls.getHostSemaphore()
+        if semaphore is not None:
+            # An MPI program takes a slot per rank (all the slots of the host at most)
+            slot, waitTime = semaphore.acquire(count=numberOfMpi)
+            print('%s waited %.2f s for %d Rosetta slots (%d in the host)' %
+                  (os.path.basename(program), waitTime, len(slot.indexes), semaphore.slots))
+
+        result, start = {}, time.time()
+        runKwargs = {'monitor': monitor, 'monitored': metricsFile is not None, 'result': result,
+                     'numberOfMpi': numberOfMpi, 'hostConfig': hostConfig}
+        try:
+            scratchRoot = cls.getScratchRoot()
+            if scratchRoot is None or (outputFiles is None and appendFiles is None) or numberOfMpi > 1:
+                cls._runProgram(program, args, env, cwd, **runKwargs)
+            else:
+                with ScratchRun(scratchRoot, cwd, inputFiles, outputFiles, appendFiles) as scratch:
+                    cls._runProgram(program, scratch.localizeArgs(args), env, scratch.path, **runKwargs)
+            print('%s finished in %.2f s' % (os.path.basename(program), time.time() - start))
+        finally:
+            if slot is not None:
+                slot.release()
+            if metricsFile is not None:
+                # Recorded as the Rosetta program, not as the MPI command that launches it
+                record = makeRecord(program, tags, start, time.time() - start, result.get('status'),
+                                    result.get('rusage'), waitTime, result.get('io'))
+                if numberOfMpi > 1:
+                    record['mpi'] = numberOfMpi
+                if databaseTime is not None:
+                    record['databaseTime'] = round(databaseTime, 3)
+                appendRecord(metricsFile, record)
+
+    @classmethod
+    def _runProgram(cls, program, args, env, cwd, monitor=None, monitored=False, result=None,
+                    numberOfMpi=1, hostConfig=None):
+        """ Run the program with pwutils.runJob or, if its resources are monitored, with runProcess. The exit status,
+        resource usage and I/O bytes are stored in the result dictionary """
+        result = {} if result is None else result
+        if monitor is None and not monitored:
+            pwutils.runJob(None, program, args, numberOfMpi=numberOfMpi, hostConfig=hostConfig, env=env, cwd=cwd)
+            result['status'] = 0
+        else:
+            if numberOfMpi > 1:
+                program, args = pwutils.buildRunCommand(program, args, numberOfMpi, hostConfig, env), None
+            result['status'], result['rusage'], result['io'] = runProcess(program, args, env=env, cwd=cwd,
+                                                                          onSample=monitor, check=False)
+            if result['status'] != 0:
+                raise subprocess.CalledProcessError(result['status'], program)
+
+    @classmethod
+    def getHostSemaphore(cls):
+        """ Return the semaphore limiting the concurrent Rosetta processes in the host, sized from ROSETTA_HOST_CPUS
+        and ROSETTA_HOST_MEMORY / ROSETTA_PROCESS_MEMORY, or None if none of them is set (empty values count as not
+        set). Raises ValueError if they are not valid numbers """
+        slots = getHostSlots(cls.getVar(ROSETTA_HOST_CPUS), cls.getVar(ROSETTA_HOST_MEMORY),
+                             cls.getVar(ROSETTA_PROCESS_MEMORY))
+        if slots is None:
+            return None
+        return HostSemaphore(os.path.expanduser(cls.getVar(ROSETTA_LOCK_DIR)), slots)
+
+    @classmethod
+    def getScratchRoot(cls):
+        """ Return the node-local scratch directory where Rosetta programs are run or None if it is not set """
+        scratchRoot = cls.getVar(ROSETTA_SCRATCH)
+        if not scratchRoot:
+            return None
+        return os.path.expandvars(os.path.expanduser(scratchRoot))
+
+    @classmethod
+    def getDatabasePath(cls):
+        """ Return the Rosetta database to pass to the programs. If ROSETTA_DB_CACHE is set, the database is mirrored
+        there once per node and Rosetta version (only the entries in ROSETTA_DB_CACHE_SUBSET if defined) and the
+        mirror is returned instead of the one in ROSETTA_HOME """
+        database = os.path.join(cls.getHome(), ROSETTA_DATABASE_PATH)
+        cacheRoot = cls.getVar(ROSETTA_DB_CACHE)
+        if not cacheRoot:
+            return database
+
+        subset = cls.getVar(ROSETTA_DB_CACHE_SUBSET)
+        subset = [entry.strip() for entry in subset.split(',') if entry.strip()] if subset else None
+        start = time.time()
+        mirror, created = getDatabaseMirror(database, os.path.expandvars(os.path.expanduser(cacheRoot)),
+                                            cls.getDatabaseVersion(), subset)
+        # Recorded in the telemetry of the next program launched by this thread (runRosettaProgram)
+        cls._databaseTimes.seconds = time.time() - start
+        if created or mirror not in cls._loggedMirrors:
+            cls._loggedMirrors.add(mirror)
+            print('Rosetta database %s %s in %.3f s' % (mirror, 'mirrored' if created else 'ready',
+                                                        cls._databaseTimes.seconds))
+        return mirror
+
+    @classmethod
+    def getCalibrationFile(cls):
+        """ Return the local file with the telemetry records of previous runs used to calibrate the estimates """
+        return os.path.expandvars(os.path.expanduser(cls.getVar(ROSETTA_CALIBRATION)))
+
+    @classmethod
+    def getDatabaseVersion(cls):
+        """ Identifier of the installed Rosetta release, used to version the database mirrors """
+        return '{}_{}'.format(ROSETTA_DIC['version'], os.path.basename(os.path.normpath(cls.getHome())))
 
     @classmethod
     def validateInstallation(cls):
@@ -98,6 +231,11 @@ class Plugin(pwem.Plugin):
         if not os.path.exists(os.path.expanduser(cls.getVar(ROSETTA_DIC['home']))):
             missingPaths.append("Path of Rosetta does not exist (%s) : %s " % (ROSETTA_DIC['home'],
                                                                                cls.getVar(ROSETTA_DIC['home'])))
+        try:
+            cls.getHostSemaphore()
+        except ValueError as e:
+            missingPaths.append("Invalid host limits (%s, %s, %s): %s" % (ROSETTA_HOST_CPUS, ROSETTA_HOST_MEMORY,
+                                                                         ROSETTA_PROCESS_MEMORY, e))
         return missingPaths
 
 
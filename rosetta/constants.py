@@ -30,6 +30,17 @@ ROSETTA_BINARIES_PATH = "main/source/bin"
 ROSETTA_DATABASE_PATH = "main/database"
 ROSETTA_PARAMS_PATH = "main/source/scripts/python/public"
 
+# Optional variables (scipion.conf or environment) for the execution of Rosetta programs
+ROSETTA_SCRATCH = 'ROSETTA_SCRATCH'  # node-local directory (disk or tmpfs) where Rosetta programs are run
+ROSETTA_DB_CACHE = 'ROSETTA_DB_CACHE'  # node-local directory where the Rosetta database is mirrored
+ROSETTA_DB_CACHE_SUBSET = 'ROSETTA_DB_CACHE_SUBSET'  # comma separated database entries to copy (default: all)
+ROSETTA_HOST_CPUS = 'ROSETTA_HOST_CPUS'  # max concurrent Rosetta processes in the host ('auto': number of CPUs)
+ROSETTA_HOST_MEMORY = 'ROSETTA_HOST_MEMORY'  # memory budget (GB) for all the Rosetta processes in the host
+ROSETTA_PROCESS_MEMORY = 'ROSETTA_PROCESS_MEMORY'  # expected memory (GB) of each Rosetta process
+ROSETTA_LOCK_DIR = 'ROSETTA_LOCK_DIR'  # host-local directory for the slot lock files
+ROSETTA_PROFILE = 'ROSETTA_PROFILE'  # profile the steps of the protocols if not empty
+ROSETTA_CALIBRATION = 'ROSETTA_CALIBRATION'  # local file with the telemetry of previous runs for the estimates
+
 
 # Name of programs for linux
 SCORE = 'score.static.linuxgccrelease'  # rescores PDBs and silent files, extracts, PDBs from silent files,
@@ -45,6 +56,32 @@ MAKE_RAY_FILES_GPU = 'make_ray_files.opencl.linuxgccrelease'  # create a ray fil
 DARC = 'DARC.static.linuxgccrelease'      # run DARC
 DARC_GPU = 'DARC.opencl.linuxgccrelease'  # run DARC with GPU
 
+SEED_BASE = 1111111  # seed of the rosetta_scripts jobs, offset by their first model
+ROSETTA_SCRIPTS_MPI = 'rosetta_scripts.mpi.linuxgccrelease'  # MPI build of rosetta_scripts
+JOB_MANIFEST = 'job.json'  # fingerprint, seed and models of a finished rosetta_scripts job
+MAP_MANIFEST = 'inpVolume.json'  # key (volume and crop) of the map prepared for rosetta_scripts
+EXTRACT_PDBS = 'extract_pdbs.static.linuxgccrelease'  # extracts PDBs from silent files
+SILENT_FILE = 'models.silent'  # binary silent file of the models of a rosetta_scripts job
+SILENT_INDEX = 'models.index.json'  # tags, scores and offsets of the models of a silent file
+ROSETTA_SCRIPTS = 'rosetta_scripts.static.linuxgccrelease'
+MINIMIZE_CHAIN = 'X'  # chain of the ligand in the complexes minimized after DARC
+
+# Minimization of a receptor-ligand complex, scored by the interface energy of the ligand (chain MINIMIZE_CHAIN)
+minimizeComplexXML = '''<ROSETTASCRIPTS>
+	<SCOREFXNS>
+		<ScoreFunction name="ref" weights="ref2015"/>
+	</SCOREFXNS>
+	<MOVERS>
+		<MinMover name="min" scorefxn="ref" type="lbfgs_armijo_nonmonotone" tolerance="0.001" bb="1" chi="1" jump="ALL"/>
+		<InterfaceScoreCalculator name="iface" chains="%s" scorefxn="ref"/>
+	</MOVERS>
+	<PROTOCOLS>
+		<Add mover="min"/>
+		<Add mover="iface"/>
+	</PROTOCOLS>
+	<OUTPUT scorefxn="ref"/>
+</ROSETTASCRIPTS>''' % MINIMIZE_CHAIN
+
 generateStructuresXML = '''<ROSETTASCRIPTS>
 	<SCOREFXNS>
 		<ScoreFunction name="cen" weights="score4_smooth_cart">
@@ -34,9 +34,10 @@ at the interface.
 The output will be a file named ray_<PDBname>_0001_<TargetResidue>.txt
 """
 
-from pyworkflow.utils import Message, createLink
+from pyworkflow.utils import Message, createLink, cleanPath
 from pyworkflow.utils.path import makePath
 from pyworkflow.protocol import params
+from pyworkflow.protocol.constants import STATUS_NEW
 import pyworkflow.object as pwobj
 from pyworkflow.protocol.params import LEVEL_ADVANCED, GPU_LIST, USE_GPU
 from pwem.protocols import EMProtocol
@@ -55,13 +56,38 @@ except:
     ADTGrid = False
 
 import shutil
-import os, re
+import os, re, math, json, zlib
 import glob
+import threading
+import time
+import numpy as np
 
 from rosetta import Plugin
 from rosetta.constants import *
 from ..convert import adt2agdGrid
 from rosetta.utils.batchParamsToMol_script import getBatchMolToParamsPath
+from rosetta.utils.scratch import copyAtomic, appendLocked
+from rosetta.utils import pdbio
+from rosetta.utils.silent import readScores
+from rosetta.utils.memory import MemoryGovernor, GB
+from rosetta.utils.ligands import countConformers, getParamsDescriptors, getComplexity, getMoleculeDescriptors
+from rosetta.utils.scheduling import CostModel
+from rosetta.utils.estimator import updateCalibration, loadCalibration, estimateDarc, formatEstimate, \
+    writeEstimate, readEstimate
+from rosetta.utils.profiling import profileStep, addProfilingParams
+from rosetta.utils.progress import ProgressTracker, loadStatus, formatStatus
+from rosetta.utils.telemetry import getProtocolTags, getMetricsKwargs, getMetricsFile, measureChildren, readRecords, \
+    formatSummary, getTailIdle
+
+STATE_LOCK, OUTPUT_LOCK = threading.Lock(), threading.RLock()
+# Finished dockings are appended to the output every STREAM_BATCH dockings or STREAM_INTERVAL seconds
+STREAM_BATCH, STREAM_INTERVAL = 20, 60
+# Seconds between checks for new molecules in a streaming input
+INPUT_CHECK_INTERVAL = 30
+# Relative cost of the conformers search and the complex minimization, used to order the dockings
+SEARCH_CONFORMERS_FACTOR, MINIMIZE_FACTOR = 2.0, 1.5
+# Ligands read to estimate the cost of a screen
+ESTIMATE_SAMPLE = 200
 
 
 class RosettaProtDARC(EMProtocol):
@@ -157,16 +183,43 @@ class RosettaProtDARC(EMProtocol):
                       label="Minimize output complex", default=False,
                       help="Perform energy minimization on the output structure")
 
+        group.addParam("minimizeTopK", params.IntParam, default=0, condition='minimize_output',
+                       label="Minimize only the top ligands: ",
+                       help="Dock every ligand without minimization and then minimize the complex of only the best "
+                            "K ligands of each pocket (ranked by their DARC score). The complex of the receptor with "
+                            "the docked pose of each selected ligand is minimized (rosetta_scripts), without docking "
+                            "it again, and scored by the interface energy of the ligand. "
+                            "The poses without minimization are saved in an additional output.\n"
+                            "If 0, the output complex of every ligand is minimized by DARC")
+
         # Advanced parameters =======================================
         advanced = form.addGroup("Advanced parameters", expertLevel=LEVEL_ADVANCED)
+        advanced.addParam('adaptiveBudget', params.BooleanParam, default=False,
+                          label='Adapt PSO budget to each ligand:',
+                          help='Scale the runs and particles of PSO of each ligand between a minimum and a maximum '
+                               'with its complexity: rotatable bonds and heavy atoms (from its params file) and '
+                               'number of conformers. Small rigid ligands get the minimum budget and the most '
+                               'flexible ones the maximum.')
+
         advanced.addParam('num_runs', params.IntParam, default=100, label='Runs for PSO:',
+                          condition='not adaptiveBudget',
                           help='Set the number of runs used during Particle Swarm Optimization (PSO). '
                                'Default value is 100 runs.')
 
         advanced.addParam('num_particles', params.IntParam, default=100, label='Particles for PSO:',
+                          condition='not adaptiveBudget',
                           help='Set the number of particles used during Particle Swarm Optimization (PSO). '
                                'Default value is 100 particles.')
 
+        advanced.addParam('minRuns', params.IntParam, default=30, label='Min runs for PSO:',
+                          condition='adaptiveBudget', help='Runs of PSO for the simplest ligands')
+        advanced.addParam('maxRuns', params.IntParam, default=200, label='Max runs for PSO:',
+                          condition='adaptiveBudget', help='Runs of PSO for the most complex ligands')
+        advanced.addParam('minParticles', params.IntParam, default=30, label='Min particles for PSO:',
+                          condition='adaptiveBudget', help='Particles of PSO for the simplest ligands')
+        advanced.addParam('maxParticles', params.IntParam, default=200, label='Max particles for PSO:',
+                          condition='adaptiveBudget', help='Particles of PSO for the most complex ligands')
+
         advanced.addParam('missing_weight', params.FloatParam, default=5.48,
                           label='Weight for missing points in the pockets:',
                           help='Set the weight of those rays that do not reach the protein pocket'
@@ -187,14 +240,70 @@ class RosettaProtDARC(EMProtocol):
         runs.addParam("seed", params.IntParam, label='Set seed: ', default=1111111, condition="cseed",
                        help='Set a integer number as constant seed. The default one is 1111111 ')
 
+        runs.addParam("replicates", params.IntParam, label='Max replicates per ligand: ', default=1,
+                      help='Dock each ligand several times with different seeds (as many at the same time as '
+                           'threads of the protocol not used by other dockings) until its best score converges, '
+                           'keeping the best pose. The spread of the scores of the replicates is saved in the output '
+                           'molecules.\nIf 1, each ligand is docked once')
+        runs.addParam("replicateTol", params.FloatParam, label='Convergence tolerance: ', default=0.1,
+                      condition='replicates > 1',
+                      help='The replicates of a ligand stop when a new round of them improves its best DARC score '
+                           'less than this value')
+
+        funnel = form.addGroup("Screening funnel", expertLevel=LEVEL_ADVANCED)
+        funnel.addParam('funnelMode', params.BooleanParam, default=False, label='Use a screening funnel: ',
+                        help='Dock the whole library first in a fast screening stage (reduced PSO and, by default, '
+                             'shape only) and run the full docking defined above only on the ligands selected '
+                             'from it. The poses of the screening stage are saved in an additional output')
+        funnel.addParam('screenRuns', params.IntParam, default=20, condition='funnelMode',
+                        label='Runs for PSO in screening: ',
+                        help='Number of runs used during PSO in the screening stage')
+        funnel.addParam('screenParticles', params.IntParam, default=20, condition='funnelMode',
+                        label='Particles for PSO in screening: ',
+                        help='Number of particles used during PSO in the screening stage')
+        funnel.addParam('screenElectro', params.BooleanParam, default=False, condition='funnelMode and use_electro',
+                        label='Include electrostatics in screening: ',
+                        help='Whether to use the electrostatics grid in the screening stage or only the shape '
+                             'of the pocket')
+        funnel.addParam('funnelSelection', params.EnumParam, default=0, condition='funnelMode',
+                        choices=['Top fraction', 'Score threshold'], label='Select ligands by: ',
+                        help='How the ligands that go on to the full docking are selected in each pocket from '
+                             'their screening score')
+        funnel.addParam('funnelFraction', params.FloatParam, default=0.1,
+                        condition='funnelMode and funnelSelection == 0', label='Fraction of ligands selected: ',
+                        help='Fraction (0-1] of the best scored ligands in screening that are docked again')
+        funnel.addParam('funnelThreshold', params.FloatParam, default=0.0,
+                        condition='funnelMode and funnelSelection == 1', label='Score threshold: ',
+                        help='Ligands with a screening score lower or equal than this value are docked again')
+
+        memory = form.addGroup("Memory management", expertLevel=LEVEL_ADVANCED)
+        memory.addParam('memoryBudget', params.FloatParam, default=0, label='Memory budget (GB): ',
+                        help='Maximum memory used by the concurrent DARC processes of this protocol. New dockings '
+                             'only start while the memory expected for them fits in the budget, learning the memory '
+                             'of each ligand from the ones already docked. The number of threads is the maximum '
+                             'number of concurrent dockings.\nIf 0, the memory is not limited.')
+        memory.addParam('ligandMemory', params.FloatParam, default=1.0, condition='memoryBudget > 0',
+                        label='Initial memory per ligand (GB): ',
+                        help='Memory expected for a docking until the memory of some of them is measured')
+
+        addProfilingParams(form)
+
         form.addParallelSection(threads=4, mpi=1)
 
  # --------------------------- STEPS functions ------------------------------
 
     def _insertAllSteps(self):
         self.originalReceptorFile = self.getOriginalReceptorFile()
+        mols, self._inputClosed = self.loadInputMolecules()
+        molsDic = {mol.getObjId(): mol for mol in mols}
+        # The steps inserted while running are recorded in the manifest, so a resumed run inserts them again in the
+        # same order and they match the steps of the previous execution
+        manifest = self.loadStepsManifest()
+        firstIds = manifest[0]['molIds'] if manifest else sorted(molsDic)
+        self._insertedMolIds = set(firstIds)
+
         # Insert processing steps
-        cId = self._insertFunctionStep('convertInputStep', prerequisites=[])
+        cId = self._insertFunctionStep('convertInputStep', firstIds, prerequisites=[])
         raysSteps = []
         if self.fromReceptor == 1:
             for pocket in self.inputStructROIs.get():
@@ -203,29 +312,115 @@ class RosettaProtDARC(EMProtocol):
         else:
           gId = self._insertFunctionStep('generateRaysStep', prerequisites=[cId])
           raysSteps.append(gId)
-
+        self._raysSteps, self._lastParamsStep = raysSteps, cId
+
+        # The docking steps of the molecules are inserted once their params are generated (insertReadyDockings), so
+        # the selection of the first stage and the output wait until the docking steps of all the molecules are
+        # inserted. The dockings of the later stages are inserted once the ligands that go on to them are selected
+        stages = self.getStages()
+        self._selectSteps, self._insertedStages = {}, [stages[0]['name']]
+        if len(stages) > 1:
+            self._selectSteps[stages[0]['name']] = self._insertFunctionStep('selectStep', stages[0]['name'],
+                                                                            prerequisites=[], wait=True)
+        self._outputStep = self._insertFunctionStep('createOutputStep', prerequisites=[], wait=True)
+        self._pendingDockings = [('molfile_list.txt', cId, [molsDic[molId] for molId in firstIds if molId in molsDic])]
+
+        if manifest:
+            # The progress of the previous execution is kept
+            self.replayStepsManifest(manifest[1:], molsDic)
+        else:
+            self.addManifestEntry({'event': 'params', 'batch': 'molfile_list.txt', 'molIds': firstIds})
+            self.getProgressTracker().setTotals(self.getProgressTotals(len(mols)))
+
+        # Molecules that arrived to the input while the run was stopped
+        newIds = [molId for molId in molsDic if molId not in self._insertedMolIds]
+        if newIds:
+            self.insertParamsStep(newIds, molsDic)
+
+    def replayStepsManifest(self, entries, molsDic):
+        """ Insert the params and docking steps of the batches of molecules as they were inserted in the previous
+        execution """
+        for entry in entries:
+            if entry['event'] == 'params':
+                self.insertParamsStep(entry['molIds'], molsDic, resumed=True)
+            elif entry['event'] == 'dockings':
+                batch = [batch for batch in self._pendingDockings if batch[0] == entry['batch']][0]
+                self.insertBatchDockings(batch, resumed=True)
+            elif entry['event'] == 'stage':
+                self.insertStageDockings(self.getStage(entry['stage']), resumed=True)
+
+    def _insertDarcSteps(self, batchName, mols, prerequisites):
+        """ Insert a darcStep for each molecule of a batch in each pocket, in the first stage of the screen, as
+        prerequisites of its selection step (or the output step if it is the only stage) """
+        pockets = [pocket.clone() for pocket in self.inputStructROIs.get()] if self.fromReceptor == 1 else [None]
+        stage = self.getStages()[0]
+        # The most expensive dockings are inserted (and so started) first, shortening the tail of the screen
+        mols = self.sortByCost(batchName, mols, stage)
         darcSteps = []
-        for mol in self.inputSmallMolecules.get():
-            if self.fromReceptor == 1:
-                for pocket in self.inputStructROIs.get():
-                    dId = self._insertFunctionStep('darcStep', mol.clone(), pocket.clone(), prerequisites=raysSteps)
-                    darcSteps.append(dId)
-            else:
-                dId = self._insertFunctionStep('darcStep', mol.clone(), prerequisites=raysSteps)
-                darcSteps.append(dId)
-
-        self._insertFunctionStep('createOutputStep', prerequisites=darcSteps)
-
-    def convertInputStep(self):
+        for mol in mols:
+            for pocket in pockets:
+                darcSteps.append(self._insertFunctionStep('darcStep', mol.clone(), pocket, stage['name'],
+                                                          prerequisites=prerequisites))
+
+        nextStep = self._selectSteps.get(stage['name'], self._outputStep)
+        self._steps[nextStep - 1].addPrerequisites(*darcSteps)
+
+    def insertStageDockings(self, stage, resumed=False):
+        """ Insert the docking steps of a later stage of the screen, only for the ligands selected in each pocket
+        by the previous stage, followed by the selection step of the stage (or the output step in the last one) """
+        previous = self.getPreviousStage(stage['name'])
+        prevSelectStep = self._selectSteps[previous['name']]
+        with open(self.getSelectionFile(previous['name'])) as f:
+            selection = json.load(f)
+
+        mols = self.loadInputMolecules()[0]
+        pockets = [pocket.clone() for pocket in self.inputStructROIs.get()] if self.fromReceptor == 1 else [None]
+        selectedNames = set(name for names in selection.values() for name in names)
+        mols = self.sortByCost('selection_{}'.format(previous['name']),
+                               [mol for mol in mols if self.getConfName(mol) in selectedNames], stage)
+        darcSteps = []
+        for mol in mols:
+            for pocket in pockets:
+                if self.getConfName(mol) in selection.get(os.path.basename(self.getPocketDir(pocket)), []):
+                    darcSteps.append(self._insertFunctionStep('darcStep', mol.clone(), pocket, stage['name'],
+                                                              prerequisites=[prevSelectStep]))
+
+        if stage['final']:
+            self._steps[self._outputStep - 1].addPrerequisites(prevSelectStep, *darcSteps)
+        else:
+            self._selectSteps[stage['name']] = self._insertFunctionStep('selectStep', stage['name'],
+                                                                        prerequisites=[prevSelectStep] + darcSteps)
+        self._insertedStages.append(stage['name'])
+        if not resumed:
+            self.addManifestEntry({'event': 'stage', 'stage': stage['name']})
+
+    @profileStep
+    def convertInputStep(self, molIds=None):
         #Converting the ADT grid to the Rosetta agd format
         if self.use_electro:
             adtGridName = self.grid.get().getFileName().split('/')[-1]
             self.agdGrid = adt2agdGrid(self.grid.get(), self._getExtraPath(adtGridName.replace('.e.map', '.agd')))
 
         # Generate params file that DARC will use to dock the ligand in the target protein
-        writtenFiles = []
-        with open(self._getExtraPath("molfile_list.txt"), "w+") as file:
-            for mol in self.inputSmallMolecules.get():
+        self.generateParams(molIds, 'molfile_list.txt', 'convertInputStep')
+        # Estimated from the params, once, so the summary does not read the ligands on each refresh
+        writeEstimate(self.getEstimateFile(), self.getEstimate())
+
+    @profileStep
+    def paramsStep(self, molIds, listName):
+        """ Generate the params files of the molecules that arrived to a streaming input """
+        self.generateParams(molIds, listName, 'paramsStep')
+
+    def generateParams(self, molIds, listName, stepName):
+        """ Generate the params files of the input molecules with the given ids (all if None), skipping those
+        already generated """
+        molIds = set(molIds) if molIds is not None else None
+        mols = [mol for mol in self.loadInputMolecules()[0] if molIds is None or mol.getObjId() in molIds]
+        paramsDir = self._getExtraPath('params')
+        with open(self._getExtraPath(listName), "w+") as file:
+            for mol in mols:
+                if os.path.exists(os.path.join(paramsDir, self.getConfName(mol))):
+                    continue
                 molFile = mol.getFileName()
                 if not 'mol2' in molFile and not 'sdf' in molFile:
                     confFile = self.convertFile(molFile)
@@ -234,11 +429,11 @@ class RosettaProtDARC(EMProtocol):
                 file.write(os.path.abspath(confFile) + "\n")
 
         # 2. Launch batch_molfile_to_params.py for each file. It will generate a pdb file and params file
-        database_path = os.path.join(Plugin.getHome(), ROSETTA_DATABASE_PATH)
+        database_path = Plugin.getDatabasePath()
         args = " -d %s" % database_path
         mol2params_path = os.path.join(Plugin.getHome(), ROSETTA_PARAMS_PATH, PARAMS_FILE)
         args += " --script_path %s" % mol2params_path
-        mollist = os.path.abspath(self._getExtraPath("molfile_list.txt"))
+        mollist = os.path.abspath(self._getExtraPath(listName))
         args += " %s" % mollist
 
         # Execute the program bach_molfile_to_params to create the params file that will be used by DARC programs
@@ -251,8 +446,10 @@ class RosettaProtDARC(EMProtocol):
         self.runJob('chmod', ' 755 {}'.format(batchParamsToMol_script),
                          cwd=os.path.abspath(self._getExtraPath()))
         Plugin.runRosettaProgram(batchParamsToMol_script, args=args,
-                                 cwd=os.path.abspath(self._getExtraPath()))
+                                 cwd=os.path.abspath(self._getExtraPath()),
+                                 **getMetricsKwargs(self, stepName))
 
+    @profileStep
     def generateRaysStep(self, pocket=None):
         """Generate the txt and pdb file with the protein pocket mapping around a given residue
         """
@@ -263,10 +460,12 @@ class RosettaProtDARC(EMProtocol):
             # Generate 2 file with different formats (pdb (rays are hetatm) and txt).
             # Run Make Ray Files w/wo GPU
             if not getattr(self, USE_GPU):
-                Plugin.runRosettaProgram(Plugin.getProgram(MAKE_RAY_FILES), args, cwd=rayDir)
+                Plugin.runRosettaProgram(Plugin.getProgram(MAKE_RAY_FILES), args, cwd=rayDir,
+                                         **self.getRaysScratchFiles(), **self.getRaysMetrics(rayDir))
             else:
                 args += " -gpu %s" % str(getattr(self, GPU_LIST).get())
-                Plugin.runRosettaProgram(Plugin.getProgram(MAKE_RAY_FILES_GPU), args, cwd=rayDir)
+                Plugin.runRosettaProgram(Plugin.getProgram(MAKE_RAY_FILES_GPU), args, cwd=rayDir,
+                                         **self.getRaysScratchFiles(), **self.getRaysMetrics(rayDir))
         else:
             rayDir = self._getExtraPath('pocket_1')
             makePath(rayDir)
@@ -274,27 +473,41 @@ class RosettaProtDARC(EMProtocol):
             # Generate 2 file with different formats (pdb (rays are hetatm) and txt).
             # Run Make Ray Files w/wo GPU
             if GPU_LIST == 0:
-              Plugin.runRosettaProgram(Plugin.getProgram(MAKE_RAY_FILES), args, cwd=rayDir)
+              Plugin.runRosettaProgram(Plugin.getProgram(MAKE_RAY_FILES), args, cwd=rayDir,
+                                       **self.getRaysScratchFiles(), **self.getRaysMetrics(rayDir))
             else:
               args += " -gpu %s" % str(self.gpuList.get())
-              Plugin.runRosettaProgram(Plugin.getProgram(MAKE_RAY_FILES_GPU), args, cwd=rayDir)
+              Plugin.runRosettaProgram(Plugin.getProgram(MAKE_RAY_FILES_GPU), args, cwd=rayDir,
+                                       **self.getRaysScratchFiles(), **self.getRaysMetrics(rayDir))
 
 
-    def darcStep(self, ligand, pocket=None):
+    @profileStep
+    def darcStep(self, ligand, pocket=None, stageName=None):
         """ Launch a docking process with Rosetta DARC for each ligand
         """
-
+        stage = self.getStage(stageName)
+        pocketDir = self.getPocketDir(pocket)
+        startTime = time.time()
         # Add protein file where the program will generate the rays (REQUIRED)
         pdb_file = self.getOriginalReceptorFile()
 
         # Save compound with errors during docking
         compound_Error = []
 
-        rayDir = self.getPocketDir(pocket)  # Run DARC for each ligand in the set of small molecules (and his conformers)
+        # Run DARC for each ligand in the set of small molecules (and his conformers)
+        # The stages before the last one run in a subdirectory of the pocket
+        rayDir = self.getStageDir(pocketDir, stage)
+        os.makedirs(rayDir, exist_ok=True)
+        if not stage['dock']:
+            # The pose of the ligand docked in the previous stage is minimized, without docking it again
+            success = self.minimizePose(ligand, pocketDir, rayDir, stage)
+            self.dockingFinished(ligand, pocketDir, rayDir, stage, startTime, success)
+            return
 
         # Create the args of the program and add protein file
         args = ""
         args += " -protein %s" % os.path.abspath(pdb_file)
+        args += " -database %s" % Plugin.getDatabasePath()
 
 
         paramsDir = self.getParamsDir(ligand)
@@ -309,11 +522,11 @@ class RosettaProtDARC(EMProtocol):
         args += " -extra_res_fa %s" % os.path.abspath(newLigandParams)
 
         # Add protein ray file
-        ray_file = self.getRayFile(rayDir)
+        ray_file = self.getRayFile(pocketDir)
         args += " -ray_file %s" % os.path.abspath(ray_file)
 
         # Shape only or with electrostatics charges
-        if not self.use_electro:
+        if not stage['electro']:
             args += " -darc_shape_only"
         else:
             #args += " -add_electrostatics"
@@ -326,7 +539,7 @@ class RosettaProtDARC(EMProtocol):
 
         # Minimize the best scoring DARC output model and give some metrics more and
         # Calculate ligand theta value during this minimization
-        if self.minimize_output.get():
+        if stage['minimize']:
             args += " -minimize_output_complex True"
             args += " -calculate_thetaLig True"
 
@@ -337,64 +550,468 @@ class RosettaProtDARC(EMProtocol):
         args += " -use_ligand_filename"
 
         # Use advanced options
-        args += " -num_runs %s" % self.num_runs.get()
-        args += " -num_particles %s" % self.num_particles.get()
+        nConfs, descriptors = countConformers(ligand_pdb), getParamsDescriptors(newLigandParams)
+        runs, particles = self.getPSOBudget(stage, descriptors, nConfs)
+        args += " -num_runs %s" % runs
+        args += " -num_particles %s" % particles
         args += " -missing_point_weight %s" % self.missing_weight.get()
         args += " -steric_weight %s" % self.steric_weight.get()
         args += " -extra_point_weight %s" % self.extra_weight.get()
 
-        if self.cseed.get():
-            args += " -run:constant_seed"
-            args += " -run:jran %s" % self.seed.get()
-
-        try:
-            # Run DARC w/wo GPU
-            if GPU_LIST == 0:
-                Plugin.runRosettaProgram(Plugin.getProgram(DARC), args, cwd=rayDir)
-            else:
-                args += " -gpu %s" % str(self.gpuList.get())
-                Plugin.runRosettaProgram(Plugin.getProgram(DARC_GPU), args, cwd=rayDir)
-        except:
+        # Files staged and retrieved when running in a node-local scratch directory
+        # Absolute paths: the inputs are relative to the project, not to rayDir (the cwd of DARC)
+        inputFiles = [os.path.abspath(inFile) for inFile in [pdb_file, ligand_pdb, newLigandPDB, newLigandParams,
+                                                               ray_file]]
+        if stage['electro']:
+            inputFiles.append(os.path.abspath(self.getAGDFile()))
+        scratchFiles = {'inputFiles': inputFiles, 'outputFiles': ['*.pdb'], 'appendFiles': ['darc_score.sc']}
+        pocketName = os.path.basename(pocketDir)
+        metrics = getMetricsKwargs(self, 'darcStep', ligand=self.getConfName(ligand), pocket=pocketName,
+                                   stage=stage['name'], runs=runs, particles=particles,
+                                   heavyAtoms=descriptors['heavyAtoms'], conformers=nConfs)
+
+        # Wait until the memory expected for this ligand fits in the budget
+        memKey = '{}_{}_{}'.format(self.getConfName(ligand), pocketName, stage['name'])
+        if stage['replicated'] and self.replicates.get() > 1:
+            success = self.runReplicates(ligand, args, rayDir, stage, scratchFiles, metrics, memKey, nConfs)
+        else:
+            if self.cseed.get():
+                args += " -run:constant_seed"
+                args += " -run:jran %s" % self.seed.get()
+            success = self.runDarc(args, rayDir, scratchFiles, metrics, memKey, nConfs)
+        if not success:
             compound_Error.append(ligand_pdb)
+        self.dockingFinished(ligand, pocketDir, rayDir, stage, startTime, not compound_Error)
+
+    def dockingFinished(self, ligand, pocketDir, rayDir, stage, startTime, success):
+        """ Record the progress of a docking (or minimization) and queue its pose for the output """
+        pocketName = os.path.basename(pocketDir)
+        self.getProgressTracker().stepFinished(self.getConfName(ligand), self.getProgressKey(pocketName, stage),
+                                               time.time() - startTime, success=success)
+        if success and stage['final']:
+            with OUTPUT_LOCK:
+                self._pendingOutputs = getattr(self, '_pendingOutputs', []) + [(ligand, rayDir)]
+
+    def runDarc(self, args, cwd, scratchFiles, metrics, memKey, nConfs):
+        """ Run DARC once a process slot of the protocol is free and the memory expected for the ligand fits in the
+        budget (the host slot, if any, is taken by runRosettaProgram). Returns whether it succeeded """
+        with self.getProcessSlots(), self.getMemoryGovernor().admit(memKey, nConfs) as memTicket:
+            try:
+                # Run DARC w/wo GPU
+                if GPU_LIST == 0:
+                    Plugin.runRosettaProgram(Plugin.getProgram(DARC), args, cwd=cwd,
+                                             monitor=memTicket.update, **scratchFiles, **metrics)
+                else:
+                    args += " -gpu %s" % str(self.gpuList.get())
+                    Plugin.runRosettaProgram(Plugin.getProgram(DARC_GPU), args, cwd=cwd,
+                                             monitor=memTicket.update, **scratchFiles, **metrics)
+            except Exception as e:
+                print('DARC failed: %s' % e)
+                return False
+        return True
+
+    def runReplicates(self, ligand, args, rayDir, stage, scratchFiles, metrics, memKey, nConfs):
+        """ Dock a ligand with consecutive seeds, in rounds of as many replicates as threads of the protocol (each
+        one waits for a free process slot, see runDarc), until a round does not improve its best score more than the
+        tolerance or the max replicates are reached. The poses and score of the best replicate are copied to rayDir
+        and the scores of all of them saved in replicates.json.
+        Returns whether any replicate succeeded """
+        ligName = self.getConfName(ligand)
+        baseSeed = self.seed.get() if self.cseed.get() else self.getLigandSeed(ligand)
+        repsDir = self.getReplicatesDir(rayDir, ligName)
+        scores, lock = {}, threading.Lock()
+
+        def runReplicate(k):
+            repDir = os.path.join(repsDir, 'rep_{}'.format(k))
+            os.makedirs(repDir, exist_ok=True)
+            repArgs = args + " -run:constant_seed -run:jran %s" % (baseSeed + k)
+            repMetrics = dict(metrics, tags=dict(metrics['tags'], replicate=k))
+            if self.runDarc(repArgs, repDir, scratchFiles, repMetrics, '{}_rep{}'.format(memKey, k), nConfs):
+                score = self.parseScores(repDir, minimized=stage['minimize']).get(ligName)
+                if score is not None:
+                    with lock:
+                        scores[k] = float(score)
+
+        nReps, bestScore, converged = 0, None, False
+        while nReps < self.replicates.get() and not converged:
+            roundSize = max(1, min(self.replicates.get() - nReps, self.getThreadSlots()))
+            threads = [threading.Thread(target=runReplicate, args=(k,)) for k in range(nReps, nReps + roundSize)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            nReps += roundSize
+
+            newBest = min(scores.values()) if scores else None
+            converged = bestScore is not None and newBest is not None and bestScore - newBest < self.replicateTol.get()
+            bestScore = newBest if newBest is not None else bestScore
+
+        if not scores:
+            return False
+        bestRep = min(scores, key=scores.get)
+        bestDir = os.path.join(repsDir, 'rep_{}'.format(bestRep))
+        for pFile in self.getLigandFiles(bestDir, minimized=stage['minimize']):
+            copyAtomic(os.path.join(bestDir, pFile), os.path.join(rayDir, pFile))
+        appendLocked(os.path.join(bestDir, 'darc_score.sc'), os.path.join(rayDir, 'darc_score.sc'))
+        with open(os.path.join(repsDir, 'replicates.json'), 'w') as f:
+            json.dump({'scores': scores, 'best': bestRep, 'seed': baseSeed + bestRep, 'converged': converged}, f,
+                      indent=1)
+        return True
+
+    def minimizePose(self, ligand, pocketDir, rayDir, stage):
+        """ Minimize (rosetta_scripts) the complex of the receptor with the pose of a ligand docked in the previous
+        stage. The output follows the one of the minimization of DARC: the minimized ligand pose in
+        mini_<pose file> and a line with its score (interface energy) in darc_score.sc.
+        Returns whether it succeeded """
+        ligName = self.getConfName(ligand)
+        prevDir = self.getStageDir(pocketDir, self.getPreviousStage(stage['name']))
+        poseFiles = [pFile for pFile in self.getLigandFiles(prevDir, minimized=False) if ligName in pFile]
+        if not poseFiles:
+            return False
+        minDir = os.path.join(rayDir, 'minimize', ligName)
+        os.makedirs(minDir, exist_ok=True)
+
+        # Complex of the receptor and the ligand residue of the pose, in its own chain
+        paramsFile = os.path.abspath(glob.glob(os.path.join(self.getParamsDir(ligand), "*.params"))[0])
+        poseLines = pdbio.readLines(os.path.join(prevDir, poseFiles[0]))
+        poseAtoms = pdbio.parseAtoms(poseLines[pdbio.isRecord(poseLines, 'ATOM', 'HETATM')], fields=('resName',))
+        ligandLines = poseAtoms['line'][poseAtoms['resName'] == self.getParamsCode(paramsFile).encode()]
+        pdbio.setColumn(ligandLines, 21, 22, MINIMIZE_CHAIN)
+        receptorLines = pdbio.readLines(self.getPDBReceptor())
+        complexFile = os.path.join(minDir, ligName + '_complex.pdb')
+        pdbio.writeLines(complexFile, np.concatenate([receptorLines[pdbio.isRecord(receptorLines, 'ATOM')],
+                                                      ligandLines]))
+
+        args = " -database %s" % Plugin.getDatabasePath()
+        args += " -in:file:s %s" % os.path.abspath(complexFile)
+        args += " -extra_res_fa %s" % paramsFile
+        args += " -parser:protocol %s" % os.path.abspath(self.getMinimizeXMLFile())
+        args += " -out:path:all %s" % os.path.abspath(minDir)
+        args += " -out:file:scorefile minimize.sc"
+        args += " -nstruct 1 -overwrite -ignore_unrecognized_res"
+        metrics = getMetricsKwargs(self, 'darcStep', ligand=ligName, pocket=os.path.basename(pocketDir),
+                                   stage=stage['name'])
+        memKey = '{}_{}_{}'.format(ligName, os.path.basename(pocketDir), stage['name'])
+        with self.getProcessSlots(), self.getMemoryGovernor().admit(memKey) as memTicket:
+            try:
+                Plugin.runRosettaProgram(Plugin.getProgram(ROSETTA_SCRIPTS), args, cwd=os.path.abspath(minDir),
+                                         monitor=memTicket.update, **metrics)
+            except Exception as e:
+                print('Minimization failed: %s' % e)
+                return False
+
+        scoreFile, outFiles = os.path.join(minDir, 'minimize.sc'), glob.glob(os.path.join(minDir, '*_0001.pdb'))
+        scores = readScores(scoreFile) if os.path.exists(scoreFile) else []
+        if not scores or not outFiles:
+            return False
+        score = scores[0].get('interface_delta_' + MINIMIZE_CHAIN, scores[0].get('total_score'))
+
+        outAtoms = pdbio.readAtoms(outFiles[0], fields=('chain',))
+        pdbio.writeLines(os.path.join(rayDir, 'mini_' + poseFiles[0]),
+                         outAtoms['line'][outAtoms['chain'] == MINIMIZE_CHAIN.encode()])
+        # Code of the DARC score lines: <receptor>_<ligand>_<n>
+        with open(os.path.join(minDir, 'darc_score.sc'), 'w') as f:
+            f.write('%s %s_%s_1 %.3f\n' % (poseFiles[0], self.getReceptorName(), ligName, score))
+        appendLocked(os.path.join(minDir, 'darc_score.sc'), os.path.join(rayDir, 'darc_score.sc'))
+        return True
+
+    @profileStep
+    def selectStep(self, stageName):
+        """ Select in each pocket the ligands of a stage of the screen that go on to the next one and save the
+        poses of the stage in its own output set """
+        stage, nextStage = self.getStage(stageName), self.getNextStage(stageName)
+        selection = {}
+        for pocketDir in self.getAllPocketDirs():
+            scoresDic = self.parseScores(self.getStageDir(pocketDir, stage), minimized=stage['minimize'])
+            ranked = sorted(scoresDic, key=lambda lig: float(scoresDic[lig]))
+            selectMode, selectValue = stage['select']
+            if selectMode == 'fraction':
+                selected = ranked[:int(math.ceil(selectValue * len(ranked)))]
+            elif selectMode == 'top':
+                selected = ranked[:selectValue]
+            else:
+                selected = [lig for lig in ranked if float(scoresDic[lig]) <= selectValue]
+            selection[os.path.basename(pocketDir)] = selected
+
+        with open(self.getSelectionFile(stageName), 'w') as f:
+            json.dump(selection, f, indent=1)
+        self.getProgressTracker().setTotals({self.getProgressKey(pocketName, nextStage): len(selected)
+                                             for pocketName, selected in selection.items()})
+        self.createStageOutput(stage)
+
+    def createStageOutput(self, stage):
+        """ Output set with the poses of an intermediate stage of the screen """
+        setFile = self._getPath('outputSmallMolecules_{}.sqlite'.format(stage['name']))
+        cleanPath(setFile)
+        outputSet = SetOfSmallMolecules(filename=setFile)
+        outputSet.setDocked(True)
+        outputSet.proteinFile.set(self.getOriginalReceptorFile())
 
+        mols = self.loadInputMolecules()[0]
+        for pocketDir in self.getAllPocketDirs():
+            stageDir = self.getStageDir(pocketDir, stage)
+            scoresDic = self.parseScores(stageDir, minimized=stage['minimize'])
+            pdbFiles = self.getLigandFiles(stageDir, minimized=stage['minimize'])
+            for mol in mols:
+                newMol = self.buildOutputMolecule(mol, stageDir, scoresDic, pdbFiles, gridId=self.getGridId(pocketDir),
+                                                  minimized=stage['minimize'], prefix=stage['name'] + '_')
+                if newMol is not None:
+                    outputSet.append(newMol)
+
+        with OUTPUT_LOCK:
+            self._defineOutputs(**{'outputSmallMolecules' + stage['name'].capitalize(): outputSet})
+            self._defineSourceRelation(self.inputSmallMolecules, outputSet)
+
+    @profileStep
     def createOutputStep(self):
-        """Create a set of darc score for each small molecule and ID"""
-        outputSet = SetOfSmallMolecules().create(outputPath=self._getPath())
-
-        outDirs = self.getAllPocketDirs()
-        for outDir in outDirs:
-            savedMols = []
-            scoresDic = self.parseScores(outDir)
-            gridId = self.getGridId(outDir)
-
-            pdbFiles = self.getLigandFiles(outDir)
-            for mol in self.inputSmallMolecules.get():
-                molName, molBase = mol.getUniqueName(), self.getConfName(mol)
-                for pFile in pdbFiles:
-                    if molBase in pFile and not molBase in savedMols:
-                        if not self.minimize_output or 'mini_' in pFile:
-                          newMol = SmallMolecule()
-                          newMol.copy(mol, copyId=False)
-                          newMol.setGridId(gridId)
-                          newMol.setMolClass('Rosetta')
-                          newMol.setDockId(self.getObjId())
-                          newMol._energy = pwobj.Float(scoresDic[molBase])
-
-                          newPDBFile = self._getPath(newMol.getUniqueName() + '_1.pdb')
-                          shutil.copy(os.path.join(outDir, pFile), newPDBFile)
-                          newMol.poseFile.set(newPDBFile)
-                          newMol.setPoseId(1)
-                          outputSet.append(newMol)
-                          savedMols.append(molBase)
-
+        """Create a set of darc score for each small molecule and ID.
+        The dockings already streamed to the output are kept and the output set is closed"""
+        results = []
+        mols = self.loadInputMolecules()[0]
+        for outDir in self.getAllPocketDirs():
+            for mol in mols:
+                results.append((mol, outDir))
+
+        with OUTPUT_LOCK:
+            self._pendingOutputs = []
+            self.updateOutputMolecules(results, streamState=pwobj.Set.STREAM_CLOSED)
+        updateCalibration(getMetricsFile(self), Plugin.getCalibrationFile())
+
+    def _stepsCheck(self):
+        self._checkNewInput()
+        self.insertReadyDockings()
+        self._checkNewOutput()
+
+    def _checkNewInput(self):
+        """ While the input set is streaming, insert the params steps of the new molecules, whose docking steps
+        are inserted once their params are generated """
+        if getattr(self, '_inputClosed', True) or \
+                time.time() - getattr(self, '_lastInputCheck', 0) < INPUT_CHECK_INTERVAL:
+            return
+        self._lastInputCheck = time.time()
+
+        mols, self._inputClosed = self.loadInputMolecules()
+        newIds = [mol.getObjId() for mol in mols if mol.getObjId() not in self._insertedMolIds]
+        if newIds:
+            self.insertParamsStep(newIds, {mol.getObjId(): mol for mol in mols})
+            self.updateSteps()
+
+    def insertParamsStep(self, molIds, molsDic, resumed=False):
+        """ Insert the params step of a batch of new molecules, whose docking steps are inserted once it finishes """
+        listName = 'molfile_list_{}.txt'.format(max(molIds))
+        # The params generations run one after the other, since they share the names of their temporary files
+        pId = self._insertFunctionStep('paramsStep', molIds, listName, prerequisites=[self._lastParamsStep])
+        self._pendingDockings.append((listName, pId, [molsDic[molId] for molId in molIds if molId in molsDic]))
+        self._lastParamsStep = pId
+        self._insertedMolIds.update(molIds)
+        if not resumed:
+            self.addManifestEntry({'event': 'params', 'batch': listName, 'molIds': molIds})
+            self.getProgressTracker().addTotals(self.getProgressTotals(len(molIds)))
+
+    def insertReadyDockings(self):
+        """ Insert the docking steps of the pending molecules whose params step is finished, so they are sorted by
+        the cost predicted from their params. Once the input is closed and all of them are inserted, the selection
+        and output steps are released. The dockings of each later stage are inserted once the selection of the
+        previous one is finished, and the output step is released once those of the last stage are inserted """
+        pending = getattr(self, '_pendingDockings', [])
+        ready = [batch for batch in pending if self._steps[batch[1] - 1].isFinished()]
+        for batch in ready:
+            self.insertBatchDockings(batch)
+
+        stages = self.getStages()
+        selected = []
+        for stage in stages[len(self._insertedStages):]:
+            if not self._steps[self._selectSteps[self._insertedStages[-1]] - 1].isFinished():
+                break
+            self.insertStageDockings(stage)
+            selected.append(stage)
+
+        released = False
+        if self._inputClosed and not pending:
+            outputStep, allStages = self._steps[self._outputStep - 1], len(self._insertedStages) == len(stages)
+            for step in self._steps:
+                if step.isWaiting() and (allStages or step is not outputStep):
+                    step.setStatus(STATUS_NEW)
+                    released = True
+        if ready or selected or released:
+            self.updateSteps()
+
+    def insertBatchDockings(self, batch, resumed=False):
+        batchName, paramsStep, mols = batch
+        darcSteps = self._insertDarcSteps(batchName, mols, prerequisites=[paramsStep] + self._raysSteps)
+        self._steps[self._outputStep - 1].addPrerequisites(*darcSteps)
+        self._pendingDockings.remove(batch)
+        if not resumed:
+            self.addManifestEntry({'event': 'dockings', 'batch': batchName})
+
+    def _checkNewOutput(self):
+        """ Append the poses of the finished dockings to the output set in batches, so downstream protocols can
+        start before the whole screen is finished """
+        with OUTPUT_LOCK:
+            pending = getattr(self, '_pendingOutputs', [])
+            if not pending or (len(pending) < STREAM_BATCH and
+                               time.time() - getattr(self, '_lastOutputUpdate', 0) < STREAM_INTERVAL):
+                return
+            self._pendingOutputs = []
+            self.updateOutputMolecules(pending)
+
+    def updateOutputMolecules(self, results, streamState=pwobj.Set.STREAM_OPEN):
+        """ Append to the output set the docked poses of the (ligand, pocket directory) pairs not yet in it """
+        outputSet, savedKeys = self._loadOutputSet()
+        isNew = not hasattr(self, 'outputSmallMolecules')
+
+        dirsInfo = {}
+        for mol, outDir in results:
+            key = (self.getConfName(mol), str(self.getGridId(outDir)))
+            if key in savedKeys:
+                continue
+            if outDir not in dirsInfo:
+                dirsInfo[outDir] = (self.getStreamedScores(outDir), self.getLigandFiles(outDir))
+
+            newMol = self.buildOutputMolecule(mol, outDir, *dirsInfo[outDir])
+            if newMol is not None:
+                outputSet.append(newMol)
+                savedKeys.add(key)
+
+        self._updateOutputSet('outputSmallMolecules', outputSet, streamState)
+        if isNew:
+            self._defineSourceRelation(self.inputSmallMolecules, outputSet)
+        self._lastOutputUpdate = time.time()
+
+    def _loadOutputSet(self):
+        """ Open the output set (creating it if needed) for appending. Returns the set and the keys
+        (ligand, gridId) of the molecules already in it, kept in memory and only read from the set the first time
+        (i.e: when a run is resumed) """
+        setFile = self._getPath('outputSmallMolecules.sqlite')
+        loadKeys = getattr(self, '_savedKeys', None) is None
+        if loadKeys:
+            self._savedKeys = set()
+        if os.path.exists(setFile):
+            outputSet = SetOfSmallMolecules(filename=setFile)
+            outputSet.loadAllProperties()
+            if loadKeys:
+                for mol in outputSet:
+                    self._savedKeys.add((self.getConfName(mol), str(mol.getGridId())))
+            outputSet.enableAppend()
+        else:
+            outputSet = SetOfSmallMolecules(filename=setFile)
+            outputSet.setDocked(True)
+            outputSet.proteinFile.set(self.getOriginalReceptorFile())
+        return outputSet, self._savedKeys
+
+    def getStreamedScores(self, outDir):
+        """ Scores of the dockings in a pocket directory, parsing only the lines appended to its score file since
+        the previous call """
+        if getattr(self, '_streamedScores', None) is None:
+            self._streamedScores = {}
+        offset, scoresDic = self._streamedScores.get(outDir, (0, {}))
+        scoreFile = os.path.join(outDir, 'darc_score.sc')
+        if os.path.exists(scoreFile):
+            with open(scoreFile, 'rb') as fIn:
+                fIn.seek(offset)
+                content = fIn.read()
+            # Only complete lines, the rest is read in the next call
+            end = content.rfind(b'\n') + 1
+            for line in content[:end].decode().splitlines():
+                if line.strip():
+                    ligCode, score = self.parseScoreLine(line, self.minimize_output.get())
+                    scoresDic[ligCode] = score
+            offset += end
+        self._streamedScores[outDir] = (offset, scoresDic)
+        return scoresDic
 
-        outputSet.setDocked(True)
-        outputSet.proteinFile.set(self.getOriginalReceptorFile())
-        self._defineOutputs(outputSmallMolecules=outputSet)
-        self._defineSourceRelation(self.inputSmallMolecules, outputSet)
+    def buildOutputMolecule(self, mol, outDir, scoresDic, pdbFiles, gridId=None, minimized=None, prefix=''):
+        """ Output small molecule with the DARC pose of mol in a pocket (or stage) directory.
+        None if it was not docked """
+        gridId = self.getGridId(outDir) if gridId is None else gridId
+        minimized = self.minimize_output.get() if minimized is None else minimized
+        molBase = self.getConfName(mol)
+        for pFile in pdbFiles:
+            if molBase in pFile and molBase in scoresDic:
+                if not minimized or 'mini_' in pFile:
+                    newMol = SmallMolecule()
+                    newMol.copy(mol, copyId=False)
+                    newMol.setGridId(gridId)
+                    newMol.setMolClass('Rosetta')
+                    newMol.setDockId(self.getObjId())
+                    newMol._energy = pwobj.Float(scoresDic[molBase])
+                    repInfo = self.getReplicatesInfo(outDir, molBase)
+                    if repInfo is not None:
+                        repScores = list(repInfo['scores'].values())
+                        newMol._replicates = pwobj.Integer(len(repScores))
+                        newMol._scoreSpread = pwobj.Float(max(repScores) - min(repScores))
+
+                    newPDBFile = self._getPath(prefix + newMol.getUniqueName() + '_1.pdb')
+                    shutil.copy(os.path.join(outDir, pFile), newPDBFile)
+                    newMol.poseFile.set(newPDBFile)
+                    newMol.setPoseId(1)
+                    return newMol
+        return None
 
+    # --------------------------- INFO functions -----------------------------------
+    def _summary(self):
+        summary = []
+        records = readRecords(getMetricsFile(self))
+        if not self.isFinished():
+            estimate = readEstimate(self.getEstimateFile())
+            if estimate is None and self.inputSmallMolecules.get() is not None and \
+                    (self.fromReceptor != 1 or self.inputStructROIs.get() is not None):
+                # Not launched yet, or its params are not generated: estimated from the input files
+                estimate = self.getEstimate(prepared=False)
+            if estimate is not None:
+                summary += formatEstimate(estimate)
+        summary += formatStatus(loadStatus(self.getProgressFile()))
+        summary += self.getFunnelSummary(records)
+        if os.path.exists(self._getExtraPath()):
+            summary += self.getReplicatesSummary()
+        summary += self.getTailSummary(records)
+        summary += formatSummary(records)
+        return summary
+
+    def _validate(self):
+        errors = []
+        if self.funnelMode.get() and self.funnelSelection.get() == 0 and not 0 < self.funnelFraction.get() <= 1:
+            errors.append('The fraction of ligands selected in the screening funnel must be in (0, 1]')
+        if self.adaptiveBudget.get() and (self.minRuns.get() > self.maxRuns.get() or
+                                          self.minParticles.get() > self.maxParticles.get()):
+            errors.append('The minimum PSO runs and particles cannot be greater than the maximum ones')
+        return errors
+
+    def getFunnelSummary(self, records):
+        """ CPU used by each stage and saved compared to a single full docking pass, estimated from the mean CPU of
+        the dockings in the last docking stage. The minimizations of the top ligands are reported apart """
+        stages = self.getStages()
+        stagesCPU = {stage['name']: [] for stage in stages}
+        for rec in records:
+            if rec.get('step') == 'darcStep' and rec.get('stage') in stagesCPU:
+                stagesCPU[rec['stage']].append(rec.get('user', 0) + rec.get('sys', 0))
+        if len(stages) < 2:
+            return []
+
+        summary = ['Screen stages: ' + ', '.join('%s %d %s (%.2f CPU h)' %
+                                                 (stage['name'], len(stagesCPU[stage['name']]),
+                                                  'dockings' if stage['dock'] else 'minimizations',
+                                                  sum(stagesCPU[stage['name']]) / 3600) for stage in stages)]
+        dockStages = [stage['name'] for stage in stages if stage['dock']]
+        fullCPU = stagesCPU[dockStages[-1]]
+        if len(dockStages) > 1 and fullCPU:
+            usedCPU = sum(sum(stagesCPU[stageName]) for stageName in dockStages)
+            fullPassCPU = len(stagesCPU[dockStages[0]]) * sum(fullCPU) / len(fullCPU)
+            summary.append('Docking CPU hours saved compared to a single full pass: %.2f (%.2f estimated for the '
+                           'full pass)' % ((fullPassCPU - usedCPU) / 3600, fullPassCPU / 3600))
+        return summary
 
 ############################## UTILS ########################
+    def loadInputMolecules(self):
+        """ Read the input molecules from their set file, which may be growing if it is streaming.
+        Returns the molecules and whether the input set is closed """
+        inputSet = SetOfSmallMolecules(filename=self.inputSmallMolecules.get().getFileName())
+        inputSet.loadAllProperties()
+        mols = [mol.clone() for mol in inputSet]
+        closed = inputSet.isStreamClosed()
+        inputSet.close()
+        return mols, closed
+
     def getConfName(self, mol):
         return mol.getUniqueName(grid=False, dock=False, pose=False)
 
@@ -407,7 +1024,7 @@ class RosettaProtDARC(EMProtocol):
         args = "-protein %s" % os.path.basename(pdb_file)
 
         # Add Database path
-        database_path = os.path.join(Plugin.getHome(), ROSETTA_DATABASE_PATH)
+        database_path = Plugin.getDatabasePath()
         args += " -database %s" % database_path
 
         # Add the specific residue that will be the center of ray generation (REQUIRED)
@@ -453,6 +1070,279 @@ class RosettaProtDARC(EMProtocol):
         return args
 
 
+    def getRaysMetrics(self, rayDir):
+        return getMetricsKwargs(self, 'generateRaysStep', pocket=os.path.basename(rayDir))
+
+    def getMemoryGovernor(self):
+        """ Memory admission control shared by the darcSteps running in this protocol """
+        with STATE_LOCK:
+            if getattr(self, '_memoryGovernor', None) is None:
+                budget = self.memoryBudget.get() * GB if (self.memoryBudget.get() or 0) > 0 else None
+                self._memoryGovernor = MemoryGovernor(budget, defaultEstimate=self.ligandMemory.get() * GB)
+        return self._memoryGovernor
+
+    def getThreadSlots(self):
+        """ Dockings running at the same time: the steps are run by numberOfThreads - 1 threads """
+        return max(1, self.numberOfThreads.get() - 1)
+
+    def getProcessSlots(self):
+        """ Semaphore of the Rosetta processes of the protocol, as many as step threads, so the replicates of a
+        docking do not run on top of the other dockings """
+        with STATE_LOCK:
+            if getattr(self, '_processSlots', None) is None:
+                self._processSlots = threading.BoundedSemaphore(self.getThreadSlots())
+        return self._processSlots
+
+    def getProgressFile(self):
+        return self._getExtraPath('progress.json')
+
+    def getProgressTracker(self):
+        """ Progress of the darcSteps of this protocol, written incrementally in extra/progress.json """
+        with STATE_LOCK:
+            if getattr(self, '_progressTracker', None) is None:
+                self._progressTracker = ProgressTracker(self.getProgressFile())
+        return self._progressTracker
+
+    def getPocketNames(self):
+        if self.fromReceptor == 1:
+            return [self.getPocketName(pocket) for pocket in self.inputStructROIs.get()]
+        return [self.getPocketName()]
+
+    def getStages(self):
+        """ Docking stages of the screen. Each stage docks the ligands selected from the previous one (with the
+        'select' criterion of the previous stage) and only the last one runs in the pocket directory and produces
+        the main output """
+        stages = []
+        if self.funnelMode.get():
+            select = ('fraction', self.funnelFraction.get()) if self.funnelSelection.get() == 0 else \
+                ('threshold', self.funnelThreshold.get())
+            stages.append({'name': 'screen', 'runs': self.screenRuns.get(), 'particles': self.screenParticles.get(),
+                           'electro': self.use_electro.get() and self.screenElectro.get(), 'minimize': False,
+                           'dock': True, 'adaptive': False, 'select': select})
+
+        fullStage = {'name': 'full', 'runs': self.num_runs.get(), 'particles': self.num_particles.get(),
+                     'electro': self.use_electro.get(), 'minimize': self.minimize_output.get(), 'dock': True,
+                     'adaptive': self.adaptiveBudget.get()}
+        if self.minimize_output.get() and self.minimizeTopK.get() > 0:
+            # Minimization of the poses of the top ligands, without docking them again
+            stages.append(dict(fullStage, minimize=False, select=('top', self.minimizeTopK.get())))
+            fullStage = dict(fullStage, name='minimize', dock=False, runs=0, particles=0, adaptive=False)
+        stages.append(fullStage)
+
+        dockStages = [stage for stage in stages if stage['dock']]
+        for stage in stages:
+            stage['final'] = stage is stages[-1]
+            # The replicates run in the last docking stage
+            stage['replicated'] = stage is dockStages[-1]
+        return stages
+
+    def getStage(self, stageName=None):
+        stages = self.getStages()
+        for stage in stages:
+            if stage['name'] == stageName:
+                return stage
+        return stages[-1]
+
+    def getNextStage(self, stageName):
+        stages = self.getStages()
+        names = [stage['name'] for stage in stages]
+        return stages[names.index(stageName) + 1]
+
+    def getPreviousStage(self, stageName):
+        stages = self.getStages()
+        names = [stage['name'] for stage in stages]
+        return stages[names.index(stageName) - 1]
+
+    def getMinimizeXMLFile(self):
+        """ rosetta_scripts protocol of the minimization of the top ligands, written the first time """
+        xmlFile = self._getExtraPath('minimize_complex.xml')
+        with STATE_LOCK:
+            if not os.path.exists(xmlFile):
+                with open(xmlFile, 'w') as f:
+                    f.write(minimizeComplexXML)
+        return xmlFile
+
+    def getParamsCode(self, paramsFile):
+        """ Residue name (3 letters) of a ligand in its params file """
+        code = None
+        with open(paramsFile) as f:
+            for line in f:
+                if line.startswith('IO_STRING'):
+                    return line.split()[1]
+                elif line.startswith('NAME'):
+                    code = line.split()[1]
+        return code
+
+    def getPSOBudget(self, stage, descriptors, nConfs):
+        """ PSO runs and particles of a docking. In adaptive mode, they are scaled with the complexity of the ligand
+        (descriptors from its params file) between the min and max values """
+        if not stage['adaptive']:
+            return stage['runs'], stage['particles']
+        complexity = getComplexity(conformers=nConfs, **descriptors)
+        runs = self.minRuns.get() + complexity * (self.maxRuns.get() - self.minRuns.get())
+        particles = self.minParticles.get() + complexity * (self.maxParticles.get() - self.minParticles.get())
+        return int(round(runs)), int(round(particles))
+
+    def getReplicatesDir(self, rayDir, ligName):
+        return os.path.join(rayDir, 'replicates', ligName)
+
+    def getReplicatesInfo(self, rayDir, ligName):
+        """ Scores of the replicates of a ligand and the best of them. None if it was not replicated """
+        repsFile = os.path.join(self.getReplicatesDir(rayDir, ligName), 'replicates.json')
+        if not os.path.exists(repsFile):
+            return None
+        with open(repsFile) as f:
+            return json.load(f)
+
+    def getReplicatesSummary(self):
+        """ Number of replicates and spread (max - min) of the scores of the replicated ligands """
+        nReps, spreads = [], []
+        for pocketDir in self.getAllPocketDirs():
+            for repsFile in glob.glob(os.path.join(self.getReplicatesDir(pocketDir, '*'), 'replicates.json')):
+                with open(repsFile) as f:
+                    repScores = list(json.load(f)['scores'].values())
+                nReps.append(len(repScores))
+                spreads.append(max(repScores) - min(repScores))
+        if not spreads:
+            return []
+        return ['Replicates: %d ligand-pocket pairs, %.1f replicates on average. Score spread: mean %.3f, max %.3f' %
+                (len(spreads), sum(nReps) / len(nReps), sum(spreads) / len(spreads), max(spreads))]
+
+    def getCostModel(self):
+        """ Cost model of the dockings, fitted to the ones already measured in this run """
+        records = [rec for rec in readRecords(getMetricsFile(self)) if rec.get('step') == 'darcStep']
+        return CostModel().fit(records)
+
+    def getCostFactor(self, stage):
+        """ Relative cost of the docking flags """
+        factor = SEARCH_CONFORMERS_FACTOR if self.search_conformers.get() else 1.0
+        return factor * MINIMIZE_FACTOR if stage['minimize'] else factor
+
+    def sortByCost(self, batchName, mols, stage):
+        """ Molecules of a batch sorted by the predicted cost of their docking in a stage, most expensive first.
+        The order is saved, so the docking steps of a resumed run are inserted as in the previous execution """
+        orderFile = self._getExtraPath('docking_order.json')
+        orders = {}
+        if os.path.exists(orderFile):
+            with open(orderFile) as f:
+                orders = json.load(f)
+
+        if batchName not in orders:
+            model, factor = self.getCostModel(), self.getCostFactor(stage)
+            costs = {}
+            for mol in mols:
+                descriptors = self.getLigandDescriptors(mol) or {'heavyAtoms': 0, 'conformers': 1}
+                costs[mol.getObjId()] = model.predict(runs=stage['runs'], particles=stage['particles'],
+                                                      factor=factor, **descriptors)
+            orders[batchName] = sorted(costs, key=costs.get, reverse=True)
+            with open(orderFile, 'w') as f:
+                json.dump(orders, f)
+
+        positions = {molId: i for i, molId in enumerate(orders[batchName])}
+        return sorted(mols, key=lambda mol: positions.get(mol.getObjId(), len(positions)))
+
+    def getStepsManifestFile(self):
+        return self._getExtraPath('steps_manifest.json')
+
+    def loadStepsManifest(self):
+        """ Batches of molecules whose params and docking steps were inserted, in the order of the insertions """
+        manifestFile = self.getStepsManifestFile()
+        if not os.path.exists(manifestFile):
+            return []
+        with open(manifestFile) as f:
+            return json.load(f)
+
+    def addManifestEntry(self, entry):
+        manifest = self.loadStepsManifest() + [entry]
+        tmpFile = self.getStepsManifestFile() + '.tmp'
+        with open(tmpFile, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmpFile, self.getStepsManifestFile())
+
+    def getLigandDescriptors(self, mol):
+        """ Heavy atoms and conformers of a ligand, read from its params and Rosetta conformers files as darcStep
+        records them, so the cost model is fitted and used on the same descriptors. None if its params are not
+        generated yet """
+        paramsDir = self._getExtraPath('params', self.getConfName(mol))
+        paramsFiles = glob.glob(os.path.join(paramsDir, '*.params'))
+        confFile = self.getRosettaConfFile(paramsDir, mol) if paramsFiles else None
+        if confFile is None:
+            return None
+        return {'heavyAtoms': getParamsDescriptors(paramsFiles[0])['heavyAtoms'],
+                'conformers': countConformers(confFile)}
+
+    def getEstimate(self, prepared=True):
+        """ Estimate of the cost of the screen (CPU and wall hours, peak memory and disk), from the params of a sample
+        of the ligands (or their input files if they are not prepared yet) and calibrated with the records of previous
+        runs. The selections of a funnel by score threshold and the replicates are counted as their upper bound. The
+        minimizations of the top ligands are not counted, since they are cheap compared to the dockings """
+        inputSet = self.inputSmallMolecules.get()
+        getDescriptors = self.getLigandDescriptors if prepared else \
+            lambda mol: getMoleculeDescriptors(mol.getFileName())
+        descriptors = [getDescriptors(mol) for mol in inputSet.iterItems(limit=ESTIMATE_SAMPLE)]
+        descriptors = [desc for desc in descriptors if desc is not None]
+        nPockets = len(self.getPocketNames())
+        nDockings, dockings = len(inputSet) * nPockets, []
+        for stage in self.getStages():
+            runs, particles = stage['runs'], stage['particles']
+            if stage['adaptive']:
+                runs = (self.minRuns.get() + self.maxRuns.get()) / 2
+                particles = (self.minParticles.get() + self.maxParticles.get()) / 2
+            replicates = self.replicates.get() if stage['replicated'] else 1
+            dockings.append((nDockings * replicates, runs, particles, self.getCostFactor(stage)))
+
+            selectMode, selectValue = stage.get('select', (None, None))
+            if selectMode == 'fraction':
+                nDockings = int(math.ceil(selectValue * nDockings))
+            elif selectMode == 'top':
+                nDockings = min(nDockings, selectValue * nPockets)
+
+        threads = self.getThreadSlots()
+        return estimateDarc(descriptors, dockings, threads, loadCalibration(Plugin.getCalibrationFile(), 'darcStep'))
+
+    def getEstimateFile(self):
+        return self._getExtraPath('estimate.json')
+
+    def getTailSummary(self, records):
+        """ Idle cores at the end of the screen, after the last docking started """
+        dockRecords = [rec for rec in records if rec.get('step') == 'darcStep']
+        slots = self.getThreadSlots()
+        tailIdle = getTailIdle(dockRecords, slots)
+        if tailIdle is None or not tailIdle['tail']:
+            return []
+        return ['Tail of the screen: %.1f min from the start of the last docking, with %.1f of %d threads idle on '
+                'average (%.2f idle core-hours)' % (tailIdle['tail'] / 60, tailIdle['idle'] / tailIdle['tail'],
+                                                    slots, tailIdle['idle'] / 3600)]
+
+    def getLigandSeed(self, ligand):
+        """ Deterministic seed of a ligand, derived from its name """
+        return zlib.crc32(self.getConfName(ligand).encode()) % 10 ** 8 + 1
+
+    def getStageDir(self, pocketDir, stage):
+        return pocketDir if stage['final'] else os.path.join(pocketDir, 'stage_{}'.format(stage['name']))
+
+    def getSelectionFile(self, stageName):
+        return self._getExtraPath('selection_{}.json'.format(stageName))
+
+    def getProgressKey(self, pocketName, stage):
+        return pocketName if stage['final'] else '{} ({})'.format(pocketName, stage['name'])
+
+    def getProgressTotals(self, nMols):
+        """ Number of dockings of nMols ligands in each pocket and stage. The later stages are updated when their
+        ligands are selected """
+        return {self.getProgressKey(pocketName, stage): nMols
+                for pocketName in self.getPocketNames() for stage in self.getStages()}
+
+    def getPocketName(self, pocket=None):
+        return 'pocket_{}'.format(pocket.getObjId()) if pocket is not None else 'pocket_1'
+
+    def getRaysScratchFiles(self):
+        """ Inputs and outputs of make_ray_files, used when running in a node-local scratch directory """
+        inputFiles = [os.path.basename(self.getOriginalReceptorFile())]
+        if self.use_electro:
+            inputFiles.append(os.path.abspath(self.getAGDFile()))
+        return {'inputFiles': inputFiles, 'outputFiles': ['ray_*']}
+
     def switchResidueFormat(self, residue):
       '''From A_100 to 100:A'''
       return '{}:{}'.format(residue.split('.')[1], residue.split('.')[0])
@@ -503,12 +1393,13 @@ class RosettaProtDARC(EMProtocol):
         return outDir.split('_')[-1]
 
 
-    def getLigandFiles(self, outDir):
+    def getLigandFiles(self, outDir, minimized=None):
+        minimized = self.minimize_output.get() if minimized is None else minimized
         lFiles = []
         for file in os.listdir(outDir):
-            if not self.minimize_output.get() and file.startswith('LIGAND_'):
+            if not minimized and file.startswith('LIGAND_'):
                 lFiles.append(file)
-            elif self.minimize_output.get() and file.startswith('mini_LIGAND'):
+            elif minimized and file.startswith('mini_LIGAND'):
                 lFiles.append(file)
         return lFiles
 
@@ -537,7 +1428,9 @@ class RosettaProtDARC(EMProtocol):
         confName, ext = os.path.splitext(inFile)
         oFile = inFile.replace(ext[1:], outExt)
         args = ' -i{} {} -o{} -O {}'.format(ext[1:], inFile, outExt, oFile)
-        runOpenBabel(protocol=self, args=args, cwd=outDir)
+        tags = getProtocolTags(self, 'convertInputStep', ligand=os.path.basename(inFile))
+        with measureChildren(getMetricsFile(self), 'obabel', tags):
+            runOpenBabel(protocol=self, args=args, cwd=outDir)
         return os.path.join(outDir, oFile)
 
     def convertConformersFile(self, confFile, outExt='mol2'):
@@ -565,7 +1458,9 @@ class RosettaProtDARC(EMProtocol):
             pdbFile = os.path.abspath(self._getTmpPath('pdbInput.pdb'))
             if not os.path.exists(pdbFile):
                 args = ' -i{} {} -opdb -O {}'.format(inExt[1:], os.path.abspath(strFile), pdbFile)
-                runOpenBabel(protocol=self, args=args, cwd=self._getTmpPath())
+                tags = getProtocolTags(self, 'getPDBReceptor')
+                with measureChildren(getMetricsFile(self), 'obabel', tags):
+                    runOpenBabel(protocol=self, args=args, cwd=self._getTmpPath())
         else:
             pdbFile = strFile
         return pdbFile
@@ -586,19 +1481,27 @@ class RosettaProtDARC(EMProtocol):
     def getAGDFile(self):
         return self.agdGrid.getFileName()
 
-    def parseScores(self, outDir):
+    def parseScores(self, outDir, minimized=None):
+        minimized = self.minimize_output.get() if minimized is None else minimized
         scoresDic = {}
+        if not os.path.exists(os.path.join(outDir, 'darc_score.sc')):
+            return scoresDic
         with open(os.path.join(outDir, 'darc_score.sc')) as fIn:
             for line in fIn:
-                if not self.minimize_output:
-                    code, score = line.split()[0], line.split()[1]
-                else:
-                    code, score = line.split()[1], line.split()[2]
-                ligCode = code[len(self.getReceptorName())+1:]
-                ligCode = '_'.join(ligCode.split('_')[:-1])
+                ligCode, score = self.parseScoreLine(line, minimized)
                 scoresDic[ligCode] = score
         return scoresDic
 
+    def parseScoreLine(self, line, minimized):
+        """ Ligand and score of a line of darc_score.sc """
+        if not minimized:
+            code, score = line.split()[0], line.split()[1]
+        else:
+            code, score = line.split()[1], line.split()[2]
+        ligCode = code[len(self.getReceptorName())+1:]
+        ligCode = '_'.join(ligCode.split('_')[:-1])
+        return ligCode, score
+
     def getRosettaConfFile(self, dir, ligand):
         for file in os.listdir(dir):
             if '.pdb' in file and not ligand.getMolName() in file:
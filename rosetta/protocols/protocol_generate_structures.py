@@ -34,19 +34,67 @@ Adaptation of shared code from Gabriel Lander
 The output will be a file named ray_<PDBname>_0001_<TargetResidue>.txt
 """
 
-import os, sys
+import os, sys, re, json, glob, shutil, time
+import numpy as np
 
 from pyworkflow.utils import Message
 from pyworkflow.protocol import params
+from pyworkflow.object import String, Float, Integer
 from pwem.protocols import EMProtocol
 from pwem.convert.atom_struct import toPdb
-from pwem.objects import SetOfAtomStructs, AtomStruct
+from pwem.objects import SetOfAtomStructs, AtomStruct, Transform
 
 from pwem.emlib.image import ImageHandler
 from pwem.convert import Ccp4Header
 
 from rosetta import Plugin
 from rosetta.constants import *
+from rosetta.utils.profiling import profileStep, addProfilingParams
+from rosetta.utils.fingerprint import hashFiles, hashText
+from rosetta.utils.maps import readMapHeader, getCropBox, cropMap
+from rosetta.utils import pdbio
+from rosetta.utils.silent import writeIndex, readIndex, copyModels, readScores, getScoreTerms
+from rosetta.utils.density import mapCorrelations
+from rosetta.utils.telemetry import getMetricsKwargs, getMetricsFile, readRecords, formatSummary
+from rosetta.utils.estimator import updateCalibration, loadCalibration, estimateStructures, formatEstimate, \
+    writeEstimate, readEstimate, countResidues
+
+
+# CartesianSampler rounds of the refinement, from the least to the most strict cutoff
+SAMPLERS = ['cen5_50', 'cen5_60', 'cen5_70', 'cen5_80']
+MAX_NCYCLES, MIN_NCYCLES, CALIBRATION_CYCLES = 200, 20, 20
+# Calibration passes: name, movers added to the protocol and settings. The relax passes run it twice (after cenmin
+# and the final one, the ones after the removed CartesianSampler rounds are also removed)
+CALIBRATION_PASSES = [
+    ('setup', ['setupdens', 'loaddens', 'cenmin'], {'relax': 'FastRelax', 'rounds': 0, 'ncycles': 0}),
+    ('fastrelax', ['setupdens', 'loaddens', 'cenmin', 'relaxcart'], {'relax': 'FastRelax', 'rounds': 0, 'ncycles': 0}),
+    ('localrelax', ['setupdens', 'loaddens', 'cenmin', 'relaxcart'], {'relax': 'LocalRelax', 'rounds': 0, 'ncycles': 0}),
+    ('sampler', ['setupdens', 'loaddens', 'cenmin', 'cen5_50'],
+     {'relax': 'FastRelax', 'rounds': 1, 'ncycles': CALIBRATION_CYCLES})]
+
+
+def getRelaxTypes(residues):
+    """ Relax types of the refinement of a structure, in order of preference. FastRelax only up to 1000 residues """
+    return ['FastRelax', 'LocalRelax'] if residues <= 1000 else ['LocalRelax']
+
+
+def chooseRefinement(costs, budget, residues):
+    """ Refinement settings that fit in a time budget (seconds per model) with the measured costs (seconds) of the
+    setup, each relax type and each CartesianSampler cycle. FastRelax (only up to 1000 residues), more rounds and
+    more cycles are preferred in that order. If nothing fits, the cheapest settings are returned """
+    relaxTypes = getRelaxTypes(residues)
+    for relax in relaxTypes:
+        for rounds in range(len(SAMPLERS), 0, -1):
+            # cenmin + relax, (sampler + relax) x rounds, final relax
+            remaining = budget - costs['setup'] - (rounds + 2) * costs[relax]
+            ncycles = int(remaining / (rounds * costs['cycle'])) if costs['cycle'] > 0 else MAX_NCYCLES
+            if ncycles >= MIN_NCYCLES:
+                ncycles = min(MAX_NCYCLES, ncycles)
+                return {'relax': relax, 'rounds': rounds, 'ncycles': ncycles,
+                        'predicted': costs['setup'] + (rounds + 2) * costs[relax] + rounds * ncycles * costs['cycle']}
+    relax = min(relaxTypes, key=lambda r: costs[r])
+    return {'relax': relax, 'rounds': 1, 'ncycles': MIN_NCYCLES,
+            'predicted': costs['setup'] + 3 * costs[relax] + MIN_NCYCLES * costs['cycle']}
 
 
 class ProtRosettaGenerateStructures(EMProtocol):
@@ -60,6 +108,7 @@ class ProtRosettaGenerateStructures(EMProtocol):
 
     def __init__(self, **kwargs):
         EMProtocol.__init__(self, **kwargs)
+        self.stepsExecutionMode = params.STEPS_PARALLEL
 
     # -------------------------- DEFINE param functions ----------------------
     def _defineParams(self, form):
@@ -67,10 +116,12 @@ class ProtRosettaGenerateStructures(EMProtocol):
         """
         form.addSection(label=Message.LABEL_INPUT)
         group = form.addGroup('General')
-        group.addParam("inputStructure", params.PointerParam, pointerClass="AtomStruct",
+        group.addParam("inputStructure", params.PointerParam, pointerClass="AtomStruct,SetOfAtomStructs",
                       label="Reference atomic structure: ",
                       important=True, allowsNull=False,
-                      help="Select the reference atomic structure")
+                      help="Select the reference atomic structure or a set of them (i.e. an ensemble). In a set, "
+                           "the map and the symmetry definition are prepared once and the number of output "
+                           "structures are generated from each of them, with their jobs split among the threads")
         group.addParam("inputVolume", params.PointerParam, pointerClass="Volume",
                       label="Volume related to the atomic structure: ",
                       help="Select an electron density map for the input structure."
@@ -80,7 +131,11 @@ class ProtRosettaGenerateStructures(EMProtocol):
                       help='Set the resolution of the input volume.')
         group.addParam('numMods', params.IntParam,
                        label='Number of output structures:', default=10,
-                       help='Set the number of output Rosetta structures to be generated')
+                       help='Set the number of output Rosetta structures to be generated. The models already '
+                            'generated with the same inputs and parameters (in this or other runs of the project) '
+                            'are reused and only the missing ones are generated. They are split in '
+                            'parallel rosetta_scripts jobs, as many as threads. With several MPI processes, each '
+                            'job runs the MPI build of rosetta_scripts and its models are split among them')
         group.addParam('skipIdealize', params.BooleanParam, default=True,
                        label='Skip Rosetta Idealize: ',
                        help='Skip Rosetta idealize to the input atomic structure')
@@ -108,7 +163,48 @@ class ProtRosettaGenerateStructures(EMProtocol):
         group.addParam('membrane', params.BooleanParam, label='Membrane protein: ',
                        default=False, help='Whether the input protein is placed into a membrane')
 
-        form.addParallelSection(threads=4, mpi=1)
+        group = form.addGroup('Output', expertLevel=params.LEVEL_ADVANCED)
+        group.addParam('bestModels', params.IntParam, default=0, label='Register only the best models: ',
+                       help='Number of models (with the best, lowest, total score, which includes the density fit '
+                            'term elec_dens_fast weighted for the resolution) registered in the output. If 0, all '
+                            'the models are registered. In any case, the outputs are sorted by score and carry '
+                            'the score terms of Rosetta (_rosetta_<term> attributes)')
+        group.addParam('mapCorrelation', params.BooleanParam, default=True, label='Model-map correlation: ',
+                       help='Correlation of each output model with the input map (_mapCorrelation attribute), '
+                            'inside a mask around its atoms. The density of the model is simulated at the '
+                            'resolution of the map. The models in silent files are extracted to PDB to compute it, '
+                            'so with silent file output only the best models kept are scored (none if all of them '
+                            'are kept)')
+        group.addParam('silentOutput', params.BooleanParam, default=False, label='Silent file output: ',
+                       help='Write the models of each rosetta_scripts job in a binary silent file instead of a PDB '
+                            'per model, with an index of their tags and scores. The output structures point into '
+                            'the silent files and are extracted to PDB only when needed (extract_pdbs). '
+                            'With MPI, at least 3 processes are needed (master, file buffer and workers)')
+
+        group = form.addGroup('Input map', expertLevel=params.LEVEL_ADVANCED)
+        group.addParam('cropMap', params.BooleanParam, default=True, label='Crop map to the structure: ',
+                       help='Crop the input map to the box of the input structure plus a margin. Rosetta loads '
+                            'and scores a smaller map, using less memory and time per model. The converted map is '
+                            'reused by the runs of the project with the same volume and crop')
+        group.addParam('cropMargin', params.FloatParam, default=10.0, label='Crop margin (A): ',
+                       condition='cropMap', help='Margin around the input structure kept in the cropped map')
+
+        group = form.addGroup('Time budget', expertLevel=params.LEVEL_ADVANCED)
+        group.addParam('timeBudget', params.FloatParam, default=0, label='Time per model (min): ',
+                       help='Wall-clock time budget to generate each model in one core. The setup, relax and '
+                            'rebuilding of the refinement are first measured in the input (calibration pass) and '
+                            'the relax type (FastRelax or LocalRelax), the number of rebuilding rounds and the '
+                            'cycles of each one are chosen to fit in the budget.\n'
+                            'If 0, the default refinement is used')
+
+        addProfilingParams(form)
+
+        # The protocol is not launched with MPI: its jobs run in the threads and each one launches its own MPI ranks
+        form.addParallelSection(threads=4, mpi=0)
+        form.addParam('rosettaMpi', params.IntParam, default=1, label='MPI processes per job: ',
+                      help='MPI processes of each rosetta_scripts job. If greater than 1, the jobs run the MPI build '
+                           'of rosetta_scripts and the models of each job are split among its processes. The jobs '
+                           'run at the same time as threads, so up to (threads - 1) x MPI processes are used')
         form.addHidden(params.USE_GPU, params.BooleanParam, default=True,
                        label="Use GPU for execution: ",
                        help="This protocol has both CPU and GPU implementation.\
@@ -120,95 +216,216 @@ class ProtRosettaGenerateStructures(EMProtocol):
  # --------------------------- STEPS functions ------------------------------
 
     def _insertAllSteps(self):
-        self._insertFunctionStep('prepareInputStep')
-        self._insertFunctionStep('runRosettaScript')
-        self._insertFunctionStep('createOutputStep')
-
+        pId = self._insertFunctionStep('prepareInputStep')
+        if self.timeBudget.get() > 0:
+            pId = self._insertFunctionStep('calibrationStep', prerequisites=[pId])
+        jobSteps = []
+        for structure, start, nstruct in self.getJobs():
+            jId = self._insertFunctionStep('runRosettaScript', structure, start, nstruct, prerequisites=[pId])
+            jobSteps.append(jId)
+        self._insertFunctionStep('createOutputStep', prerequisites=jobSteps)
+
+    @profileStep
     def prepareInputStep(self):
-        #Fix volume
-        inVol = self._getInputVolume()
-        mrcFile = self._getExtraPath('inpVolume.mrc')
-        ImageHandler().convert(inVol, mrcFile)
-        Ccp4Header.fixFile(mrcFile, mrcFile, inVol.getOrigin(force=True).getShifts(),
-                           inVol.getSamplingRate(), Ccp4Header.START)
-
-        #Convert structure to pdb
-        pdbFile = self.inputStructure.get().getFileName()
-        name, ext = os.path.splitext(pdbFile)
-        self.pdbfile = self._getExtraPath(os.path.basename(pdbFile))
-        os.link(pdbFile, self.pdbfile)
-        if ext != '.pdb':
-          outFile = self.pdbfile.replace(ext, '.pdb')
-          toPdb(self.pdbfile, outFile)
-          self.pdbfile = outFile
-
-        #Clean pdb
-        self.pdbfile = self.cleanPDB(self.pdbfile)
-
-        #Run rosetta Idealize
-        if not self.skipIdealize.get():
-            self.pdbfile = self.runRosettaIdealize()
-
-        if self.isSymmetric():
-            self.pdbfile, self.symfile = self.generateRosettaSym()
+        #Convert structures to pdb
+        structures = self.getInputStructures()
+        pdbFiles = []
+        for i, aStr in enumerate(structures):
+          pdbFile = aStr.getFileName()
+          name, ext = os.path.splitext(pdbFile)
+          # The structures of a set are prefixed with their index, as they may share their file name
+          prefix = '%03d_' % i if len(structures) > 1 else ''
+          localFile = self._getExtraPath(prefix + os.path.basename(pdbFile))
+          os.link(pdbFile, localFile)
+          if ext != '.pdb':
+            outFile = os.path.splitext(localFile)[0] + '.pdb'
+            toPdb(localFile, outFile)
+            localFile = outFile
+          pdbFiles.append(localFile)
+
+        #Fix volume, once for all the structures
+        self.prepareMap(pdbFiles)
+
+        prepared, self.residues = [], []
+        for i, pdbFile in enumerate(pdbFiles):
+          #Clean pdb
+          self.pdbfile = self.cleanPDB(pdbFile)
+
+          #Run rosetta Idealize
+          if not self.skipIdealize.get():
+              self.pdbfile = self.runRosettaIdealize()
 
-        # get number of residues in ASU
-        self.residues = self.getResList(self.pdbfile)
-        print("ASU contains %i residues" % (len(self.residues)))
-
-    def runRosettaScript(self):
-      rosettaDir = Plugin.getRosettaDir()
-      program, programGPU = 'rosetta_scripts.static.linuxgccrelease', 'rosetta_scripts.opencl.linuxgccrelease'
-      xmlRosettaFile = os.path.abspath(self._getExtraPath('multicycle.xml'))
-
-      args = " -database {}/main/database".format(rosettaDir)
-      args += " -in::file::s %s " % self.pdbfile
-      args += " -parser::protocol {} ".format(xmlRosettaFile)
+          if self.isSymmetric():
+            if i == 0:
+              self.pdbfile, self.symfile = self.generateRosettaSym()
+            else:
+              # The symmetry definition of the first structure is shared by the rest, only their ASU is kept
+              asuFile = os.path.splitext(self.pdbfile)[0] + "_asu_INPUT.pdb"
+              self.keepChainSubset(self.pdbfile, asuFile, self.asu.get().split(','))
+              self.pdbfile = asuFile
+
+          # get number of residues in ASU
+          residues = self.getResList(self.pdbfile)
+          print("ASU of %s contains %i residues" % (os.path.basename(pdbFile), len(residues)))
+          # The relax of the XML (shared by all the structures) is chosen for the largest one
+          if len(residues) > len(self.residues):
+            self.residues = residues
+          prepared.append({'pdbfile': os.path.abspath(self.pdbfile), 'nucleic': self.nucleic,
+                           'residues': len(residues)})
+
+        # The parallel jobs (and a resumed run) read the prepared input from its file
+        with open(self.getPreparedFile(), 'w') as f:
+            json.dump({'symfile': getattr(self, 'symfile', None), 'structures': prepared}, f, indent=1)
+        # Estimated from the prepared structures, once, so the summary does not read the inputs on each refresh
+        writeEstimate(self.getEstimateFile(), self.getEstimate(prepared))
+
+        # With a time budget, the XML is written after measuring the refinement in calibrationStep
+        if self.timeBudget.get() <= 0:
+            self.writeRosettaXML(self.getXMLFile())
+            self.planRun()
+
+    @profileStep
+    def runRosettaScript(self, structure=0, start=1, nstruct=None):
+      """ Generate the models of an input structure planned for the job slot starting at model start (nstruct
+      models at most, fewer if some are reused from previous runs) in a job directory """
+      program, programGPU = ROSETTA_SCRIPTS, 'rosetta_scripts.opencl.linuxgccrelease'
+      xmlRosettaFile = os.path.abspath(self.getXMLFile())
+      prepared = self.getPreparedInput(structure)
+      job = self.getPlan(structure)['jobs'][str(start)]
+      nstruct, seed = job['nstruct'], job['seed']
+      if nstruct == 0:
+        print('All the models of this job are reused from previous runs')
+        return
+      jobDir = self.getJobDir(structure, seed)
+      os.makedirs(jobDir, exist_ok=True)
+
+      # Each job gets its own seed, not used by any previous job, so they do not generate the same models
+      args = self.getScriptArgs(prepared, xmlRosettaFile, nstruct, seed)
+
+      # Files staged and retrieved when running in a node-local scratch directory
+      inputFiles = [prepared['pdbfile'], xmlRosettaFile]
       if self.isSymmetric():
-        args += " -parser::script_vars symmdef=%s " % self.symfile
-        args += " -score_symm_complex false "
-      if self.nucleic:
-        args += " -relax::dna_move "
-      args += " -ignore_unrecognized_res "
-      args += " -edensity::mapreso %.3f " % self.resolution.get()
-      args += " -edensity::cryoem_scatterers "
-      args += " -in::file::centroid_input "
-      args += " -out::suffix _rev2 "
-      args += " -cryst::crystal_refine "
-      args += " -restore_talaris_behavior "
-      args += " -nstruct %i" % self.numMods.get()
-
-      self.writeRosettaXML(xmlRosettaFile)
+        inputFiles.append(prepared['symfile'])
+      scratchFiles = {'inputFiles': inputFiles, 'outputFiles': ['*_rev2_*.pdb', '*.sc', SILENT_FILE]}
+      if self.silentOutput.get():
+        args += " -out:file:silent %s -out:file:silent_struct_type binary " % SILENT_FILE
+      metrics = getMetricsKwargs(self, 'runRosettaScript', residues=prepared['residues'], nstruct=nstruct,
+                                 job=start, seed=seed, structure=structure)
 
       print('Launching Rosetta scripts')
-      if not getattr(self, params.USE_GPU):
+      if self.useMPI():
+        # The job distributor splits the models of the job among the MPI ranks, without a master rank. The silent
+        # file is written by a single rank, with a master and a file buffer rank
+        if self.silentOutput.get():
+          args += " -jd2:mpi_file_buf_job_distributor -mpi_tracer_to_file mpi_log "
+        else:
+          args += " -jd2:mpi_work_partition_job_distributor -mpi_tracer_to_file mpi_log "
+        program = Plugin.getProgram(ROSETTA_SCRIPTS_MPI)
+        print(program, args)
+        print('---------------------------\n')
+        sys.stdout.flush()
+        Plugin.runRosettaProgram(program, args, cwd=jobDir, numberOfMpi=self.rosettaMpi.get(),
+                                 hostConfig=self.getHostConfig(), **scratchFiles, **metrics)
+      elif not getattr(self, params.USE_GPU):
         program = Plugin.getProgram(program)
         print(program, args)
         print('---------------------------\n')
         sys.stdout.flush()
-        Plugin.runRosettaProgram(program, args, cwd=self._getPath())
+        Plugin.runRosettaProgram(program, args, cwd=jobDir, **scratchFiles, **metrics)
       else:
         programGPU = Plugin.getProgram(programGPU)
         args += " -gpu %s" % str(getattr(self, params.GPU_LIST).get())
         print(programGPU, args)
         print('---------------------------\n')
         sys.stdout.flush()
-        Plugin.runRosettaProgram(programGPU, args, cwd=self._getPath())
-
-
+        Plugin.runRosettaProgram(programGPU, args, cwd=jobDir, **scratchFiles, **metrics)
+
+      # Manifest of the models of the job (and their scores), to reuse them in runs with the same inputs
+      with open(os.path.join(jobDir, JOB_MANIFEST), 'w') as f:
+        json.dump({'fingerprint': prepared['fingerprint'], 'seed': seed, 'nstruct': nstruct,
+                   'models': self.getJobModels(jobDir), 'scores': self.getJobScores(jobDir)}, f, indent=1)
+
+
+    @profileStep
+    def calibrationStep(self):
+        """ Measure the runtime of the setup, the relax (FastRelax and LocalRelax) and the CartesianSampler cycles
+        of the refinement in the input (the largest one of a set) and choose the settings that fit in the time
+        budget per model """
+        structures = self.getPreparedInput(None)['structures']
+        prepared = self.getPreparedInput(max(range(len(structures)), key=lambda i: structures[i]['residues']))
+        self.symfile = prepared['symfile']
+        relaxTypes, times = getRelaxTypes(prepared['residues']), {}
+        for name, movers, settings in CALIBRATION_PASSES:
+            if 'relaxcart' in movers and settings['relax'] not in relaxTypes:
+                # A relax that can not be chosen for this structure is not measured
+                continue
+            calDir = os.path.abspath(self._getExtraPath('calibration', name))
+            os.makedirs(calDir, exist_ok=True)
+            xmlFile = os.path.join(calDir, 'calibration.xml')
+            self.writeRosettaXML(xmlFile, settings=settings, movers=movers)
+            start = time.time()
+            Plugin.runRosettaProgram(Plugin.getProgram(ROSETTA_SCRIPTS),
+                                     self.getScriptArgs(prepared, xmlFile, 1, SEED_BASE), cwd=calDir,
+                                     **getMetricsKwargs(self, 'calibrationStep', calibration=name))
+            times[name] = time.time() - start
+
+        costs = {'setup': times['setup'], 'cycle': max(0.0, times['sampler'] - times['setup']) / CALIBRATION_CYCLES}
+        for relax in relaxTypes:
+            costs[relax] = max(0.0, times[relax.lower()] - times['setup']) / 2
+        settings = chooseRefinement(costs, self.timeBudget.get() * 60, prepared['residues'])
+        print('Refinement settings for %.1f min per model: %s (predicted %.1f min)' %
+              (self.timeBudget.get(), settings, settings['predicted'] / 60))
+        with open(self.getBudgetFile(), 'w') as f:
+            json.dump({'costs': costs, 'settings': settings}, f, indent=1)
+
+        self.writeRosettaXML(self.getXMLFile(), settings=settings)
+        self.planRun()
+
+    @profileStep
     def createOutputStep(self):
         outputSet = SetOfAtomStructs.create(self._getPath())
-        for file in os.listdir(self._getPath()):
-            if '_rev2_' in file:
-                pdbFile = self._getPath(file)
-                aStr = AtomStruct(filename=pdbFile)
-                outVol = self._getInputVolume().clone()
-                outVol.setLocation(self._getExtraPath('inpVolume.mrc'))
-                aStr.setVolume(outVol)
-                outputSet.append(aStr)
+        outVol = self.getOutputVolume()
+        # Models of each input structure, ranked among themselves
+        ranked = [self.rankModels(structure) for structure in range(self.getNumberOfStructures())]
+        # The models are merged by their tag, unique among the jobs, so a model found twice is output once
+        tags = set()
+        for i, (models, scores) in enumerate(ranked):
+            merged = []
+            for model in models:
+                if self.getModelTag(model) not in tags:
+                    tags.add(self.getModelTag(model))
+                    merged.append(model)
+            ranked[i] = (merged, scores)
+        self.writeScoresTable(ranked)
+        if self.bestModels.get() > 0:
+            ranked = [(models[:self.bestModels.get()], scores) for models, scores in ranked]
+        allModels = [model for models, _ in ranked for model in models]
+        correlations = {}
+        if self.mapCorrelation.get() and self.silentOutput.get() and self.bestModels.get() <= 0:
+            print('The model-map correlation is skipped, since it would extract all the models of the silent files')
+        elif self.mapCorrelation.get():
+            correlations = self.getMapCorrelations(allModels)
+        inputIds = [aStr.getObjId() for aStr in self.getInputStructures()]
+        for structure, (models, scores) in enumerate(ranked):
+          for rank, model in enumerate(models, 1):
+            if isinstance(model, str):
+                aStr = AtomStruct(filename=model)
+            else:
+                # Model in a silent file, extracted on demand (getModelFile)
+                aStr = AtomStruct(filename=model[0])
+                aStr._silentTag = String(model[1])
+            aStr._rosettaRank = Integer(rank)
+            aStr._inputStructureId = Integer(inputIds[structure])
+            if correlations.get(self.getModelKey(model)) is not None:
+                aStr._mapCorrelation = Float(correlations[self.getModelKey(model)])
+            for term, value in scores.get(self.getModelKey(model), {}).items():
+                setattr(aStr, '_rosetta_' + term, Float(value))
+            aStr.setVolume(outVol.clone())
+            outputSet.append(aStr)
 
         self._defineOutputs(outputAtomStructs=outputSet)
         self._defineSourceRelation(self.inputStructure, outputSet)
+        updateCalibration(getMetricsFile(self), Plugin.getCalibrationFile())
 
 
     def _validate(self):
@@ -217,10 +434,415 @@ class ProtRosettaGenerateStructures(EMProtocol):
         # Check that the input volume exist
         if self._getInputVolume() is None:
             errors.append("Error: You should provide a volume.\n")
+        if self.useMPI() and not os.path.exists(Plugin.getProgram(ROSETTA_SCRIPTS_MPI)):
+            errors.append("Error: %s (Rosetta built with MPI) is needed to run with several MPI processes.\n"
+                          % ROSETTA_SCRIPTS_MPI)
+        if self.useMPI() and self.silentOutput.get() and self.rosettaMpi.get() < 3:
+            errors.append("Error: at least 3 MPI processes are needed with silent file output "
+                          "(master, file buffer and workers).\n")
         return errors
 
+    def _summary(self):
+        summary = []
+        if os.path.exists(self.getPlanFile()):
+            plans = self.getPlan(None)['structures']
+            summary.append('Models reused from previous runs: %d. Generated: %d' %
+                           (sum(len(plan['reused']) for plan in plans),
+                            sum(job['nstruct'] for plan in plans for job in plan['jobs'].values())))
+        if os.path.exists(self.getScoresFile()):
+            with open(self.getScoresFile()) as f:
+                header = f.readline().strip().split(',')
+                rows = [line.strip().split(',') for line in f]
+            if 'total_score' in header:
+                iScore = header.index('total_score')
+                rows = [row for row in rows if len(row) == len(header) and row[iScore]]
+                if rows:
+                    best = min(rows, key=lambda row: float(row[iScore]))
+                    summary.append('Best model: %s (total score %s). Scores of all the models in %s' %
+                                   (best[header.index('model')], best[iScore], self.getScoresFile()))
+        if os.path.exists(self.getCorrelationsFile()):
+            with open(self.getCorrelationsFile()) as f:
+                correlations = {key: value for key, value in json.load(f).items() if value is not None}
+            if correlations:
+                best, median = max(correlations, key=correlations.get), np.median(list(correlations.values()))
+                summary.append('Model-map correlation: best %.3f (%s), median %.3f' %
+                               (correlations[best], os.path.basename(best), median))
+        if os.path.exists(self.getBudgetFile()):
+            with open(self.getBudgetFile()) as f:
+                settings = json.load(f)['settings']
+            summary.append('Refinement for %.1f min per model: %s, %d CartesianSampler rounds of %d cycles '
+                           '(predicted %.1f min)' % (self.timeBudget.get(), settings['relax'], settings['rounds'],
+                                                     settings['ncycles'], settings['predicted'] / 60))
+        if not self.isFinished():
+            summary += self.getEstimateSummary()
+        summary += formatSummary(readRecords(getMetricsFile(self)))
+        return summary
+
+    def getEstimate(self, prepared):
+        """ Estimate of the cost of the run (CPU and wall hours, peak memory and disk) from the residues of the
+        prepared structures, calibrated with the records of previous runs """
+        residues = sum(structure['residues'] for structure in prepared) / len(prepared)
+        return estimateStructures(residues, self.numMods.get() * len(prepared),
+                                  min(len(self.getJobs()), self.getJobSlots()) * self.rosettaMpi.get(),
+                                  loadCalibration(Plugin.getCalibrationFile(), 'runRosettaScript'))
+
+    def getInputEstimate(self):
+        """ Estimate of the run before its input is prepared, from the residues of the ASU of the input files """
+        chains = self.asu.get().split(',') if self.isSymmetric() else None
+        return self.getEstimate([{'residues': countResidues(aStr.getFileName(), chains)}
+                                 for aStr in self.getInputStructures()])
+
+    def getEstimateSummary(self):
+        estimate = readEstimate(self.getEstimateFile())
+        if estimate is None and self.inputStructure.get() is not None:
+            # Not launched yet, or its input is not prepared
+            estimate = self.getInputEstimate()
+        return formatEstimate(estimate) if estimate is not None and estimate['cpuHours'] else []
+
+    def getEstimateFile(self):
+        return self._getExtraPath('estimate.json')
+
 ###################################### UTILS ####################
 
+    def useMPI(self):
+        return self.rosettaMpi.get() > 1
+
+    def getInputStructures(self):
+        """ Input atomic structures: the input one or the ones of the input set """
+        inputObj = self.inputStructure.get()
+        if isinstance(inputObj, SetOfAtomStructs):
+            return [aStr.clone() for aStr in inputObj]
+        return [inputObj]
+
+    def getNumberOfStructures(self):
+        inputObj = self.inputStructure.get()
+        return inputObj.getSize() if isinstance(inputObj, SetOfAtomStructs) else 1
+
+    def getJobSlots(self):
+        """ Jobs running at the same time (the steps are run by numberOfThreads - 1 threads) """
+        return max(1, self.numberOfThreads.get() - 1)
+
+    def getJobs(self):
+        """ Parallel rosetta_scripts jobs, as (input structure, first model, number of models). The job slots are
+        split among the input structures. With MPI, each job gets at least as many models as MPI processes """
+        maxJobs = -(-self.numMods.get() // self.rosettaMpi.get()) if self.useMPI() else self.numMods.get()
+        nStructures = self.getNumberOfStructures()
+        nJobs = max(1, min(-(-self.getJobSlots() // nStructures), maxJobs))
+        jobs = []
+        for structure in range(nStructures):
+            start = 1
+            for i in range(nJobs):
+                nstruct = self.numMods.get() // nJobs + (i < self.numMods.get() % nJobs)
+                jobs.append((structure, start, nstruct))
+                start += nstruct
+        return jobs
+
+    def getJobDir(self, structure, seed):
+        return os.path.abspath(self._getExtraPath('job_{}_{}'.format(structure, seed)))
+
+    def getModels(self, structure=0):
+        """ Models of an input structure reused from previous runs and generated by the jobs of the plan (and in
+        the protocol folder, by previous versions of the protocol), as PDB files or [silent file, tag] """
+        models = glob.glob(self._getPath('*_rev2_*.pdb')) if structure == 0 else []
+        plan = self.getPlan(structure)
+        models += plan['reused']
+        for job in plan['jobs'].values():
+            models += self.getJobModels(self.getJobDir(structure, job['seed']))
+        return sorted(models, key=self.getModelKey)
+
+    def getModelKey(self, model):
+        """ Identifier of a model: its PDB file or tag@silentFile """
+        return model if isinstance(model, str) else '{}@{}'.format(model[1], model[0])
+
+    def getModelTag(self, model):
+        """ Tag of a model in the score files of Rosetta """
+        return os.path.splitext(os.path.basename(model))[0] if isinstance(model, str) else model[1]
+
+    def getJobScores(self, jobDir):
+        """ Score terms of the models of a job by tag, from the index of its silent file or its score files """
+        indexFile = os.path.join(jobDir, SILENT_INDEX)
+        if os.path.exists(indexFile):
+            models = readIndex(indexFile)['models']
+        else:
+            models = [model for scoreFile in sorted(glob.glob(os.path.join(jobDir, '*.sc')))
+                      for model in readScores(scoreFile)]
+        return {model['tag']: getScoreTerms(model) for model in models}
+
+    def getScores(self, structure=0):
+        """ Score terms of the models of an input structure by model key """
+        plan = self.getPlan(structure)
+        scores = dict(plan.get('scores', {}))
+        for job in plan['jobs'].values():
+            jobDir = self.getJobDir(structure, job['seed'])
+            jobScores = self.getJobScores(jobDir)
+            for model in self.getJobModels(jobDir):
+                if self.getModelTag(model) in jobScores:
+                    scores[self.getModelKey(model)] = jobScores[self.getModelTag(model)]
+        return scores
+
+    def rankModels(self, structure=0):
+        """ Models of an input structure sorted by total score (the ones without score last) and their scores """
+        scores = self.getScores(structure)
+        models = sorted(self.getModels(structure), key=lambda model: scores.get(self.getModelKey(model), {}).get(
+            'total_score', float('inf')))
+        return models, scores
+
+    def writeScoresTable(self, ranked):
+        """ Write the table of the scores of the ranked models of each input structure in extra/scores.csv """
+        terms = sorted(set(term for _, scores in ranked for modelScores in scores.values() for term in modelScores))
+        terms = ['total_score'] + [term for term in terms if term != 'total_score'] if terms else []
+        with open(self.getScoresFile(), 'w') as f:
+            f.write(','.join(['structure', 'rank', 'model'] + terms) + '\n')
+            for structure, (models, scores) in enumerate(ranked):
+                for rank, model in enumerate(models, 1):
+                    modelScores = scores.get(self.getModelKey(model), {})
+                    f.write(','.join([str(structure), str(rank), self.getModelKey(model)] +
+                                     ['%g' % modelScores[term] if term in modelScores else '' for term in terms])
+                            + '\n')
+
+    def getScoresFile(self):
+        return self._getExtraPath('scores.csv')
+
+    def getMapCorrelations(self, models):
+        """ Correlation with the (cropped) input map of the models by model key, computed in a pool of threads. The
+        ones in silent files are extracted first. The correlations are also written in extra/correlations.json """
+        pdbFiles = {}
+        for model in models:
+            if isinstance(model, str):
+                pdbFiles[self.getModelKey(model)] = model
+        silentFiles = set(model[0] for model in models if not isinstance(model, str))
+        for silentFile in sorted(silentFiles):
+            silentModels = [model for model in models if not isinstance(model, str) and model[0] == silentFile]
+            extracted = self.extractModels(silentFile, [model[1] for model in silentModels])
+            pdbFiles.update({self.getModelKey(model): pdbFile for model, pdbFile in zip(silentModels, extracted)})
+
+        # The threads of the pool are bounded by the box of the input structures plus the crop margin (the map crop),
+        # where the models are refined, instead of the whole map
+        mapFile = self._getExtraPath('inpVolume.mrc')
+        coords = np.concatenate([self.getCoordinates(structure['pdbfile'])
+                                 for structure in self.getPreparedInput(None)['structures']])
+        low, high = getCropBox(readMapHeader(mapFile), coords, self.cropMargin.get())
+        keys = list(pdbFiles)
+        values = mapCorrelations(mapFile, [pdbFiles[key] for key in keys], self.resolution.get(),
+                                 threads=self.numberOfThreads.get(), boxVoxels=int(np.prod(high - low)))
+        correlations = dict(zip(keys, values))
+        with open(self.getCorrelationsFile(), 'w') as f:
+            json.dump(correlations, f, indent=1)
+        return correlations
+
+    def getCorrelationsFile(self):
+        return self._getExtraPath('correlations.json')
+
+    def getJobModels(self, jobDir):
+        """ Models of a job: its PDB files or [silent file, tag] of the models in its silent file, which is indexed
+        the first time """
+        silentFile, indexFile = os.path.join(jobDir, SILENT_FILE), os.path.join(jobDir, SILENT_INDEX)
+        if os.path.exists(silentFile):
+            if not os.path.exists(indexFile):
+                writeIndex(silentFile, indexFile)
+            return [[silentFile, model['tag']] for model in readIndex(indexFile)['models']]
+        return sorted(glob.glob(os.path.join(jobDir, '*_rev2_*.pdb')))
+
+    def getModelFile(self, aStr):
+        """ PDB file of an output structure, extracted from its silent file the first time """
+        tag = getattr(aStr, '_silentTag', None)
+        if tag is None:
+            return aStr.getFileName()
+        return self.extractModels(aStr.getFileName(), [tag.get()])[0]
+
+    def extractModels(self, silentFile, tags):
+        """ Extract models of a silent file to PDB files, only the ones not extracted before. The tags repeat
+        across jobs, so each silent file (of this or of a previous run) gets its own directory in extra/extracted """
+        silentFile = os.path.abspath(silentFile)
+        outDir = os.path.abspath(self._getExtraPath('extracted', '{}_{}'.format(
+            os.path.basename(os.path.dirname(silentFile)), hashText(silentFile)[:8])))
+        os.makedirs(outDir, exist_ok=True)
+        pdbFiles = [os.path.join(outDir, tag + '.pdb') for tag in tags]
+        missing = [tag for tag, pdbFile in zip(tags, pdbFiles) if not os.path.exists(pdbFile)]
+        if missing:
+            args = " -database {}".format(Plugin.getDatabasePath())
+            args += " -in:file:silent %s -in:file:silent_struct_type binary" % silentFile
+            args += " -in:file:tags %s" % ' '.join(missing)
+            args += " -out:path:all %s" % outDir
+            Plugin.runRosettaProgram(Plugin.getProgram(EXTRACT_PDBS), args, cwd=outDir,
+                                     **getMetricsKwargs(self, 'extractModels', models=len(missing)))
+        return pdbFiles
+
+    def getFingerprint(self, prepared):
+        """ Fingerprint of the inputs that define the models: prepared structure, symmetry, map, resolution and
+        XML (without the paths of this run) """
+        with open(self.getXMLFile()) as f:
+            xml = f.read().replace(os.path.abspath(self._getExtraPath()), '')
+        return hashFiles([prepared['pdbfile'], prepared['symfile'], self._getExtraPath('inpVolume.mrc')],
+                         hashText(xml), self.resolution.get(), prepared['nucleic'])
+
+    def getJobManifests(self):
+        """ Manifests of the finished jobs of all the runs of the project (including this one) """
+        runsDir = os.path.dirname(os.path.abspath(self.getWorkingDir()))
+        manifests = []
+        for manifestFile in glob.glob(os.path.join(runsDir, '*', 'extra', 'job_*', JOB_MANIFEST)):
+            with open(manifestFile) as f:
+                manifests.append(json.load(f))
+        return manifests
+
+    def planModels(self, structure, fingerprint):
+        """ Plan the models of an input structure: the ones already generated with the same fingerprint (in this or
+        other runs of the project) are reused and the missing ones are split among its jobs, with seeds not used
+        before. The models of other runs are copied into this one """
+        ownDir, reused, usedSeeds, scores = os.path.abspath(self._getExtraPath()), [], [SEED_BASE - 1], {}
+        for manifest in self.getJobManifests():
+            if manifest['fingerprint'] != fingerprint:
+                continue
+            usedSeeds.append(manifest['seed'])
+            silentModels, manifestScores = [], manifest.get('scores', {})
+            for model in manifest['models']:
+                if isinstance(model, list):
+                    # Models in a silent file, copied together below
+                    if len(reused) + len(silentModels) < self.numMods.get() and os.path.exists(model[0]):
+                        silentModels.append(model)
+                elif len(reused) < self.numMods.get() and os.path.exists(model):
+                    tag = self.getModelTag(model)
+                    if not model.startswith(ownDir):
+                        reusedDir = self._getExtraPath('reused')
+                        os.makedirs(reusedDir, exist_ok=True)
+                        newFile = os.path.abspath(os.path.join(reusedDir, '{}_{}_{}'.format(
+                            structure, manifest['seed'], os.path.basename(model))))
+                        shutil.copy(model, newFile)
+                        model = newFile
+                    reused.append(model)
+                    if tag in manifestScores:
+                        scores[model] = manifestScores[tag]
+            if silentModels and not silentModels[0][0].startswith(ownDir):
+                reusedDir = self._getExtraPath('reused')
+                os.makedirs(reusedDir, exist_ok=True)
+                silentFile, tags = silentModels[0][0], set(tag for _, tag in silentModels)
+                index = readIndex(os.path.join(os.path.dirname(silentFile), SILENT_INDEX))
+                newFile = os.path.abspath(os.path.join(reusedDir, '{}_{}_{}'.format(
+                    structure, manifest['seed'], SILENT_FILE)))
+                copyModels(silentFile, [model for model in index['models'] if model['tag'] in tags], newFile)
+                silentModels = [[newFile, tag] for _, tag in silentModels]
+            reused += silentModels
+            scores.update({self.getModelKey(model): manifestScores[model[1]] for model in silentModels
+                           if model[1] in manifestScores})
+
+        jobs = [start for jobStructure, start, _ in self.getJobs() if jobStructure == structure]
+        missing, firstSeed = self.numMods.get() - len(reused), max(usedSeeds) + 1
+        plan = {'reused': reused, 'scores': scores, 'jobs': {}}
+        for i, start in enumerate(jobs):
+            plan['jobs'][str(start)] = {'nstruct': missing // len(jobs) + (i < missing % len(jobs)),
+                                        'seed': firstSeed + i}
+        print('Structure %d: %d models reused from previous runs, %d to generate' % (structure, len(reused), missing))
+        return plan
+
+    def prepareMap(self, pdbFiles):
+        """ Convert the input volume into the MRC map read by Rosetta, cropped to the box of the structures plus a
+        margin. The map is reused from any run of the project with the same volume and crop """
+        inVol, mrcFile = self._getInputVolume(), self._getExtraPath('inpVolume.mrc')
+        shifts, sampling = inVol.getOrigin(force=True).getShifts(), inVol.getSamplingRate()
+        crop = None
+        if self.cropMap.get():
+            coords = np.concatenate([self.getCoordinates(pdbFile) for pdbFile in pdbFiles])
+            crop = [[round(c, 1) for c in coords.min(axis=0)], [round(c, 1) for c in coords.max(axis=0)],
+                    self.cropMargin.get()]
+        key = hashFiles([inVol.getFileName().split(':')[0]], sampling, list(shifts), crop)
+
+        runsDir = os.path.dirname(os.path.abspath(self.getWorkingDir()))
+        for cacheFile in glob.glob(os.path.join(runsDir, '*', 'extra', MAP_MANIFEST)):
+            with open(cacheFile) as f:
+                cached = json.load(f)
+            if cached['key'] == key and os.path.exists(cached['file']):
+                print('Reusing the map %s' % cached['file'])
+                shutil.copy(cached['file'], mrcFile)
+                break
+        else:
+            fullFile = self._getTmpPath('inpVolume_full.mrc') if crop else mrcFile
+            ImageHandler().convert(inVol, fullFile)
+            Ccp4Header.fixFile(fullFile, fullFile, shifts, sampling, Ccp4Header.START)
+            if crop:
+                header = readMapHeader(fullFile)
+                low, high = getCropBox(header, coords, self.cropMargin.get())
+                start = cropMap(fullFile, mrcFile, low, high)
+                ccp4header = Ccp4Header(mrcFile, readHeader=True)
+                ccp4header.setStartPixel(tuple(int(x) for x in start))
+                ccp4header.writeHeader()
+                os.remove(fullFile)
+                print('Map cropped from %s to %s voxels' % (tuple(header['dims']), tuple(high - low)))
+
+        with open(self._getExtraPath(MAP_MANIFEST), 'w') as f:
+            json.dump({'key': key, 'file': os.path.abspath(mrcFile)}, f, indent=1)
+
+    def getOutputVolume(self):
+        """ Input volume pointing to the (cropped) map used by Rosetta, with its origin """
+        outVol = self._getInputVolume().clone()
+        outVol.setLocation(self._getExtraPath('inpVolume.mrc'))
+        header = readMapHeader(self._getExtraPath('inpVolume.mrc'))
+        origin = Transform()
+        origin.setShifts(*(float(x) for x in header['start'] * header['voxelSize']))
+        outVol.setOrigin(origin)
+        return outVol
+
+    def planRun(self):
+        """ Fingerprint the prepared inputs and plan the models to generate of each input structure """
+        prepared = self.getPreparedInput(None)
+        for structure in prepared['structures']:
+            structure['fingerprint'] = self.getFingerprint(dict(structure, symfile=prepared['symfile']))
+        with open(self.getPreparedFile(), 'w') as f:
+            json.dump(prepared, f, indent=1)
+        plans = [self.planModels(i, structure['fingerprint']) for i, structure in enumerate(prepared['structures'])]
+        with open(self.getPlanFile(), 'w') as f:
+            json.dump({'structures': plans}, f, indent=1)
+
+    def getScriptArgs(self, prepared, xmlRosettaFile, nstruct, seed):
+      args = " -database {}".format(Plugin.getDatabasePath())
+      args += " -in::file::s %s " % prepared['pdbfile']
+      args += " -parser::protocol {} ".format(xmlRosettaFile)
+      if self.isSymmetric():
+        args += " -parser::script_vars symmdef=%s " % prepared['symfile']
+        args += " -score_symm_complex false "
+      if prepared['nucleic']:
+        args += " -relax::dna_move "
+      args += " -ignore_unrecognized_res "
+      args += " -edensity::mapreso %.3f " % self.resolution.get()
+      args += " -edensity::cryoem_scatterers "
+      args += " -in::file::centroid_input "
+      args += " -out::suffix %s " % self.getJobSuffix(seed)
+      args += " -cryst::crystal_refine "
+      args += " -restore_talaris_behavior "
+      args += " -nstruct %i" % nstruct
+      args += " -run:constant_seed -run:jran %i" % seed
+      return args
+
+    def getJobSuffix(self, seed):
+        """ Suffix of the models of a job, so their names and tags are unique among the jobs (of this and previous
+        runs, since each job gets a seed not used before) """
+        return '_rev2_j%d' % (seed - SEED_BASE)
+
+    def getBudgetFile(self):
+        return self._getExtraPath('budget.json')
+
+    def getPlanFile(self):
+        return self._getExtraPath('plan.json')
+
+    def getPlan(self, structure=0):
+        """ Plan of the models of an input structure (of all of them if None) """
+        with open(self.getPlanFile()) as f:
+            plan = json.load(f)
+        return plan if structure is None else plan['structures'][structure]
+
+    def getXMLFile(self):
+        return self._getExtraPath('multicycle.xml')
+
+    def getPreparedFile(self):
+        return self._getExtraPath('prepared.json')
+
+    def getPreparedInput(self, structure=0):
+        """ Prepared input structure, with the symmetry file shared by all of them (all the prepared input if None) """
+        with open(self.getPreparedFile()) as f:
+            prepared = json.load(f)
+        if structure is None:
+            return prepared
+        return dict(prepared['structures'][structure], symfile=prepared['symfile'])
+
     def cleanPDB(self, pdbfile):
         self.nucleic = False
         hydrogen = self.hydrogen.get()
@@ -278,10 +900,9 @@ class ProtRosettaGenerateStructures(EMProtocol):
 
     def runRosettaIdealize(self):
         program, programGPU = 'idealize_jd2.static.linuxgccrelease', 'idealize_jd2.opencl.linuxgccrelease'
-        rosettaDir = Plugin.getRosettaDir()
 
         # cmd+= " -database $ROSETTA3_DB"
-        args = " -database {}/main/database".format(rosettaDir)
+        args = " -database {}".format(Plugin.getDatabasePath())
         args += " -in::path ./"
         args += " -in::file::s %s" % self.pdbfile
         args += " -ignore_unrecognized_res"
@@ -297,10 +918,12 @@ class ProtRosettaGenerateStructures(EMProtocol):
         print("----------------------------")
 
         if params.GPU_LIST == 0:
-            Plugin.runRosettaProgram(program, args, cwd=self._getExtraPath())
+            Plugin.runRosettaProgram(program, args, cwd=self._getExtraPath(),
+                                     **getMetricsKwargs(self, 'runRosettaIdealize'))
         else:
             args += " -gpu %s" % str(self.gpuList.get())
-            Plugin.runRosettaProgram(programGPU, args, cwd=self._getExtraPath())
+            Plugin.runRosettaProgram(programGPU, args, cwd=self._getExtraPath(),
+                                     **getMetricsKwargs(self, 'runRosettaIdealize'))
 
         tmpfile = os.path.splitext(self.pdbfile)[0] + "_0001.pdb"
         outfile = os.path.splitext(self.pdbfile)[0] + "_ideal.pdb"
@@ -362,9 +985,13 @@ class ProtRosettaGenerateStructures(EMProtocol):
 
       return pdbfile, symedit
     
-    def writeRosettaXML(self, xmlRosettaFile):
-        # write protocol xml
+    def writeRosettaXML(self, xmlRosettaFile, settings=None, movers=None):
+        """ Write the protocol xml. settings: relax type, CartesianSampler rounds and ncycles chosen for a time
+        budget (see chooseRefinement). movers: names of the only movers added to the protocol (all if None) """
         xml = open(xmlRosettaFile, 'w')
+        relax = settings['relax'] if settings else ('LocalRelax' if len(self.residues) > 1000 else 'FastRelax')
+        samplers = SAMPLERS[:settings['rounds']] if settings else SAMPLERS
+        skipRelax = False
 
         # determine electron density weight
         # according to Rosetta:
@@ -379,6 +1006,18 @@ class ProtRosettaGenerateStructures(EMProtocol):
         symflags = ["<cen weights", "<dens_soft", "<dens weights"]
 
         for line in generateStructuresXML.split('\n'):
+          addedMover = re.search(r'<Add mover="(\w+)"', line)
+          if addedMover:
+            mover = addedMover.group(1)
+            # Each CartesianSampler round not used is removed with the relax after it
+            if (movers is not None and mover not in movers) or (mover.startswith('cen5_') and mover not in samplers) \
+                    or (mover == 'relaxcart' and skipRelax):
+              skipRelax = mover.startswith('cen5_')
+              continue
+            skipRelax = False
+          if settings and line.strip().startswith("<CartesianSampler"):
+            line = line.replace('ncycles="200"', 'ncycles="%i"' % settings['ncycles'])
+
           # for add symmetry to xml file
           if self.isSymmetric():
             if line.strip().startswith(tuple(symflags)):
@@ -399,8 +1038,8 @@ class ProtRosettaGenerateStructures(EMProtocol):
             elif line.strip().startswith('<Add mover="setupdens"'):
               line = "\t\t<Add mover='setupsymm'/>\n"
 
-          # if more than 1000 residues in ASU, use localrelax instead of fastrelax
-          if len(self.residues) > 1000 and line.strip().startswith("<FastRelax"):
+          # if more than 1000 residues in ASU (or chosen for the time budget), use localrelax instead of fastrelax
+          if relax == 'LocalRelax' and line.strip().startswith("<FastRelax"):
             line = "\t\t<LocalRelax name='relaxcart' scorefxn='dens' max_iter='100' ncyc='1' ramp_cart='0' K='16' nexp='2'/>\n"
           if line.strip().endswith("(REPLACE WITH EWEIGHT)"):
             line = "\t\t\t<Reweight scoretype='elec_dens_fast' weight='%i'/>\n" % eweight
@@ -416,7 +1055,7 @@ class ProtRosettaGenerateStructures(EMProtocol):
     ################### SMALL UTILS ###################
     def _getInputVolume(self):
         if self.inputVolume.get() is None:
-            fnVol = self.inputStructure.get().getVolume()
+            fnVol = self.getInputStructures()[0].getVolume()
         else:
             fnVol = self.inputVolume.get()
         return fnVol
@@ -432,17 +1071,20 @@ class ProtRosettaGenerateStructures(EMProtocol):
         exit("\nError generating chain subset file: %s\n" % pdbout)
 
     def getResList(self, pdb):
-      reslist = []
+      # The residues are kept in order in the keys of a dict, since a list membership test is quadratic
+      reslist = {}
       f = open(pdb)
       for line in f:
         if line.startswith("ATOM") or line.startswith("HETATM"):
           chain = line[21]
           res = line[22:26].strip()
           resid = "%s.%s" % (res, chain)
-          if resid not in reslist:
-            reslist.append(resid)
+          reslist[resid] = None
       f.close()
-      return reslist
+      return list(reslist)
+
+    def getCoordinates(self, pdb):
+      return pdbio.getCoordinates(pdbio.readAtoms(pdb, fields=pdbio.COORDINATES))
 
     def isSymmetric(self):
         return self.sym.get() != 'C1'
@@ -49,6 +49,7 @@ import os, shutil, json, glob
 
 from rosetta import Plugin
 from rosetta.constants import *
+from rosetta.utils.telemetry import getMetricsKwargs, getMetricsFile, readRecords, formatSummary
 
 from pwchem.utils import cleanPDB
 
@@ -170,6 +171,7 @@ class RosettaProteinPreparation(EMProtocol):
         args = ""
         args += " -in:file:"
         args += "s %s" % pdbFile # PDB file to add missing atoms
+        args += " -database %s" % Plugin.getDatabasePath()
 
         args += " -out:output -no_optH false"
 
@@ -183,7 +185,8 @@ class RosettaProteinPreparation(EMProtocol):
         # It creates different files by default in the protocol path:
         #   - <PDB_INPUT_NAME>_0001.pdb
         #   - <PDB_INPUT_NAME>_0001.sc (scorefile (default by program ->default.sc))
-        Plugin.runRosettaProgram(Plugin.getProgram(SCORE), args, cwd=self._getPath())
+        Plugin.runRosettaProgram(Plugin.getProgram(SCORE), args, cwd=self._getPath(),
+                                 **getMetricsKwargs(self, 'score_optH'))
 
         #Move and rename the files to Path from the ExtraPath
         scoresFile = self._getPath("%s_0001.pdb" % pdbName)
@@ -283,6 +286,7 @@ class RosettaProteinPreparation(EMProtocol):
                                % ( filename, filename_original, filename_clean, filename_sc))
         else:
             summary.append("Protocol not yet completed")
+        summary += formatSummary(readRecords(getMetricsFile(self)))
         return summary
 
 
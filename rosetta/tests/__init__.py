@@ -27,3 +27,16 @@
 from rosetta.tests.test_darc import *
 from rosetta.tests.test_target_preparation import *
 from rosetta.tests.test_generate_structures import *
+from rosetta.tests.test_silent import *
+from rosetta.tests.test_density import *
+from rosetta.tests.test_governor import *
+from rosetta.tests.test_process import *
+from rosetta.tests.test_database import *
+from rosetta.tests.test_estimator import *
+from rosetta.tests.test_pdbio import *
+from rosetta.tests.test_memory import *
+from rosetta.tests.test_progress import *
+from rosetta.tests.test_ligands import *
+from rosetta.tests.test_scheduling import *
+from rosetta.tests.test_fingerprint import *
+from rosetta.tests.test_maps import *
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+# **************************************************************************
+# *
+# * Authors:  Scipion-chem team (scipion@cnb.csic.es)
+# *
+# * Biocomputing Unit, CNB-CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+"""
+Benchmark of the numpy PDB processing (rosetta.utils.pdbio) against the line by line loops of the plugin, on a
+synthetic assembly of several million atoms. The outputs of both are checked to be the same.
+
+The line filters (cleanPDB, keepChainSubset, rename_pdb_file) are not faster with pdbio, so the plugin keeps the
+loops for them. The residue list keeps its loop with a dict instead of a list, and the coordinates are read with
+pdbio.
+
+    python -m rosetta.tests.benchmark_pdbio [--atoms 3000000] [--dir /tmp] [--formerResList]
+"""
+
+import os, time, argparse, tempfile
+
+import numpy as np
+
+from rosetta.utils import pdbio
+
+CHAINS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789'
+RESIDUE = [('N', 'N'), ('CA', 'C'), ('C', 'C'), ('O', 'O'), ('CB', 'C'), ('H', 'H'), ('HA', 'H')]
+
+
+def writeAssembly(fileName, nAtoms):
+    """ Synthetic assembly: alanines of 7 atoms in chains of up to 9999 residues, and a ligand every 1000 residues """
+    rng = np.random.default_rng(0)
+    with open(fileName, 'w') as f:
+        f.write('HEADER    SYNTHETIC ASSEMBLY\nREMARK   1 BENCHMARK\n')
+        serial, residue = 1, 0
+        while serial <= nAtoms:
+            chain, resSeq = CHAINS[(residue // 9999) % len(CHAINS)], residue % 9999 + 1
+            record, resName = ('HETATM', 'LIG') if residue % 1000 == 999 else ('ATOM  ', 'ALA')
+            for (name, element), (x, y, z) in zip(RESIDUE, rng.uniform(-999, 999, (len(RESIDUE), 3))):
+                f.write('%-6s%5d %-4s %3s %s%4d    %8.3f%8.3f%8.3f  1.00  0.00          %2s\n' %
+                        (record, serial % 100000, name, resName, chain, resSeq, x, y, z, element))
+                serial += 1
+            residue += 1
+        f.write('TER\nEND\n')
+
+
+# Former implementations
+def legacyClean(pdbIn, pdbOut):
+    chainids = []
+    with open(pdbOut, 'w') as outpdb:
+        for line in open(pdbIn):
+            if line.startswith("ATOM"):
+                if line[76:78].strip() == "H": continue
+                if line[21] not in chainids: chainids.append(line[21])
+                outpdb.write(line)
+    return chainids
+
+
+def legacyChainSubset(pdbIn, pdbOut, chains):
+    with open(pdbOut, 'w') as outpdb:
+        for line in open(pdbIn):
+            if line.startswith("ATOM") or line.startswith("HETATM"):
+                if line[21] in chains: outpdb.write(line)
+
+
+def dictResList(pdb):
+    reslist = {}
+    for line in open(pdb):
+        if line.startswith("ATOM") or line.startswith("HETATM"):
+            reslist["%s.%s" % (line[22:26].strip(), line[21])] = None
+    return list(reslist)
+
+
+def legacyCoordinates(pdb):
+    coords = []
+    with open(pdb) as f:
+        for line in f:
+            if line.startswith("ATOM") or line.startswith("HETATM"):
+                coords.append([float(line[30:38]), float(line[38:46]), float(line[46:54])])
+    return np.array(coords)
+
+
+def legacyResList(pdb):
+    reslist = []
+    for line in open(pdb):
+        if line.startswith("ATOM") or line.startswith("HETATM"):
+            resid = "%s.%s" % (line[22:26].strip(), line[21])
+            if resid not in reslist:
+                reslist.append(resid)
+    return reslist
+
+
+def legacyRename(pdbIn, pdbOut, newName):
+    with open(pdbIn) as f:
+        lines = [x.rstrip() for x in f]
+    with open(pdbOut, 'w') as f:
+        for line in lines:
+            if line[0:6] == "HETATM":
+                line = line[:17] + newName + line[20:]
+            f.write(line + "\n")
+
+
+# pdbio implementations
+def fastClean(pdbIn, pdbOut):
+    atoms = pdbio.readAtoms(pdbIn, records=('ATOM',), fields=('resName', 'chain', 'element'))
+    atoms = atoms[atoms['element'] != b'H']
+    pdbio.writeLines(pdbOut, atoms['line'])
+    return pdbio.getChains(atoms)
+
+
+def fastChainSubset(pdbIn, pdbOut, chains):
+    atoms = pdbio.readAtoms(pdbIn, fields=('chain',))
+    pdbio.writeLines(pdbOut, atoms['line'][np.isin(atoms['chain'], [c.encode() for c in chains])])
+
+
+def fastResList(pdb):
+    return pdbio.getResidues(pdbio.readAtoms(pdb, fields=('chain', 'resSeq')))
+
+
+def fastCoordinates(pdb):
+    return pdbio.getCoordinates(pdbio.readAtoms(pdb, fields=pdbio.COORDINATES))
+
+
+def fastRename(pdbIn, pdbOut, newName):
+    lines = pdbio.readLines(pdbIn)
+    pdbio.setColumn(lines, 17, 20, newName, pdbio.isRecord(lines, 'HETATM'))
+    pdbio.writeLines(pdbOut, lines, strip=True)
+
+
+def timeIt(function, *args):
+    start = time.time()
+    result = function(*args)
+    return time.time() - start, result
+
+
+def sameFiles(file1, file2):
+    with open(file1, 'rb') as f1, open(file2, 'rb') as f2:
+        return f1.read() == f2.read()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--atoms', type=int, default=3000000, help='Atoms of the synthetic assembly')
+    parser.add_argument('--dir', default=None, help='Directory of the temporary files')
+    parser.add_argument('--formerResList', action='store_true',
+                        help='Also time the former residue list, quadratic in the number of residues (about 2 min '
+                             'for 300000 atoms and hours for millions)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmpDir:
+        pdbFile = os.path.join(tmpDir, 'assembly.pdb')
+        writeAssembly(pdbFile, args.atoms)
+        print('Assembly of %d atoms (%.1f MB)' % (args.atoms, os.path.getsize(pdbFile) / 1024 ** 2))
+        print('%-20s %12s %12s %9s %6s' % ('task', 'former (s)', 'pdbio (s)', 'speedup', 'same'))
+
+        tasks = [('cleanPDB', legacyClean, fastClean),
+                 ('keepChainSubset', lambda i, o: legacyChainSubset(i, o, ['A', 'C']),
+                  lambda i, o: fastChainSubset(i, o, ['A', 'C'])),
+                 ('rename_pdb_file', lambda i, o: legacyRename(i, o, 'XYZ'), lambda i, o: fastRename(i, o, 'XYZ'))]
+        for name, legacy, fast in tasks:
+            legacyFile, fastFile = os.path.join(tmpDir, 'legacy.pdb'), os.path.join(tmpDir, 'fast.pdb')
+            legacyTime, legacyResult = timeIt(legacy, pdbFile, legacyFile)
+            fastTime, fastResult = timeIt(fast, pdbFile, fastFile)
+            same = sameFiles(legacyFile, fastFile) and \
+                (legacyResult is None or [c.strip() for c in legacyResult] == fastResult)
+            print('%-20s %12.2f %12.2f %8.1fx %6s' % (name, legacyTime, fastTime, legacyTime / fastTime, same))
+
+        legacyTime, legacyResult = timeIt(legacyCoordinates, pdbFile)
+        fastTime, fastResult = timeIt(fastCoordinates, pdbFile)
+        print('%-20s %12.2f %12.2f %8.1fx %6s' % ('getCoordinates', legacyTime, fastTime, legacyTime / fastTime,
+                                                  np.array_equal(legacyResult, fastResult)))
+
+        dictTime, dictResult = timeIt(dictResList, pdbFile)
+        fastTime, fastResult = timeIt(fastResList, pdbFile)
+        print('%-20s %12.2f %12.2f %8.1fx %6s' % ('getResList (dict)', dictTime, fastTime, dictTime / fastTime,
+                                                  dictResult == fastResult))
+        if args.formerResList:
+            legacyTime, legacyResult = timeIt(legacyResList, pdbFile)
+            print('%-20s %12.2f %12.2f %8.1fx %6s' % ('getResList (list)', legacyTime, fastTime,
+                                                      legacyTime / fastTime, legacyResult == fastResult))
+
+
+if __name__ == '__main__':
+    main()
@@ -26,10 +26,15 @@
 # **************************************************************************
 
 
+import json, math, os, tempfile, time
+
 from pyworkflow.tests import *
 
 from pwem.protocols import ProtImportPdb, ProtSetFilter
 from rosetta.protocols import RosettaProteinPreparation, RosettaProtDARC
+from rosetta.constants import ROSETTA_SCRATCH
+from rosetta.utils.telemetry import readRecords, getMetricsFile
+from rosetta.utils.scheduling import CostModel
 from pwchem.protocols import ProtChemImportSmallMolecules, ProtChemOBabelPrepareLigands, \
   ProtChemRDKitPrepareLigands, ProtDefineStructROIs
 
@@ -136,7 +141,7 @@ class TestImportBase(BaseTest):
         return cls.protGridADT
 
 
-    def _runDARC(self, ADTLigs=False, pocketsProt=None, gridProt=None):
+    def _runDARC(self, ADTLigs=False, pocketsProt=None, gridProt=None, wait=True, **kwargs):
         if ADTLigs:
             protLigs = self.protPrepareLigandRDKit
         else:
@@ -147,7 +152,7 @@ class TestImportBase(BaseTest):
                 RosettaProtDARC,
                 fromReceptor=0,
                 target_residue='99:C',
-                numberOfThreads=8)
+                numberOfThreads=8, **kwargs)
 
             protDARC.inputAtomStruct.set(self.protPrepareReceptor)
             protDARC.inputAtomStruct.setExtended('outputStructure')
@@ -161,14 +166,13 @@ class TestImportBase(BaseTest):
                 protDARC.grid.set(gridProt)
                 protDARC.grid.setExtended('outputGrid')
 
-            self.launchProtocol(protDARC)
-            self.assertIsNotNone(getattr(protDARC, 'outputSmallMolecules', None))
+            self._launchDARC(protDARC, wait)
 
         else:
             protDARC = self.newProtocol(
                 RosettaProtDARC,
                 fromReceptor=1,
-                numberOfThreads=8)
+                numberOfThreads=8, **kwargs)
 
             protDARC.inputStructROIs.set(self.pocketProt)
             protDARC.inputStructROIs.setExtended('outputStructROIs')
@@ -182,10 +186,22 @@ class TestImportBase(BaseTest):
                 protDARC.grid.set(gridProt)
                 protDARC.grid.setExtended('outputGrid')
 
+            self._launchDARC(protDARC, wait)
+
+        return protDARC
+
+    def _launchDARC(self, protDARC, wait):
+        if wait:
             self.launchProtocol(protDARC)
             self.assertIsNotNone(getattr(protDARC, 'outputSmallMolecules', None))
+        else:
+            self.proj.launchProtocol(protDARC, wait=False)
 
-        return protDARC
+    def _waitFinished(self, prot, sleepTime=5):
+        while not prot.isFinished():
+            self.assertFalse(prot.isFailed(), prot.getErrorMessage())
+            time.sleep(sleepTime)
+            self.proj._updateProtocol(prot)
 
 
 class TestDARC(TestImportBase):
@@ -221,3 +237,98 @@ class TestDARC(TestImportBase):
                                    pocketsProt=self.pocketProt)
         else:
           print('Autodock cannot be imported, docking with electrostatics cannot be made')
+
+    def test_5(self):
+        """ Complete Docking from protein pockets and shape only, in a node-local scratch directory
+        """
+        print("\n Complete Docking from protein pockets and shape only, in scratch \n")
+        scratchRoot = tempfile.mkdtemp(prefix='rosetta_scratch_')
+        # The variable is inherited by the process running the protocol
+        os.environ[ROSETTA_SCRATCH] = scratchRoot
+        try:
+            protDARC = self._runDARC(pocketsProt=self.pocketProt)
+        finally:
+            del os.environ[ROSETTA_SCRATCH]
+
+        self.assertGreater(protDARC.outputSmallMolecules.getSize(), 0)
+        # The scratch directory of each docking is removed once its outputs are copied back
+        self.assertEqual(os.listdir(scratchRoot), [])
+
+    def test_6(self):
+        """ Docking from protein pockets whose poses are streamed to the output while the ligands are docked
+        """
+        print("\n Docking from protein pockets, streaming the output \n")
+        protDARC = self._runDARC(pocketsProt=self.pocketProt, wait=False)
+        self._waitOutput(protDARC, 'outputSmallMolecules', sleepTime=5)
+        self._waitFinished(protDARC)
+
+        # The set opened by the first batch of dockings is closed at the end, with every pose
+        outputSet = protDARC.outputSmallMolecules
+        self.assertTrue(outputSet.isStreamClosed())
+        self.assertGreater(outputSet.getSize(), 0)
+
+    def test_7(self):
+        """ Docking from protein pockets in a screening funnel: shape only pass, then the best half fully docked
+        """
+        print("\n Docking from protein pockets in a screening funnel \n")
+        protDARC = self._runDARC(pocketsProt=self.pocketProt, funnelMode=True, screenRuns=10, screenParticles=10,
+                                 funnelSelection=0, funnelFraction=0.5, num_runs=30, num_particles=30)
+
+        # Every ligand docked in the screen, and only the selected ones in the full stage
+        screenSize = protDARC.outputSmallMoleculesScreen.getSize()
+        self.assertGreater(screenSize, 0)
+        self.assertLessEqual(protDARC.outputSmallMolecules.getSize(), math.ceil(0.5 * screenSize))
+        self.assertTrue(any(line.startswith('Screen stages: ') for line in protDARC.summary()))
+
+    def test_8(self):
+        """ Docking from protein pockets and minimization of the complex of the top ligand only
+        """
+        print("\n Docking from protein pockets, minimizing the top ligand \n")
+        protDARC = self._runDARC(pocketsProt=self.pocketProt, minimize_output=True, minimizeTopK=1,
+                                 num_runs=30, num_particles=30)
+
+        # Every ligand docked without minimization, and the best one of the pocket minimized
+        self.assertGreater(protDARC.outputSmallMoleculesFull.getSize(), 1)
+        self.assertEqual(protDARC.outputSmallMolecules.getSize(), 1)
+        self.assertTrue(any('minimize 1 minimizations' in line for line in protDARC.summary()))
+
+    def test_9(self):
+        """ Docking from protein pockets with a PSO budget scaled with the complexity of each ligand
+        """
+        print("\n Docking from protein pockets with an adaptive PSO budget \n")
+        protDARC = self._runDARC(pocketsProt=self.pocketProt, adaptiveBudget=True,
+                                 minRuns=10, maxRuns=40, minParticles=10, maxParticles=40)
+
+        records = [rec for rec in readRecords(getMetricsFile(protDARC)) if rec.get('step') == 'darcStep']
+        self.assertGreater(len(records), 0)
+        for rec in records:
+            self.assertTrue(10 <= rec['runs'] <= 40)
+            self.assertTrue(10 <= rec['particles'] <= 40)
+
+    def test_10(self):
+        """ Docking from protein pockets with replicates of each ligand, keeping the best pose
+        """
+        print("\n Docking from protein pockets with replicates \n")
+        protDARC = self._runDARC(pocketsProt=self.pocketProt, replicates=3, replicateTol=0.1,
+                                 num_runs=30, num_particles=30)
+
+        # A single round: the protocol runs as many replicates at once as threads it has (the failed ones not counted)
+        for mol in protDARC.outputSmallMolecules:
+            self.assertIn(mol._replicates.get(), (1, 2, 3))
+            self.assertGreaterEqual(mol._scoreSpread.get(), 0.0)
+        self.assertTrue(any(line.startswith('Replicates: ') for line in protDARC.summary()))
+
+    def test_11(self):
+        """ Docking from protein pockets, starting the dockings of the most expensive ligands first
+        """
+        print("\n Docking from protein pockets, most expensive ligands first \n")
+        protDARC = self._runDARC(pocketsProt=self.pocketProt)
+
+        # Nothing is measured before the first batch is inserted, so it is sorted by the prior cost
+        with open(protDARC._getExtraPath('docking_order.json')) as f:
+            order = json.load(f)['molfile_list.txt']
+        mols = {mol.getObjId(): mol.clone() for mol in protDARC.inputSmallMolecules.get()}
+        self.assertEqual(sorted(order), sorted(mols))
+        costs = [CostModel().predict(runs=1, particles=1, **protDARC.getLigandDescriptors(mols[molId]))
+                 for molId in order]
+        self.assertEqual(costs, sorted(costs, reverse=True))
@@ -0,0 +1,60 @@
+# **************************************************************************
+# *
+# * Name:     test of utils/database.py
+# *
+# * Authors: Scipion-chem team (scipion@cnb.csic.es)
+# *
+# * Biocomputing Unit, CNB-CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+import os, shutil, tempfile, unittest
+
+from rosetta.utils.database import getDatabaseMirror, COMPLETE_MARKER
+
+
+class TestDatabase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.database = os.path.join(self.tmpDir, 'database')
+        for entry in ('scoring', 'chemical'):
+            os.makedirs(os.path.join(self.database, entry))
+            with open(os.path.join(self.database, entry, 'weights.txt'), 'w') as f:
+                f.write(entry)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def testMirror(self):
+        cacheRoot = os.path.join(self.tmpDir, 'cache')
+        mirror, created = getDatabaseMirror(self.database, cacheRoot, '3.12 release', subset=['scoring'])
+        self.assertTrue(created)
+        self.assertTrue(os.path.exists(os.path.join(mirror, COMPLETE_MARKER)))
+        # The subset is copied and the rest linked to the original database
+        self.assertFalse(os.path.islink(os.path.join(mirror, 'scoring')))
+        self.assertTrue(os.path.islink(os.path.join(mirror, 'chemical')))
+        with open(os.path.join(mirror, 'chemical', 'weights.txt')) as f:
+            self.assertEqual(f.read(), 'chemical')
+
+        # Reused by the next programs, and versioned by the release
+        self.assertEqual(getDatabaseMirror(self.database, cacheRoot, '3.12 release'), (mirror, False))
+        self.assertNotEqual(getDatabaseMirror(self.database, cacheRoot, '3.13')[0], mirror)
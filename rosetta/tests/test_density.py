@@ -0,0 +1,91 @@
+# **************************************************************************
+# *
+# * Name:     test of utils/density.py
+# *
+# * Authors: Scipion-chem team (scipion@cnb.csic.es)
+# *
+# * Biocomputing Unit, CNB-CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+import os, shutil, tempfile, unittest
+
+import numpy as np
+
+from rosetta.utils.maps import HEADER_SIZE
+from rosetta.utils.density import splatAtoms, gaussianBlur, mapCorrelations, getPoolThreads, SIGMA_FACTOR, \
+    BYTES_PER_VOXEL
+
+DIMS, VOXEL_SIZE, RESOLUTION = (48, 40, 32), 1.0, 3.0
+
+
+def writeMap(fileName, data, voxelSize):
+    """ MRC map (float32, standard axis order, origin 0) of a grid (Z, Y, X) """
+    raw = np.zeros(HEADER_SIZE, dtype=np.uint8)
+    words, floats = raw.view('<i4'), raw.view('<f4')
+    dims = data.shape[::-1]
+    words[0:3], words[3], words[7:10], words[16:19] = dims, 2, dims, (1, 2, 3)
+    floats[10:13] = np.array(dims) * voxelSize
+    with open(fileName, 'wb') as f:
+        f.write(raw.tobytes())
+        f.write(data.astype('<f4').tobytes())
+
+
+def writePDB(fileName, coords):
+    with open(fileName, 'w') as f:
+        for i, (x, y, z) in enumerate(coords, 1):
+            f.write('ATOM  %5d  CA  ALA A%4d    %8.3f%8.3f%8.3f  1.00  0.00           C\n' % (i, i, x, y, z))
+
+
+class TestDensity(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        # Random chain of atoms in the center of the box, and a map simulated from them as the models are
+        rng = np.random.default_rng(0)
+        self.coords = np.cumsum(rng.normal(0, 1.5, (60, 3)), axis=0)
+        self.coords += np.array(DIMS) * VOXEL_SIZE / 2 - self.coords.mean(axis=0)
+        grid = splatAtoms(self.coords / VOXEL_SIZE, np.full(len(self.coords), 6.0), DIMS[::-1])
+        density = gaussianBlur(grid[None], np.full(3, SIGMA_FACTOR * RESOLUTION / VOXEL_SIZE))[0]
+        self.mapFile = os.path.join(self.tmpDir, 'map.mrc')
+        writeMap(self.mapFile, density, VOXEL_SIZE)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def testCorrelation(self):
+        sameFile, shiftedFile = os.path.join(self.tmpDir, 'same.pdb'), os.path.join(self.tmpDir, 'shifted.pdb')
+        writePDB(sameFile, self.coords)
+        writePDB(shiftedFile, self.coords + np.array([4.0, -3.0, 2.0]))
+
+        same, shifted = mapCorrelations(self.mapFile, [sameFile, shiftedFile], RESOLUTION, threads=2)
+        # The PDB coordinates are rounded to 0.001 A
+        self.assertAlmostEqual(same, 1.0, places=3)
+        self.assertLess(shifted, 0.3)
+        # The box of the models only bounds the threads of the pool
+        self.assertEqual(mapCorrelations(self.mapFile, [sameFile, shiftedFile], RESOLUTION, threads=2,
+                                         boxVoxels=1000), [same, shifted])
+
+    def testPoolThreads(self):
+        boxVoxels = int(np.prod(DIMS))
+        self.assertEqual(getPoolThreads(8, boxVoxels, memory=3 * boxVoxels * BYTES_PER_VOXEL), 3)
+        self.assertEqual(getPoolThreads(8, boxVoxels, memory=0), 1)
+        self.assertEqual(getPoolThreads(2, boxVoxels, memory=100 * boxVoxels * BYTES_PER_VOXEL), 2)
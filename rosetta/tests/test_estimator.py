@@ -0,0 +1,138 @@
+# **************************************************************************
+# *
+# * Name:     test of utils/estimator.py and utils/ligands.py
+# *
+# * Authors: Scipion-chem team (scipion@cnb.csic.es)
+# *
+# * Biocomputing Unit, CNB-CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+
+import os, shutil, tempfile, unittest
+
+from rosetta.utils.ligands import getMoleculeDescriptors
+from rosetta.utils.estimator import countResidues, estimateDarc, estimateStructures, DARC_MEMORY, MODEL_CPU
+
+MOL2_FILE = '''@<TRIPOS>MOLECULE
+ethanol
+@<TRIPOS>ATOM
+      1 C1          0.0000    0.0000    0.0000 C.3     1  LIG1        0.0000
+      2 C2          1.5000    0.0000    0.0000 C.3     1  LIG1        0.0000
+      3 O1          2.0000    1.2000    0.0000 O.3     1  LIG1        0.0000
+      4 H1          2.9000    1.2000    0.0000 H       1  LIG1        0.0000
+@<TRIPOS>BOND
+     1     1     2    1
+@<TRIPOS>MOLECULE
+ethanol
+@<TRIPOS>ATOM
+      1 C1          0.0000    0.0000    0.1000 C.3     1  LIG1        0.0000
+'''
+
+SDF_FILE = '''water
+  test
+
+  3  2  0  0  0  0  0  0  0  0999 V2000
+    0.0000    0.0000    0.0000 O   0  0  0  0  0  0  0  0  0  0  0  0
+    0.9000    0.0000    0.0000 H   0  0  0  0  0  0  0  0  0  0  0  0
+   -0.3000    0.9000    0.0000 H   0  0  0  0  0  0  0  0  0  0  0  0
+M  END
+$$$$
+'''
+
+PDB_FILE = '''ATOM      1  N   ALA A   1       0.000   0.000   0.000  1.00  0.00           N
+ATOM      2  CA  ALA A   1       1.000   0.000   0.000  1.00  0.00           C
+ATOM      3  CA  GLY A   2       2.000   0.000   0.000  1.00  0.00           C
+ATOM      4  CA  GLY A   2A      3.000   0.000   0.000  1.00  0.00           C
+ATOM      5  CA  SER B   1       4.000   0.000   0.000  1.00  0.00           C
+HETATM    6  O   HOH B 101       5.000   0.000   0.000  1.00  0.00           O
+END
+'''
+
+CIF_FILE = '''data_test
+#
+loop_
+_atom_site.group_PDB
+_atom_site.id
+_atom_site.type_symbol
+_atom_site.label_atom_id
+_atom_site.label_comp_id
+_atom_site.label_asym_id
+_atom_site.label_seq_id
+_atom_site.pdbx_PDB_ins_code
+_atom_site.auth_seq_id
+_atom_site.auth_asym_id
+ATOM   1 N N   ALA A 1 ? 1 A
+ATOM   2 C CA  ALA A 1 ? 1 A
+ATOM   3 O "O5'" DA A 2 ? 2 A
+ATOM   4 C CA  SER B 1 ? 1 B
+HETATM 5 O O   HOH C . ? 101 B
+#
+'''
+
+
+class TestEstimator(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def _writeFile(self, name, content):
+        fileName = os.path.join(self.tmpDir, name)
+        with open(fileName, 'w') as f:
+            f.write(content)
+        return fileName
+
+    def testMoleculeDescriptors(self):
+        self.assertEqual(getMoleculeDescriptors(self._writeFile('ethanol.mol2', MOL2_FILE)),
+                         {'heavyAtoms': 3, 'conformers': 2})
+        self.assertEqual(getMoleculeDescriptors(self._writeFile('water.sdf', SDF_FILE)),
+                         {'heavyAtoms': 1, 'conformers': 1})
+
+    def testResidues(self):
+        # Residues of the ATOM records, with their insertion codes, of all the chains or the ones of the ASU
+        pdbFile, cifFile = self._writeFile('test.pdb', PDB_FILE), self._writeFile('test.cif', CIF_FILE)
+        self.assertEqual(countResidues(pdbFile), 4)
+        self.assertEqual(countResidues(pdbFile, chains=['A']), 3)
+        self.assertEqual(countResidues(cifFile), 3)
+        self.assertEqual(countResidues(cifFile, chains=['B']), 1)
+
+    def testEstimates(self):
+        # Before the calibration, the default costs are used and the wall time is split among the threads
+        descriptors = [{'heavyAtoms': 20, 'conformers': 10}, {'heavyAtoms': 40, 'conformers': 50}]
+        screen = estimateDarc(descriptors, [(100, 10, 100, 1.0)], threads=4, records=[])
+        self.assertEqual(screen['calibration'], 0)
+        self.assertGreater(screen['cpuHours'], 0)
+        self.assertAlmostEqual(screen['wallHours'], screen['cpuHours'] / 4)
+        self.assertEqual(screen['peakMemory'], 4 * DARC_MEMORY)
+        # A funnel stage with a smaller budget and the selected ligands adds less than a second full pass
+        funnel = estimateDarc(descriptors, [(100, 2, 20, 1.0), (10, 10, 100, 1.0)], threads=4, records=[])
+        self.assertLess(funnel['cpuHours'], screen['cpuHours'])
+
+        models = estimateStructures(200, 10, 2, records=[])
+        self.assertAlmostEqual(models['cpuHours'], MODEL_CPU * 200 * 10 / 3600)
+        records = [{'residues': 100, 'nstruct': 5, 'user': 900, 'sys': 100, 'maxRSS': 1000, 'writtenBytes': 500}]
+        calibrated = estimateStructures(200, 10, 2, records)
+        self.assertEqual(calibrated['calibration'], 1)
+        self.assertAlmostEqual(calibrated['cpuHours'], 2.0 * 200 * 10 / 3600)
+        self.assertEqual(calibrated['peakMemory'], 2000)
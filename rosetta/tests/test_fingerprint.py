@@ -0,0 +1,62 @@
+# **************************************************************************
+# *
+# * Name:     test of utils/fingerprint.py
+# *
+# * Authors: Scipion-chem team (scipion@cnb.csic.es)
+# *
+# * Biocomputing Unit, CNB-CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+
+import os, shutil, tempfile, unittest
+
+from rosetta.utils.fingerprint import hashFiles, hashText
+
+
+class TestFingerprint(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def _writeFile(self, name, content):
+        fileName = os.path.join(self.tmpDir, name)
+        with open(fileName, 'w') as f:
+            f.write(content)
+        return fileName
+
+    def testFiles(self):
+        pdbFile, mapFile = self._writeFile('model.pdb', 'ATOM\n'), self._writeFile('map.mrc', 'MAP\n')
+        key = hashFiles([pdbFile, mapFile], 'xml', 3.0)
+        # The content is hashed, not the name, and the missing files (None) are skipped
+        self.assertEqual(hashFiles([self._writeFile('copy.pdb', 'ATOM\n'), None, mapFile], 'xml', 3.0), key)
+        self.assertNotEqual(hashFiles([pdbFile, mapFile], 'xml', 3.5), key)
+        self.assertNotEqual(hashFiles([mapFile, pdbFile], 'xml', 3.0), key)
+        self._writeFile('map.mrc', 'MAP2\n')
+        self.assertNotEqual(hashFiles([pdbFile, mapFile], 'xml', 3.0), key)
+
+    def testText(self):
+        self.assertEqual(hashText('<ROSETTASCRIPTS/>', 1), hashText('<ROSETTASCRIPTS/>', 1))
+        self.assertNotEqual(hashText('<ROSETTASCRIPTS/>', 1), hashText('<ROSETTASCRIPTS/>', 2))
+        self.assertNotEqual(hashText('<ROSETTASCRIPTS/>'), hashText('<ROSETTASCRIPTS />'))
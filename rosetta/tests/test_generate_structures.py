@@ -26,9 +26,15 @@
 # *
 # **************************************************************************
 
+import filecmp, json, os, unittest
+
 from pyworkflow.tests import *
 from pwem.protocols.protocol_import import ProtImportPdb, ProtImportVolumes
+from rosetta import Plugin
+from rosetta.constants import ROSETTA_SCRIPTS_MPI, MAP_MANIFEST
 from rosetta.protocols import ProtRosettaGenerateStructures
+from rosetta.utils.maps import readMapHeader
+from rosetta.protocols.protocol_generate_structures import chooseRefinement, SAMPLERS, MAX_NCYCLES, MIN_NCYCLES
 
 
 class TestGenerateStructures(BaseTest):
@@ -72,4 +78,151 @@ class TestGenerateStructures(BaseTest):
         self._runGenerateStructures()
 
         self.assertIsNotNone(getattr(self.protGenStructures, 'outputAtomStructs', None))
+        # The models are refined into the map, so they fit it
+        for aStr in self.protGenStructures.outputAtomStructs:
+            self.assertGreater(aStr._mapCorrelation.get(), 0.3)
+            self.assertLessEqual(aStr._mapCorrelation.get(), 1.0)
+
+    def testMPI(self):
+        if not os.path.exists(Plugin.getProgram(ROSETTA_SCRIPTS_MPI)):
+            self.skipTest('%s is not installed' % ROSETTA_SCRIPTS_MPI)
+
+        protGenStructures = self.newProtocol(
+          ProtRosettaGenerateStructures,
+          inputStructure=self.protImportPDB.outputPdb,
+          inputVolume=self.protImportVolume.outputVolume,
+          resolution=1.05, numMods=4, numberOfThreads=3, rosettaMpi=2)
+        self.launchProtocol(protGenStructures)
+
+        # Two jobs at the same time, each one with its own MPI ranks
+        self.assertEqual(len(protGenStructures.getJobs()), 2)
+        self.assertIsNotNone(getattr(protGenStructures, 'outputAtomStructs', None))
+        self.assertEqual(protGenStructures.outputAtomStructs.getSize(), 4)
+
+
+    def testBestModels(self):
+        protGenStructures = self.newProtocol(
+          ProtRosettaGenerateStructures,
+          inputStructure=self.protImportPDB.outputPdb,
+          inputVolume=self.protImportVolume.outputVolume,
+          resolution=1.05, numMods=3, bestModels=2)
+        self.launchProtocol(protGenStructures)
+
+        outputs = [aStr.clone() for aStr in protGenStructures.outputAtomStructs]
+        self.assertEqual([aStr._rosettaRank.get() for aStr in outputs], [1, 2])
+        scores = [aStr._rosetta_total_score.get() for aStr in outputs]
+        self.assertEqual(scores, sorted(scores))
+
+        # The scores table keeps all the models, not only the registered ones
+        with open(protGenStructures.getScoresFile()) as f:
+            self.assertEqual(len(f.readlines()), 1 + 3)
+
+    def testSilentOutput(self):
+        protGenStructures = self.newProtocol(
+          ProtRosettaGenerateStructures,
+          inputStructure=self.protImportPDB.outputPdb,
+          inputVolume=self.protImportVolume.outputVolume,
+          resolution=1.05, numMods=2, silentOutput=True)
+        self.launchProtocol(protGenStructures)
+
+        self.assertIsNotNone(getattr(protGenStructures, 'outputAtomStructs', None))
+        modelFiles = [protGenStructures.getModelFile(aStr) for aStr in protGenStructures.outputAtomStructs]
+        for modelFile in modelFiles:
+            self.assertTrue(os.path.exists(modelFile))
+        # Each model is extracted to its own file, even if its tag is repeated in other silent files
+        self.assertEqual(len(set(modelFiles)), len(modelFiles))
+
+    def testBatch(self):
+        # Ensemble of the models of a previous run
+        self._runGenerateStructures()
+
+        protGenStructures = self.newProtocol(
+          ProtRosettaGenerateStructures,
+          inputStructure=self.protGenStructures.outputAtomStructs,
+          inputVolume=self.protImportVolume.outputVolume,
+          resolution=1.05, numMods=1, numberOfThreads=3)
+        self.launchProtocol(protGenStructures)
+
+        self.assertIsNotNone(getattr(protGenStructures, 'outputAtomStructs', None))
+        self.assertEqual(protGenStructures.outputAtomStructs.getSize(), 2)
+        self.assertEqual(set(aStr._inputStructureId.get() for aStr in protGenStructures.outputAtomStructs),
+                         set(aStr.getObjId() for aStr in self.protGenStructures.outputAtomStructs))
+
+
+    def testReuse(self):
+        def runGenerateStructures(numMods):
+            protGenStructures = self.newProtocol(
+              ProtRosettaGenerateStructures,
+              inputStructure=self.protImportPDB.outputPdb,
+              inputVolume=self.protImportVolume.outputVolume,
+              resolution=1.05, numMods=numMods)
+            self.launchProtocol(protGenStructures)
+            plan = protGenStructures.getPlan()
+            return protGenStructures, len(plan['reused']), sum(job['nstruct'] for job in plan['jobs'].values())
+
+        runGenerateStructures(2)
+        # The same inputs: the models of the previous run are reused and nothing is generated
+        protGenStructures, reused, generated = runGenerateStructures(2)
+        self.assertEqual((reused, generated), (2, 0))
+        self.assertIn('Models reused from previous runs: 2. Generated: 0', protGenStructures.summary())
+        self.assertEqual(protGenStructures.outputAtomStructs.getSize(), 2)
+
+        # Only the models missing from the previous runs are generated
+        protGenStructures, reused, generated = runGenerateStructures(3)
+        self.assertGreaterEqual(reused, 2)
+        self.assertEqual(reused + generated, 3)
+        self.assertEqual(protGenStructures.outputAtomStructs.getSize(), 3)
+
+
+    def testCropMap(self):
+        def runGenerateStructures(**kwargs):
+            protGenStructures = self.newProtocol(
+              ProtRosettaGenerateStructures,
+              inputStructure=self.protImportPDB.outputPdb,
+              inputVolume=self.protImportVolume.outputVolume,
+              resolution=1.05, numMods=1, **kwargs)
+            self.launchProtocol(protGenStructures)
+            with open(protGenStructures._getExtraPath(MAP_MANIFEST)) as f:
+                return protGenStructures, json.load(f)['key']
+
+        inputDims = self.protImportVolume.outputVolume.getDim()
+        protCrop, cropKey = runGenerateStructures(cropMargin=6.0)
+        cropDims = readMapHeader(protCrop._getExtraPath('inpVolume.mrc'))['dims']
+        self.assertTrue(all(d < inputDims[i] for i, d in enumerate(cropDims)))
+        self.assertEqual(protCrop.getOutputVolume().getDim(), tuple(int(d) for d in cropDims))
+
+        # The map of the same volume and crop is reused, and the full map is a different one
+        protReused, reusedKey = runGenerateStructures(cropMargin=6.0)
+        self.assertEqual(reusedKey, cropKey)
+        self.assertTrue(filecmp.cmp(protReused._getExtraPath('inpVolume.mrc'), protCrop._getExtraPath('inpVolume.mrc'),
+                                    shallow=False))
+        protFull, fullKey = runGenerateStructures(cropMap=False)
+        self.assertNotEqual(fullKey, cropKey)
+        self.assertEqual(tuple(readMapHeader(protFull._getExtraPath('inpVolume.mrc'))['dims']), tuple(inputDims))
+
+
+class TestChooseRefinement(unittest.TestCase):
+    COSTS = {'setup': 10.0, 'FastRelax': 20.0, 'LocalRelax': 5.0, 'cycle': 0.5}
+
+    def testPreferences(self):
+        # A large budget: FastRelax, all the CartesianSampler rounds and the max cycles
+        settings = chooseRefinement(self.COSTS, 3600, 500)
+        self.assertEqual((settings['relax'], settings['rounds'], settings['ncycles']),
+                         ('FastRelax', len(SAMPLERS), MAX_NCYCLES))
+
+        # Fewer cycles, then fewer rounds, before giving up FastRelax
+        settings = chooseRefinement(self.COSTS, 200, 500)
+        self.assertEqual((settings['relax'], settings['rounds'], settings['ncycles']), ('FastRelax', len(SAMPLERS), 35))
+        settings = chooseRefinement(self.COSTS, 150, 500)
+        self.assertEqual((settings['relax'], settings['rounds'], settings['ncycles']), ('FastRelax', 3, 26))
+        self.assertLessEqual(settings['predicted'], 150)
+
+    def testLargeStructures(self):
+        # Above 1000 residues only LocalRelax is used, and it is not measured for FastRelax
+        costs = {key: value for key, value in self.COSTS.items() if key != 'FastRelax'}
+        self.assertEqual(chooseRefinement(costs, 3600, 1500)['relax'], 'LocalRelax')
 
+    def testNothingFits(self):
+        settings = chooseRefinement(self.COSTS, 30, 500)
+        self.assertEqual((settings['relax'], settings['rounds'], settings['ncycles']), ('LocalRelax', 1, MIN_NCYCLES))
+        self.assertAlmostEqual(settings['predicted'], 10 + 3 * 5 + MIN_NCYCLES * 0.5)
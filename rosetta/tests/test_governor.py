@@ -0,0 +1,93 @@
+# **************************************************************************
+# *
+# * Name:     test of utils/governor.py
+# *
+# * Authors: Scipion-chem team (scipion@cnb.csic.es)
+# *
+# * Biocomputing Unit, CNB-CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+import os, shutil, tempfile, threading, unittest
+
+from rosetta.utils.governor import HostSemaphore, getHostSlots
+
+
+class TestGovernor(unittest.TestCase):
+
+    def setUp(self):
+        self.lockDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.lockDir)
+
+    def testHostSlots(self):
+        self.assertIsNone(getHostSlots())
+        # Empty settings (as written in the config file) are not set
+        self.assertIsNone(getHostSlots('', '', ''))
+        self.assertEqual(getHostSlots('', '16', ''), 8)
+        self.assertEqual(getHostSlots('4', '16', '1'), 4)
+        self.assertEqual(getHostSlots('32', '16', '4'), 4)
+        self.assertEqual(getHostSlots('auto'), os.cpu_count())
+        self.assertEqual(getHostSlots(None, '1', '4'), 1)
+
+        with self.assertRaises(ValueError):
+            getHostSlots('many')
+        with self.assertRaises(ValueError):
+            getHostSlots(None, '16', 'two')
+        with self.assertRaises(ValueError):
+            getHostSlots(None, '16', '0')
+
+    def testHostSemaphore(self):
+        semaphore = HostSemaphore(self.lockDir, 2)
+        (first, _), (second, _) = semaphore.acquire(), semaphore.acquire()
+        self.assertNotEqual(first.indexes, second.indexes)
+
+        # A third process waits until a slot is released, even from another semaphore of the same directory
+        acquired = threading.Event()
+
+        def acquireThird():
+            slot, _ = HostSemaphore(self.lockDir, 2).acquire(pollTime=0.05)
+            acquired.set()
+            slot.release()
+
+        thread = threading.Thread(target=acquireThird)
+        thread.start()
+        self.assertFalse(acquired.wait(0.5))
+        first.release()
+        self.assertTrue(acquired.wait(5))
+        thread.join()
+        second.release()
+
+    def testMultipleSlots(self):
+        semaphore = HostSemaphore(self.lockDir, 3)
+        single, _ = semaphore.acquire()
+        # The slots of an MPI program are taken all at once, at most all the slots of the host
+        acquired = []
+        thread = threading.Thread(target=lambda: acquired.append(semaphore.acquire(pollTime=0.05, count=8)[0]))
+        thread.start()
+        thread.join(0.5)
+        self.assertFalse(acquired)
+        single.release()
+        thread.join(5)
+        self.assertEqual(sorted(acquired[0].indexes), [0, 1, 2])
+        acquired[0].release()
+        self.assertEqual(len(semaphore.acquire(count=2)[0].indexes), 2)
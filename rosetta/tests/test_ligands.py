@@ -0,0 +1,82 @@
+# **************************************************************************
+# *
+# * Name:     test of utils/ligands.py
+# *
+# * Authors: Scipion-chem team (scipion@cnb.csic.es)
+# *
+# * Biocomputing Unit, CNB-CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+
+import os, shutil, tempfile, unittest
+
+from rosetta.utils.ligands import countConformers, getParamsDescriptors, getComplexity
+
+PARAMS_FILE = '''NAME LG1
+IO_STRING LG1 Z
+TYPE LIGAND
+AA UNK
+ATOM  C1  CH3  X   -0.27
+ATOM  C2  CH2  X   -0.18
+ATOM  O1  OH   X   -0.66
+ATOM  H1  Hapo X    0.09
+ATOM  H2  Hpol X    0.43
+BOND  C1   C2
+BOND  C2   O1
+CHI 1  C1   C2   O1   H2
+NBR_ATOM  C2
+'''
+
+# Three conformers of the ligand, one after the other
+CONFORMERS_FILE = ''.join('HETATM%5d %-4s LG1 X   1       0.000   0.000   0.000  1.00  0.00           %s\n' %
+                          (i, name, name.strip()[0])
+                          for _ in range(3) for i, name in enumerate([' C1 ', ' C2 ', ' O1 '], 1))
+
+
+class TestLigands(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def _writeFile(self, name, content):
+        fileName = os.path.join(self.tmpDir, name)
+        with open(fileName, 'w') as f:
+            f.write(content)
+        return fileName
+
+    def testDescriptors(self):
+        self.assertEqual(getParamsDescriptors(self._writeFile('LG1.params', PARAMS_FILE)),
+                         {'heavyAtoms': 3, 'rotatableBonds': 1})
+        self.assertEqual(countConformers(self._writeFile('LG1_conformers.pdb', CONFORMERS_FILE)), 3)
+        # A file without atoms still holds the ligand itself
+        self.assertEqual(countConformers(self._writeFile('empty.pdb', 'END\n')), 1)
+
+    def testComplexity(self):
+        self.assertEqual(getComplexity(0, 0, 1), 0.0)
+        self.assertEqual(getComplexity(50, 12, 51), 1.0)
+        # Saturated at the max value of each descriptor
+        self.assertEqual(getComplexity(200, 30, 500), 1.0)
+        self.assertAlmostEqual(getComplexity(25, 6, 1), 0.4)
+        self.assertLess(getComplexity(10, 1, 1), getComplexity(10, 4, 1))
@@ -0,0 +1,89 @@
+# **************************************************************************
+# *
+# * Name:     test of utils/maps.py
+# *
+# * Authors: Scipion-chem team (scipion@cnb.csic.es)
+# *
+# * Biocomputing Unit, CNB-CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+
+import os, shutil, tempfile, unittest
+
+import numpy as np
+
+from rosetta.utils.maps import readMapHeader, loadMap, getCropBox, cropMap, HEADER_SIZE
+from rosetta.tests.test_density import writeMap
+
+VOXEL_SIZE = 1.5
+
+
+class TestMaps(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.data = np.arange(32 * 40 * 48, dtype=np.float32).reshape((32, 40, 48))
+        self.mapFile = os.path.join(self.tmpDir, 'map.mrc')
+        writeMap(self.mapFile, self.data, VOXEL_SIZE)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def testHeader(self):
+        header = readMapHeader(self.mapFile)
+        self.assertEqual(list(header['dims']), [48, 40, 32])
+        self.assertEqual(list(header['start']), [0, 0, 0])
+        np.testing.assert_allclose(header['voxelSize'], VOXEL_SIZE)
+        self.assertEqual(header['offset'], HEADER_SIZE)
+        np.testing.assert_array_equal(loadMap(self.mapFile)[0], self.data)
+
+        # Only the standard axis order
+        raw = np.fromfile(self.mapFile, dtype=np.uint8)
+        raw.view('<i4')[16:19] = (3, 2, 1)
+        raw.tofile(self.mapFile)
+        with self.assertRaises(ValueError):
+            readMapHeader(self.mapFile)
+
+    def testCropBox(self):
+        header = readMapHeader(self.mapFile)
+        coords = np.array([[15.0, 12.0, 9.0], [30.0, 21.0, 18.0]])
+        low, high = getCropBox(header, coords, margin=3.0)
+        self.assertEqual(list(low), [8, 6, 4])
+        self.assertEqual(list(high), [23, 17, 15])
+        # Clipped to the map
+        low, high = getCropBox(header, coords, margin=60.0)
+        self.assertEqual((list(low), list(high)), ([0, 0, 0], [48, 40, 32]))
+
+    def testCrop(self):
+        header = readMapHeader(self.mapFile)
+        coords = np.array([[15.0, 12.0, 9.0], [30.0, 21.0, 18.0]])
+        low, high = getCropBox(header, coords, margin=3.0)
+        cropFile = os.path.join(self.tmpDir, 'crop.mrc')
+        self.assertEqual(list(cropMap(self.mapFile, cropFile, low, high)), list(low))
+
+        data, cropHeader = loadMap(cropFile)
+        self.assertEqual(list(cropHeader['dims']), list(high - low))
+        np.testing.assert_allclose(cropHeader['voxelSize'], VOXEL_SIZE)
+        np.testing.assert_array_equal(data, self.data[low[2]:high[2], low[1]:high[1], low[0]:high[0]])
+        # The voxels keep their coordinates: the same box is found in the cropped map, shifted by its start
+        cropLow, cropHigh = getCropBox(cropHeader, coords, margin=3.0)
+        self.assertEqual((list(cropLow), list(cropHigh)), ([0, 0, 0], list(high - low)))
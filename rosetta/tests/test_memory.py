@@ -0,0 +1,84 @@
+# **************************************************************************
+# *
+# * Name:     test of utils/memory.py
+# *
+# * Authors: Scipion-chem team (scipion@cnb.csic.es)
+# *
+# * Biocomputing Unit, CNB-CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+
+import threading, unittest
+
+from rosetta.utils.memory import MemoryGovernor
+
+MB = 1024 ** 2
+
+
+class TestMemory(unittest.TestCase):
+
+    def testEstimate(self):
+        governor = MemoryGovernor(defaultEstimate=100 * MB, safetyFactor=1.0)
+        self.assertEqual(governor.estimate(10), 100 * MB)
+
+        # With few measures (or all of the same size), the mean peak
+        governor.release('a', 10, 200 * MB)
+        self.assertEqual(governor.estimate(50), 200 * MB)
+
+        # Then a linear model of the size, never below the smallest peak measured
+        governor.release('b', 20, 300 * MB)
+        governor.release('c', 30, 400 * MB)
+        self.assertAlmostEqual(governor.estimate(40), 500 * MB)
+        self.assertAlmostEqual(governor.estimate(0), 200 * MB)
+
+    def testAdmission(self):
+        governor = MemoryGovernor(budget=250 * MB, defaultEstimate=100 * MB, safetyFactor=1.0, reserveFree=0)
+        first, second = governor.admit('first'), governor.admit('second')
+
+        # The third job waits until one of the others is released
+        admitted = threading.Event()
+
+        def admitThird():
+            with governor.admit('third'):
+                admitted.set()
+
+        thread = threading.Thread(target=admitThird)
+        thread.start()
+        self.assertFalse(admitted.wait(0.5))
+        with first:
+            first.update(50 * MB)
+        self.assertTrue(admitted.wait(10))
+        thread.join()
+        second.__exit__(None, None, None)
+        self.assertEqual(governor.reserved, {})
+        self.assertEqual(governor.observations, [(1, 50 * MB)])
+
+    def testUpdate(self):
+        # The reservation of a running job grows with its sampled memory, and a job always fits when none is running
+        governor = MemoryGovernor(budget=120 * MB, defaultEstimate=100 * MB, safetyFactor=1.0, reserveFree=0)
+        ticket = governor.admit('first')
+        ticket.update(140 * MB)
+        self.assertEqual(governor.reserved['first'], 140 * MB)
+        self.assertFalse(governor.fits(20 * MB))
+        ticket.__exit__(None, None, None)
+        with governor.admit('big', size=1) as big:
+            self.assertEqual(big.estimate, 140 * MB)
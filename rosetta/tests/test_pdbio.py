@@ -0,0 +1,119 @@
+# **************************************************************************
+# *
+# * Name:     test of utils/pdbio.py
+# *
+# * Authors: Scipion-chem team (scipion@cnb.csic.es)
+# *
+# * Biocomputing Unit, CNB-CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+
+import os, shutil, tempfile, unittest
+
+import numpy as np
+
+from rosetta.utils import pdbio
+
+# Lines of different widths (with and without the element columns), other records and no final line end
+PDB_FILE = '''HEADER    TEST
+ATOM      1  N   ALA A   1      11.104   6.134  -6.504  1.00  0.00           N
+ATOM      2  H   ALA A   1      11.500   6.900  -6.000  1.00  0.00           H
+ATOM      3  CA  ALA A   1      11.639   6.071  -5.147  1.00  0.00
+ATOM      4  CA  GLY A   2      13.050   5.200  -4.100  1.00  0.00           C
+TER
+ATOM      5  CA  SER B 100      -1.000  -2.500   3.250  1.00  0.00           C
+HETATM    6  C1  LIG B 201       0.500   0.250  -0.125  1.00  0.00           C
+HETATM    7  O1  LIG C 202       1.500   1.250  -1.125  1.00  0.00           O
+END'''
+
+
+# Line by line references
+def legacyResidues(pdbFile):
+    reslist = []
+    with open(pdbFile) as f:
+        for line in f:
+            if line.startswith("ATOM") or line.startswith("HETATM"):
+                resid = "%s.%s" % (line[22:26].strip(), line[21])
+                if resid not in reslist:
+                    reslist.append(resid)
+    return reslist
+
+
+def legacyCoordinates(pdbFile):
+    coords = []
+    with open(pdbFile) as f:
+        for line in f:
+            if line.startswith("ATOM") or line.startswith("HETATM"):
+                coords.append([float(line[30:38]), float(line[38:46]), float(line[46:54])])
+    return np.array(coords)
+
+
+def legacyRename(pdbFile, newName):
+    with open(pdbFile) as f:
+        lines = [line.rstrip() for line in f]
+    return ''.join((line[:17] + newName + line[20:] if line[0:6] == "HETATM" else line) + '\n' for line in lines)
+
+
+class TestPdbio(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.pdbFile = os.path.join(self.tmpDir, 'test.pdb')
+        with open(self.pdbFile, 'w') as f:
+            f.write(PDB_FILE)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def _read(self, fileName):
+        with open(fileName) as f:
+            return f.read()
+
+    def testRoundTrip(self):
+        outFile = os.path.join(self.tmpDir, 'out.pdb')
+        pdbio.writeLines(outFile, pdbio.readLines(self.pdbFile))
+        self.assertEqual(self._read(outFile), PDB_FILE + '\n')
+
+    def testAtoms(self):
+        atoms = pdbio.readAtoms(self.pdbFile)
+        self.assertEqual(len(atoms), 7)
+        self.assertEqual(pdbio.getResidues(atoms), legacyResidues(self.pdbFile))
+        self.assertEqual(pdbio.getChains(atoms), ['A', 'B', 'C'])
+        self.assertTrue(np.array_equal(pdbio.getCoordinates(atoms), legacyCoordinates(self.pdbFile)))
+        # Missing element columns are read as empty
+        self.assertEqual(list(atoms['element']), [b'N', b'H', b'', b'C', b'C', b'C', b'O'])
+
+        # The lines of the selected atoms are written as they were
+        outFile = os.path.join(self.tmpDir, 'out.pdb')
+        hetatms = pdbio.readAtoms(self.pdbFile, records=('HETATM',), fields=('chain',))
+        pdbio.writeLines(outFile, hetatms['line'][hetatms['chain'] == b'B'])
+        self.assertEqual(self._read(outFile), PDB_FILE.splitlines()[7] + '\n')
+
+    def testRename(self):
+        lines = pdbio.readLines(self.pdbFile)
+        pdbio.setColumn(lines, 17, 20, 'XYZ', pdbio.isRecord(lines, 'HETATM'))
+        outFile = os.path.join(self.tmpDir, 'out.pdb')
+        pdbio.writeLines(outFile, lines, strip=True)
+        self.assertEqual(self._read(outFile), legacyRename(self.pdbFile, 'XYZ'))
+
+        with self.assertRaises(ValueError):
+            pdbio.setColumn(lines, 17, 20, 'XY')
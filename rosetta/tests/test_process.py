@@ -0,0 +1,74 @@
+# **************************************************************************
+# *
+# * Name:     test of utils/process.py and utils/telemetry.py
+# *
+# * Authors: Scipion-chem team (scipion@cnb.csic.es)
+# *
+# * Biocomputing Unit, CNB-CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+import os, shutil, subprocess, tempfile, unittest
+
+from rosetta.utils.process import runProcess, getExitCode
+from rosetta.utils.telemetry import makeRecord, getTailIdle
+
+MB = 1024 ** 2
+
+
+class TestProcess(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def testTreeIO(self):
+        # Written by a grandchild of the shell, which finishes before the sampling of the program
+        outFile = os.path.join(self.tmpDir, 'out.bin')
+        status, rusage, (read, written) = runProcess('sh -c "head -c %d /dev/zero > %s"; cat %s > /dev/null' %
+                                                     (4 * MB, outFile, outFile), sampleTime=0.1)
+        self.assertEqual(status, 0)
+        self.assertGreaterEqual(written, 4 * MB)
+        self.assertGreaterEqual(read, 4 * MB)
+
+        record = makeRecord('/opt/rosetta/bin/darc', {'step': 'darcStep'}, 0.0, 1.0, status, rusage,
+                            ioBytes=(read, written))
+        self.assertEqual(record['program'], 'darc')
+        self.assertEqual(record['writtenBytes'], written)
+        self.assertEqual(record['step'], 'darcStep')
+
+    def testExitCode(self):
+        # As the returncode of Popen: the exit status, or the negative signal number of a killed process
+        self.assertEqual(runProcess('exit 3', sampleTime=0.1, check=False)[0], 3)
+        self.assertEqual(runProcess('kill -9 $$', sampleTime=0.1, check=False)[0], -9)
+        with self.assertRaises(subprocess.CalledProcessError):
+            runProcess('exit 3', sampleTime=0.1)
+        self.assertEqual(getExitCode(0), 0)
+        self.assertEqual(getExitCode(2 << 8), 2)
+        self.assertEqual(getExitCode(15), -15)
+
+    def testTailIdle(self):
+        # Two slots: the last job starts at 10 s and runs alone until 40 s, the other one ends at 20 s
+        records = [{'start': 0.0, 'wall': 20.0}, {'start': 10.0, 'wall': 30.0}]
+        self.assertEqual(getTailIdle(records, 2), {'tail': 30.0, 'idle': 20.0})
+        self.assertIsNone(getTailIdle([], 2))
@@ -0,0 +1,69 @@
+# **************************************************************************
+# *
+# * Name:     test of utils/progress.py
+# *
+# * Authors: Scipion-chem team (scipion@cnb.csic.es)
+# *
+# * Biocomputing Unit, CNB-CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+
+import os, shutil, tempfile, unittest
+
+from rosetta.utils.progress import ProgressTracker, loadStatus, getRates, formatStatus
+
+
+class TestProgress(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.statusFile = os.path.join(self.tmpDir, 'progress.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def testTracker(self):
+        tracker = ProgressTracker(self.statusFile)
+        tracker.setTotals({'pocket_1': 3, 'pocket_2': 3})
+        tracker.addTotals({'pocket_1': 1})
+        tracker.stepFinished('lig_1', 'pocket_1', 30.0)
+        tracker.stepFinished('lig_2', 'pocket_1', 90.0, success=False)
+        tracker.stepFinished('lig_1', 'pocket_2', 60.0)
+
+        # The status is written on each update and loaded by a resumed run
+        status = loadStatus(self.statusFile)
+        self.assertEqual(status['pockets']['pocket_1'], {'total': 4, 'done': 2, 'failed': 1})
+        self.assertEqual(status['slowest'][0], [90.0, 'lig_2', 'pocket_1'])
+        self.assertEqual(ProgressTracker(self.statusFile).status, status)
+
+        lines = formatStatus(status)
+        self.assertEqual(lines[0], 'Docked 3 of 7 ligand-pocket pairs (1 failed)')
+        self.assertIn('  - pocket_2: 1/3 docked, 0 failed', lines)
+
+    def testRates(self):
+        # Throughput over the last completions, or since the start if there is only one
+        status = {'start': 0.0, 'completions': [100.0, 200.0, 300.0],
+                  'pockets': {'pocket_1': {'total': 10, 'done': 3, 'failed': 0}}}
+        self.assertEqual(getRates(status, now=300.0), {'ligandsPerHour': 36.0, 'eta': 700.0})
+        status['completions'] = [300.0]
+        self.assertEqual(getRates(status, now=300.0), {'ligandsPerHour': 36.0, 'eta': 700.0})
+        self.assertEqual(getRates(dict(status, completions=[]), now=0.0), {'ligandsPerHour': None, 'eta': None})
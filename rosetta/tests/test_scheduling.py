@@ -0,0 +1,75 @@
+# **************************************************************************
+# *
+# * Name:     test of utils/scheduling.py
+# *
+# * Authors: Scipion-chem team (scipion@cnb.csic.es)
+# *
+# * Biocomputing Unit, CNB-CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+
+import unittest
+
+from rosetta.utils.scheduling import CostModel, PRIOR
+
+
+def makeRecord(heavyAtoms, conformers, seconds, status=0, runs=10, particles=10):
+    """ Telemetry record of a docking taking the given seconds of wall time (and twice of cpu time) """
+    return {'status': status, 'heavyAtoms': heavyAtoms, 'conformers': conformers, 'runs': runs,
+            'particles': particles, 'wall': seconds, 'user': 1.5 * seconds, 'sys': 0.5 * seconds}
+
+
+class TestScheduling(unittest.TestCase):
+
+    def testPrior(self):
+        model = CostModel()
+        self.assertFalse(model.fitted)
+        self.assertEqual(model.predict(20, 1, runs=10, particles=10), 100 * (20 * PRIOR[1] + 20 * PRIOR[2]))
+        # Bigger and more flexible ligands first, and the docking flags scale the cost
+        self.assertGreater(model.predict(30, 1, 10, 10), model.predict(20, 1, 10, 10))
+        self.assertGreater(model.predict(20, 5, 10, 10), model.predict(20, 1, 10, 10))
+        self.assertEqual(model.predict(20, 1, 10, 10, factor=3.0), 3.0 * model.predict(20, 1, 10, 10))
+
+    def testFit(self):
+        # Runtimes of 0.01 s per heavy atom and conformer and PSO evaluation, plus 0.05 s of overhead
+        records = [makeRecord(heavyAtoms, conformers, 100 * (0.05 + 0.01 * heavyAtoms * conformers))
+                   for heavyAtoms, conformers in ((10, 1), (20, 2), (30, 1), (15, 4), (25, 3))]
+        # Failed dockings are not fitted
+        records.append(makeRecord(20, 1, 5000.0, status=1))
+
+        model = CostModel().fit(records)
+        self.assertTrue(model.fitted)
+        self.assertAlmostEqual(model.predict(40, 2, runs=20, particles=10), 200 * (0.05 + 0.01 * 80), places=6)
+        cpuModel = CostModel().fit(records, key='cpu')
+        self.assertAlmostEqual(cpuModel.predict(40, 2, 20, 10), 2 * model.predict(40, 2, 20, 10), places=6)
+
+    def testKeepPrior(self):
+        # Not enough dockings measured
+        records = [makeRecord(10 * i, i, 10.0 + 10.0 * i * i) for i in range(1, 4)]
+        self.assertFalse(CostModel().fit(records).fitted)
+        self.assertTrue(CostModel(minObservations=3).fit(records).fitted)
+
+        # Bigger ligands that ran faster give a negative coefficient: not physical
+        records = [makeRecord(10 * i, 1, 100.0 - 10 * i) for i in range(1, 7)]
+        model = CostModel().fit(records)
+        self.assertFalse(model.fitted)
+        self.assertEqual(list(model.coefs), list(PRIOR))
@@ -0,0 +1,96 @@
+# **************************************************************************
+# *
+# * Name:     test of utils/silent.py
+# *
+# * Authors: Scipion-chem team (scipion@cnb.csic.es)
+# *
+# * Biocomputing Unit, CNB-CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+import os, shutil, tempfile, unittest
+
+from rosetta.utils.silent import readScores, getScoreTerms, copyModels
+
+SCORE_FILE = '''SEQUENCE:
+SCORE: total_score    fa_atr elec_dens_fast description
+SCORE:     -12.500   -25.000         -3.250 5ni1_rev2_0001
+SCORE:      -8.000   -20.000         -2.000 5ni1_rev2_0002
+'''
+
+SILENT_FILE = '''SEQUENCE: AC
+SCORE:     score    fa_atr description
+REMARK BINARYSILENTFILE
+SCORE:   -10.500   -20.000 model_0001
+ANNOTATED_SEQUENCE: A[ALA]C[CYS] model_0001
+LAAAAAAAAAAAAAAAAAAAA model_0001
+LBBBBBBBBBBBBBBBBBBBB model_0001
+SCORE:   -11.000   -21.000 model_0002
+ANNOTATED_SEQUENCE: A[ALA]C[CYS] model_0002
+LCCCCCCCCCCCCCCCCCCCC model_0002
+'''
+
+
+class TestSilent(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def _writeFile(self, name, content):
+        fileName = os.path.join(self.tmpDir, name)
+        with open(fileName, 'w') as f:
+            f.write(content)
+        return fileName
+
+    def testScoreFile(self):
+        models = readScores(self._writeFile('score.sc', SCORE_FILE))
+        self.assertEqual([model['tag'] for model in models], ['5ni1_rev2_0001', '5ni1_rev2_0002'])
+        self.assertEqual(models[0]['total_score'], -12.5)
+        self.assertEqual(models[1]['elec_dens_fast'], -2.0)
+
+    def testSilentFile(self):
+        silentFile = self._writeFile('models.out', SILENT_FILE)
+        models = readScores(silentFile)
+        self.assertEqual([model['tag'] for model in models], ['model_0001', 'model_0002'])
+        self.assertEqual(models[1]['score'], -11.0)
+
+        # The sections of the models span from their SCORE line to the next one (or the end of the file)
+        with open(silentFile, 'rb') as f:
+            content = f.read()
+        for model in models:
+            section = content[model['offset']:model['offset'] + model['size']].decode()
+            self.assertTrue(section.startswith('SCORE:'))
+            self.assertEqual(section.count(model['tag']), len(section.splitlines()))
+
+        outFile = os.path.join(self.tmpDir, 'copy.out')
+        copyModels(silentFile, models[1:], outFile)
+        self.assertEqual([model['tag'] for model in readScores(outFile)], ['model_0002'])
+
+    def testScoreTerms(self):
+        # The total score of the silent files ('score') is named as in the score files
+        silentTerms = getScoreTerms(readScores(self._writeFile('models.out', SILENT_FILE))[0])
+        self.assertEqual(silentTerms, {'total_score': -10.5, 'fa_atr': -20.0})
+
+        scoreTerms = getScoreTerms(readScores(self._writeFile('score.sc', SCORE_FILE))[0])
+        self.assertEqual(scoreTerms, {'total_score': -12.5, 'fa_atr': -25.0, 'elec_dens_fast': -3.25})
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+# **************************************************************************
+# *
+# * Authors:  Scipion-chem team (scipion@cnb.csic.es)
+# *
+# * Biocomputing Unit, CNB-CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+from .scratch import ScratchRun
+from .database import getDatabaseMirror
+from .governor import HostSemaphore, getHostSlots
+from .process import runProcess, getTreeRSS, getAvailableMemory
+from .memory import MemoryGovernor
+from .ligands import countConformers, getParamsDescriptors, getComplexity, getMoleculeDescriptors
+from .telemetry import getProtocolTags, getMetricsKwargs, getMetricsFile, appendRecord, readRecords, measureChildren, \
+    formatSummary, getTailIdle
+from .profiling import profileStep, addProfilingParams
+from .progress import ProgressTracker, loadStatus, formatStatus
+from .scheduling import CostModel
+from .estimator import updateCalibration, loadCalibration, estimateDarc, estimateStructures, formatEstimate, \
+    writeEstimate, readEstimate, countResidues
+from .fingerprint import hashFiles, hashText
+from .maps import readMapHeader, loadMap, getCropBox, cropMap
+from .silent import readScores, getScoreTerms, writeIndex, readIndex, copyModels
+from .density import mapCorrelations, modelCorrelation, getPoolThreads
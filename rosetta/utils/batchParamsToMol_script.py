@@ -126,10 +126,11 @@ def rename_param_file(param_path,new_name,new_conformer_path):
 
 def rename_pdb_file(pdb_path,new_name):
     '''Renames all the HETATM resnames in the specified pdb to new_name'''
+    if len(new_name) != 3:
+        raise ValueError("The residue name %s of %s does not have 3 characters" % (new_name, pdb_path))
     pdb_file = open(pdb_path,'r')
     pdb_lines = [x.rstrip() for x in pdb_file]
     pdb_file.close()
-    assert(len(new_name) == 3)
     for index,line in enumerate(pdb_lines):
         if len(line) < 6:
             continue
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+# **************************************************************************
+# *
+# * Authors:  Scipion-chem team (scipion@cnb.csic.es)
+# *
+# * Biocomputing Unit, CNB-CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+"""
+Node-local mirror of the Rosetta database.
+
+Every Rosetta process reads thousands of files from main/database when it starts. When many of them start
+together over a network filesystem, reading a local mirror instead (created once per node and Rosetta version)
+removes that load from the shared storage.
+"""
+
+import os, re, shutil, fcntl
+
+COMPLETE_MARKER = '.complete'
+
+
+def getDatabaseMirror(sourceDb, cacheRoot, version, subset=None):
+    """ Return the path of the node-local mirror of sourceDb for this Rosetta version, creating it if needed.
+    - subset: names of the top level entries of the database that are copied. The rest are linked to the
+    original database, so the mirror is always complete. All entries are copied if None.
+    Returns the mirror path and whether it was created in this call.
+    """
+    mirrorDir = os.path.join(cacheRoot, 'database_{}'.format(re.sub(r'[^\w.-]', '_', version)))
+    if os.path.exists(os.path.join(mirrorDir, COMPLETE_MARKER)):
+        warmDatabase(mirrorDir)
+        return mirrorDir, False
+
+    os.makedirs(cacheRoot, exist_ok=True)
+    with open(mirrorDir + '.lock', 'w') as fLock:
+        fcntl.flock(fLock, fcntl.LOCK_EX)
+        if os.path.exists(os.path.join(mirrorDir, COMPLETE_MARKER)):
+            # Created by other process while waiting for the lock
+            return mirrorDir, False
+
+        tmpDir = '{}.tmp{}'.format(mirrorDir, os.getpid())
+        shutil.rmtree(tmpDir, ignore_errors=True)
+        os.makedirs(tmpDir)
+        for entry in os.listdir(sourceDb):
+            srcPath, dstPath = os.path.join(sourceDb, entry), os.path.join(tmpDir, entry)
+            if subset is not None and entry not in subset:
+                os.symlink(srcPath, dstPath)
+            elif os.path.isdir(srcPath):
+                shutil.copytree(srcPath, dstPath, symlinks=True)
+            else:
+                shutil.copy2(srcPath, dstPath)
+        open(os.path.join(tmpDir, COMPLETE_MARKER), 'w').close()
+
+        # Remove leftovers of an interrupted mirror and publish the new one
+        shutil.rmtree(mirrorDir, ignore_errors=True)
+        os.rename(tmpDir, mirrorDir)
+        # Copied files are already in the page cache of this node
+        open(getWarmMarker(mirrorDir), 'w').close()
+    return mirrorDir, True
+
+
+def warmDatabase(mirrorDir):
+    """ Read once per boot the copied files of the mirror, so they are in the page cache before the programs
+    start. Linked entries (not in the mirrored subset) are not read. """
+    warmMarker = getWarmMarker(mirrorDir)
+    if warmMarker is None or os.path.exists(warmMarker):
+        return
+
+    with open(mirrorDir + '.lock', 'w') as fLock:
+        fcntl.flock(fLock, fcntl.LOCK_EX)
+        if os.path.exists(warmMarker):
+            return
+        for root, dirs, files in os.walk(mirrorDir):
+            for fn in files:
+                filePath = os.path.join(root, fn)
+                if os.path.islink(filePath):
+                    continue
+                with open(filePath, 'rb') as f:
+                    while f.read(1 << 20):
+                        pass
+        open(warmMarker, 'w').close()
+
+
+def getWarmMarker(mirrorDir):
+    """ Marker file of the page cache warming for the current boot of the node """
+    try:
+        with open('/proc/sys/kernel/random/boot_id') as f:
+            bootId = f.read().strip()
+    except OSError:
+        return None
+    return os.path.join(mirrorDir, '.warm_{}'.format(bootId))
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+# **************************************************************************
+# *
+# * Authors:  Scipion-chem team (scipion@cnb.csic.es)
+# *
+# * Biocomputing Unit, CNB-CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+"""
+Fit of atomic models to a map, computed with numpy for many models at once.
+
+The density of a model is simulated at the resolution of the map: each atom (weighted by its atomic number) is
+spread over its 8 neighbour voxels and the grid is blurred with a Gaussian (sigma = SIGMA_FACTOR * resolution) in
+Fourier space. Only the box of the map around the model is simulated, read from the memory mapped map. The fit is
+the correlation of the simulated and the experimental densities inside a mask around the atoms (the voxels where
+the blurred atoms are above the density of a single atom at maskRadius from it). The threads of the pool are
+limited so that their grids fit in the memory, as large as the box expected for the models (the map at most).
+"""
+
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+from .maps import loadMap
+from .process import getAvailableMemory
+from . import pdbio
+
+SIGMA_FACTOR = 1 / (np.pi * np.sqrt(2))  # about 0.225, as in the molmap of Chimera
+ATOMIC_NUMBERS = {b'H': 1, b'C': 6, b'N': 7, b'O': 8, b'P': 15, b'S': 16}
+DEFAULT_NUMBER = 6
+# Bytes per voxel of the box of a model while its correlation is computed: the two float64 grids, their rFFT and its
+# filtered copy (complex128, half of the voxels), the blurred grids and the mask
+BYTES_PER_VOXEL = 80
+
+
+def getAtomWeights(elements):
+    """ Atomic numbers of the elements (byte strings), 6 for the unknown ones """
+    weights = np.full(len(elements), DEFAULT_NUMBER, dtype=np.float64)
+    for element, number in ATOMIC_NUMBERS.items():
+        weights[elements == element] = number
+    return weights
+
+
+def splatAtoms(positions, weights, shape):
+    """ Grid (Z, Y, X) with the weights of the atoms (positions in voxels, X Y Z) spread trilinearly """
+    base = np.floor(positions).astype(int)
+    frac = positions - base
+    grid = np.zeros(int(np.prod(shape)))
+    for corner in np.ndindex(2, 2, 2):
+        index = base + corner
+        cornerWeights = weights * np.prod(np.where(corner, frac, 1 - frac), axis=1)
+        inside = np.all((index >= 0) & (index < shape[::-1]), axis=1)
+        flat = np.ravel_multi_index(index[inside].T[::-1], shape)
+        grid += np.bincount(flat, cornerWeights[inside], minlength=grid.size)
+    return grid.reshape(shape)
+
+
+def gaussianBlur(grids, sigmas):
+    """ Blur grids (N, Z, Y, X) with a Gaussian of sigmas (voxels, X Y Z) in Fourier space """
+    shape = grids.shape[1:]
+    freqs = np.meshgrid(np.fft.fftfreq(shape[0]), np.fft.fftfreq(shape[1]), np.fft.rfftfreq(shape[2]),
+                        indexing='ij', sparse=True)
+    transfer = np.exp(-2 * np.pi ** 2 * sum((f * s) ** 2 for f, s in zip(freqs, sigmas[::-1])))
+    return np.fft.irfftn(np.fft.rfftn(grids, axes=(1, 2, 3)) * transfer, s=shape, axes=(1, 2, 3))
+
+
+def modelCorrelation(mapData, header, coords, weights, resolution, maskRadius=None):
+    """ Correlation of the density simulated from the atoms and the map inside the mask around them """
+    sigmas = SIGMA_FACTOR * resolution / header['voxelSize']
+    maskRadius = resolution if maskRadius is None else maskRadius
+    positions = (coords - header['origin']) / header['voxelSize'] - header['start']
+    pad = np.ceil(np.maximum(3 * sigmas, maskRadius / header['voxelSize'])) + 1
+    low = np.clip(np.floor(positions.min(axis=0) - pad).astype(int), 0, header['dims'])
+    high = np.clip(np.ceil(positions.max(axis=0) + pad).astype(int), low, header['dims'])
+    shape = tuple((high - low)[::-1])
+    if 0 in shape:
+        return None
+
+    positions = positions - low
+    grids = np.stack([splatAtoms(positions, weights, shape), splatAtoms(positions, np.ones(len(weights)), shape)])
+    simulated, occupancy = gaussianBlur(grids, sigmas)
+    # Blurred density of a single atom at maskRadius
+    threshold = np.exp(-0.5 * np.sum((maskRadius / header['voxelSize'] / sigmas) ** 2) / 3) / \
+                ((2 * np.pi) ** 1.5 * np.prod(sigmas))
+    mask = occupancy > threshold
+    if mask.sum() < 2:
+        return None
+    experimental = np.asarray(mapData[low[2]:high[2], low[1]:high[1], low[0]:high[0]], dtype=np.float64)[mask]
+    simulated = simulated[mask]
+    return float(np.corrcoef(simulated, experimental)[0, 1])
+
+
+def getPoolThreads(threads, boxVoxels, memory=None):
+    """ Threads (at most threads, at least 1) whose grids of boxVoxels each fit in the memory (bytes, half of the
+    available memory of the node if None) """
+    if memory is None:
+        available = getAvailableMemory()
+        memory = None if available is None else available / 2
+    if memory is None:
+        return max(1, threads)
+    return max(1, min(threads, int(memory // (boxVoxels * BYTES_PER_VOXEL))))
+
+
+def mapCorrelations(mapFile, pdbFiles, resolution, threads=1, maskRadius=None, memory=None, boxVoxels=None):
+    """ Correlation to a map (MRC, memory mapped) of each model (PDB files), computed in a pool of threads limited
+    by the memory (bytes, see getPoolThreads) and the voxels of the box of a model (the whole map if None) """
+    mapData, header = loadMap(mapFile)
+    boxVoxels = int(np.prod(header['dims'])) if boxVoxels is None else min(boxVoxels, int(np.prod(header['dims'])))
+    threads = getPoolThreads(threads, boxVoxels, memory)
+
+    def correlate(pdbFile):
+        atoms = pdbio.readAtoms(pdbFile, fields=pdbio.COORDINATES + ('element',))
+        return modelCorrelation(mapData, header, pdbio.getCoordinates(atoms), getAtomWeights(atoms['element']),
+                                resolution, maskRadius)
+
+    with ThreadPoolExecutor(threads) as executor:
+        return list(executor.map(correlate, pdbFiles))
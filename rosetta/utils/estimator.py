@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+# **************************************************************************
+# *
+# * Authors:  Scipion-chem team (scipion@cnb.csic.es)
+# *
+# * Biocomputing Unit, CNB-CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+"""
+Dry-run estimate of the cost (CPU hours, wall time, peak memory and disk) of DARC screens and generate-structures
+runs, calibrated from the telemetry of previous runs.
+
+The records of the main steps of each finished run are kept in a local calibration file (JSONL, the same format
+as the metrics files of the protocols). Until there are enough of them, default costs are used.
+The estimate of a run is computed once its input is prepared and saved, so the summary does not read the inputs.
+Before that (i.e. for a protocol not launched yet), it is computed from the input files.
+"""
+
+import os, re, json, fcntl
+
+from .scheduling import CostModel
+from .telemetry import readRecords
+from . import pdbio
+
+GB = 1024 ** 3
+# Steps whose records are used for calibration and max records kept in the calibration file
+CALIBRATION_STEPS = ('darcStep', 'runRosettaScript')
+MAX_CALIBRATION = 5000
+
+# Defaults before calibration: CPU seconds per PSO evaluation of (1, heavyAtoms, heavyAtoms * conformers),
+# memory and output bytes of a docking, CPU seconds per residue and output bytes per residue of a model
+DARC_PRIOR = (0.0, 2e-4, 2e-5)
+DARC_MEMORY, DARC_DISK = 1 * GB, 2 * 1024 ** 2
+MODEL_CPU, MODEL_MEMORY, MODEL_DISK = 1.0, 1 * GB, 1300
+
+
+def updateCalibration(metricsFile, calibrationFile):
+    """ Replace the records of a protocol run in the calibration file with its current successful ones """
+    newRecords = [rec for rec in readRecords(metricsFile)
+                  if rec.get('step') in CALIBRATION_STEPS and rec.get('status') == 0]
+    if not newRecords:
+        return
+    protocols = set(rec.get('protocol') for rec in newRecords)
+    os.makedirs(os.path.dirname(os.path.abspath(calibrationFile)), exist_ok=True)
+    with open(calibrationFile, 'a+') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            f.seek(0)
+            records = [json.loads(line) for line in f if line.strip()]
+            records = [rec for rec in records if rec.get('protocol') not in protocols] + newRecords
+            f.seek(0)
+            f.truncate()
+            for rec in records[-MAX_CALIBRATION:]:
+                f.write(json.dumps(rec) + '\n')
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def loadCalibration(calibrationFile, step):
+    return [rec for rec in readRecords(calibrationFile) if rec.get('step') == step]
+
+
+def _mean(values, default):
+    values = [v for v in values if v]
+    return sum(values) / len(values) if values else default
+
+
+def estimateDarc(descriptors, dockings, threads, records):
+    """ Estimate of a DARC screen.
+    - descriptors: heavyAtoms and conformers of a sample of the ligands
+    - dockings: list of (number of dockings, runs, particles, cost factor of the flags) of each stage
+    - threads: concurrent dockings
+    - records: calibration records of darcStep
+    """
+    model = CostModel(prior=DARC_PRIOR).fit(records, key='cpu')
+    cpu = 0.0
+    for nDockings, runs, particles, factor in dockings:
+        meanCPU = _mean([model.predict(runs=runs, particles=particles, factor=factor, **desc)
+                         for desc in descriptors], 0.0)
+        cpu += nDockings * meanCPU
+
+    nDockings = sum(d[0] for d in dockings)
+    return {'cpuHours': cpu / 3600, 'wallHours': cpu / 3600 / max(1, min(threads, nDockings)),
+            'peakMemory': min(threads, max(1, nDockings)) * _mean([rec.get('maxRSS') for rec in records], DARC_MEMORY),
+            'disk': nDockings * _mean([rec.get('writtenBytes') for rec in records], DARC_DISK),
+            'calibration': len(records) if model.fitted else 0}
+
+
+def estimateStructures(residues, nstruct, processes, records):
+    """ Estimate of a generate-structures run of nstruct models of a structure with a number of residues,
+    run in a number of concurrent processes. records: calibration records of runRosettaScript """
+    calibrated = [rec for rec in records if rec.get('residues') and rec.get('nstruct')]
+    work = sum(rec['residues'] * rec['nstruct'] for rec in calibrated)
+    cpuPerResidue = sum(rec.get('user', 0) + rec.get('sys', 0) for rec in calibrated) / work if work else MODEL_CPU
+    diskPerResidue = sum(rec.get('writtenBytes', 0) for rec in calibrated) / work if work else MODEL_DISK
+
+    cpu = cpuPerResidue * residues * nstruct
+    return {'cpuHours': cpu / 3600, 'wallHours': cpu / 3600 / max(1, min(processes, nstruct)),
+            'peakMemory': min(processes, nstruct) * _mean([rec.get('maxRSS') for rec in calibrated], MODEL_MEMORY),
+            'disk': diskPerResidue * residues * nstruct, 'calibration': len(calibrated)}
+
+
+def countResidues(structFile, chains=None):
+    """ Number of residues (ATOM records, of the given chains or all of them) of a PDB or mmCIF file """
+    if os.path.splitext(structFile)[1].lower() not in ('.cif', '.mmcif'):
+        atoms = pdbio.readAtoms(structFile, records=('ATOM',), fields=('chain', 'resSeq', 'iCode'))
+        keys = set(zip(atoms['chain'].astype(str), atoms['resSeq'], atoms['iCode']))
+    else:
+        keys, columns = set(), []
+        with open(structFile) as f:
+            for line in f:
+                if line.startswith('_atom_site.'):
+                    columns.append(line.strip().split('.', 1)[1])
+                elif columns and line.startswith(('ATOM', 'HETATM')):
+                    values = dict(zip(columns, re.findall(r"'[^']*'|\"[^\"]*\"|\S+", line)))
+                    if values.get('group_PDB') == 'ATOM':
+                        keys.add((values.get('auth_asym_id', values.get('label_asym_id')),
+                                  values.get('auth_seq_id', values.get('label_seq_id')),
+                                  values.get('pdbx_PDB_ins_code')))
+                elif columns and line.startswith(('#', 'loop_', '_')):
+                    # End of the atom_site loop
+                    break
+    return len([key for key in keys if chains is None or key[0] in chains])
+
+
+def writeEstimate(estimateFile, estimate):
+    with open(estimateFile, 'w') as f:
+        json.dump(estimate, f, indent=1)
+
+
+def readEstimate(estimateFile):
+    """ Estimate saved by a run, None if it is not computed yet """
+    if not os.path.exists(estimateFile):
+        return None
+    with open(estimateFile) as f:
+        return json.load(f)
+
+
+def formatEstimate(estimate):
+    """ Lines describing an estimate, for the protocol summary """
+    source = 'calibrated with %d records of previous runs' % estimate['calibration'] if estimate['calibration'] \
+        else 'default costs, not calibrated yet'
+    return ['Estimated cost (%s): %.2f CPU hours, %.2f hours of wall time, %.2f GB of peak memory, %.2f GB of '
+            'disk' % (source, estimate['cpuHours'], estimate['wallHours'], estimate['peakMemory'] / GB,
+                      estimate['disk'] / GB)]
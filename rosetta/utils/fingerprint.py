@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+# **************************************************************************
+# *
+# * Authors:  Scipion-chem team (scipion@cnb.csic.es)
+# *
+# * Biocomputing Unit, CNB-CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+"""
+Content fingerprints of the inputs of a run, used to find results that can be reused from previous runs.
+"""
+
+import hashlib
+
+CHUNK_SIZE = 1024 ** 2
+
+
+def hashFiles(files, *values):
+    """ SHA-1 of the content of the files (None entries are skipped) and of the string of the extra values """
+    sha = hashlib.sha1()
+    for fileName in files:
+        if fileName is None:
+            continue
+        with open(fileName, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                sha.update(chunk)
+    for value in values:
+        sha.update(repr(value).encode())
+    return sha.hexdigest()
+
+
+def hashText(text, *values):
+    sha = hashlib.sha1(text.encode())
+    for value in values:
+        sha.update(repr(value).encode())
+    return sha.hexdigest()
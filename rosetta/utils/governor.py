@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+# **************************************************************************
+# *
+# * Authors:  Scipion-chem team (scipion@cnb.csic.es)
+# *
+# * Biocomputing Unit, CNB-CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+"""
+Machine-wide limit of concurrent Rosetta processes.
+
+Several protocols running in the same node size their parallelism independently. The slots of this semaphore
+are lock files in a host-local directory, so every process launched through Plugin.runRosettaProgram (from any
+protocol or Scipion project) waits for a free slot before starting.
+"""
+
+import os, time, fcntl
+
+
+class HostSemaphore:
+    """ Counting semaphore shared by all the processes of a host. Each slot is a file locked with flock, so the
+    slots of crashed processes are released by the kernel """
+    def __init__(self, lockDir, slots, name='rosetta'):
+        self.lockDir, self.slots, self.name = lockDir, max(1, int(slots)), name
+
+    def acquire(self, pollTime=0.5, count=1):
+        """ Block until count slots (at most all of them, i.e: for the ranks of an MPI program) are free. They are
+        taken all at once, so programs waiting for several slots do not hold some of them while waiting.
+        Returns the slots (to release them) and the waiting time in seconds """
+        os.makedirs(self.lockDir, exist_ok=True)
+        count = max(1, min(int(count), self.slots))
+        start = time.time()
+        while True:
+            fSlots, indexes = [], []
+            for i in range(self.slots):
+                fSlot = open(os.path.join(self.lockDir, '{}_slot_{:03d}.lock'.format(self.name, i)), 'w')
+                try:
+                    fcntl.flock(fSlot, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    fSlot.close()
+                    continue
+                fSlots.append(fSlot)
+                indexes.append(i)
+                if len(fSlots) == count:
+                    return HostSlot(fSlots, indexes), time.time() - start
+            HostSlot(fSlots, indexes).release()
+            time.sleep(pollTime)
+
+
+class HostSlot:
+    """ Slots acquired from a HostSemaphore """
+    def __init__(self, fSlots, indexes):
+        self.fSlots, self.indexes = fSlots, indexes
+
+    def release(self):
+        for fSlot in self.fSlots:
+            fcntl.flock(fSlot, fcntl.LOCK_UN)
+            fSlot.close()
+        self.fSlots = []
+
+
+DEFAULT_PROCESS_MEMORY = 2.0
+
+
+def getHostSlots(cpus=None, memoryBudget=None, processMemory=None):
+    """ Number of concurrent processes allowed in the host given the CPUs ('auto' for all of them) and a memory
+    budget in GB, each process using processMemory GB (DEFAULT_PROCESS_MEMORY if not set). Empty values are taken
+    as not set. Returns None if no limit is defined. Raises ValueError if a value is not a valid number """
+    cpus, memoryBudget, processMemory = [_getSetting(value) for value in (cpus, memoryBudget, processMemory)]
+    limits = []
+    if cpus is not None:
+        limits.append(os.cpu_count() if cpus.lower() == 'auto' else _toNumber(cpus, int, 'CPUs of the host'))
+    if memoryBudget is not None:
+        processMemory = DEFAULT_PROCESS_MEMORY if processMemory is None else \
+            _toNumber(processMemory, float, 'memory of each process (GB)')
+        if processMemory <= 0:
+            raise ValueError('The memory of each process must be positive: %s' % processMemory)
+        limits.append(int(_toNumber(memoryBudget, float, 'memory of the host (GB)') // processMemory))
+    if not limits:
+        return None
+    return max(1, min(limits))
+
+
+def _getSetting(value):
+    """ String of a setting, None if it is not set or empty """
+    value = None if value is None else str(value).strip()
+    return value or None
+
+
+def _toNumber(value, numberType, description):
+    try:
+        return numberType(value)
+    except ValueError:
+        raise ValueError('Invalid %s: %r is not a number' % (description, value))
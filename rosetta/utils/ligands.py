@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+# **************************************************************************
+# *
+# * Authors:  Scipion-chem team (scipion@cnb.csic.es)
+# *
+# * Biocomputing Unit, CNB-CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+"""
+Cheap descriptors of the ligands prepared by molfile_to_params (params and conformers files) and of the input
+molecule files, used before the params are generated.
+"""
+
+import os
+
+
+def countConformers(pdbFile):
+    """ Number of conformers in a conformers pdb file, counted as the repetitions of its first atom name """
+    firstAtom, nConfs = None, 0
+    with open(pdbFile) as f:
+        for line in f:
+            if line.startswith(('ATOM', 'HETATM')):
+                atomName = line[12:16]
+                if firstAtom is None:
+                    firstAtom = atomName
+                if atomName == firstAtom:
+                    nConfs += 1
+    return max(1, nConfs)
+
+
+def getParamsDescriptors(paramsFile):
+    """ Number of heavy atoms and of rotatable bonds (CHI) of a ligand from its Rosetta params file """
+    heavyAtoms, rotatableBonds = 0, 0
+    with open(paramsFile) as f:
+        for line in f:
+            fields = line.split()
+            if fields and fields[0] == 'ATOM' and len(fields) > 2 and not fields[2].startswith('H'):
+                heavyAtoms += 1
+            elif fields and fields[0] == 'CHI':
+                rotatableBonds += 1
+    return {'heavyAtoms': heavyAtoms, 'rotatableBonds': rotatableBonds}
+
+
+def getComplexity(heavyAtoms, rotatableBonds, conformers, maxHeavyAtoms=50, maxRotatableBonds=12, maxConformers=50):
+    """ Complexity of a ligand for the docking search, in [0, 1]. Each descriptor is saturated at its max value """
+    return 0.5 * min(1.0, rotatableBonds / maxRotatableBonds) + \
+           0.3 * min(1.0, heavyAtoms / maxHeavyAtoms) + \
+           0.2 * min(1.0, (conformers - 1) / maxConformers)
+
+
+def getMoleculeDescriptors(molFile):
+    """ Number of heavy atoms (of the first molecule) and of molecules (conformers) in a mol2, sdf or pdb(qt) file.
+    Used to estimate the cost of a screen before the params of its ligands are generated """
+    ext = os.path.splitext(molFile)[1].lower()
+    elements, nMols = [], 0
+    with open(molFile) as f:
+        if ext == '.mol2':
+            inAtoms = False
+            for line in f:
+                if line.startswith('@<TRIPOS>'):
+                    nMols += line.startswith('@<TRIPOS>MOLECULE')
+                    inAtoms = line.startswith('@<TRIPOS>ATOM') and nMols == 1
+                elif inAtoms and line.strip():
+                    elements.append(line.split()[5].split('.')[0])
+        elif ext == '.sdf':
+            lines = f.read().split('\n')
+            nMols = sum(1 for line in lines if line.startswith('$$$$'))
+            if len(lines) > 3:
+                nAtoms = int(lines[3][:3])
+                elements = [line.split()[3] for line in lines[4:4 + nAtoms]]
+        else:
+            for line in f:
+                if line.startswith('MODEL'):
+                    nMols += 1
+                elif line.startswith(('ATOM', 'HETATM')) and nMols <= 1:
+                    elements.append(line[76:78].strip() or line[12:16].strip()[0])
+    heavyAtoms = sum(1 for element in elements if element.upper() not in ('H', 'D'))
+    return {'heavyAtoms': heavyAtoms, 'conformers': max(1, nMols)}
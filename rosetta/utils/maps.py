@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+# **************************************************************************
+# *
+# * Authors:  Scipion-chem team (scipion@cnb.csic.es)
+# *
+# * Biocomputing Unit, CNB-CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+"""
+Reading and cropping of MRC maps with numpy, without converting them with the image libraries.
+
+The voxels are memory mapped (only the ones used are read) and the coordinates (Angstrom) of a voxel (i, j, k) are
+(origin + (start + index) * voxelSize) in each axis. Only maps with the standard axis order (X columns, Y rows,
+Z sections) are supported, which is the one written by Scipion.
+"""
+
+import numpy as np
+
+HEADER_SIZE = 1024
+MODES = {0: np.int8, 1: np.int16, 2: np.float32, 6: np.uint16, 12: np.float16}
+
+
+def readMapHeader(fileName):
+    """ Main fields of the header of an MRC map: dims and start (X, Y, Z, voxels), voxelSize and origin (X, Y, Z,
+    Angstrom), data type and offset of the data in the file """
+    raw = np.fromfile(fileName, dtype=np.uint8, count=HEADER_SIZE)
+    words, floats = raw.view('<i4'), raw.view('<f4')
+    if tuple(words[16:19]) != (1, 2, 3):
+        raise ValueError('Only maps with the standard axis order are supported: %s' % fileName)
+    if words[3] not in MODES:
+        raise ValueError('Unsupported mode %d of the map %s' % (words[3], fileName))
+    dims, sampling = words[0:3].copy(), words[7:10].copy()
+    return {'dims': dims, 'start': words[4:7].copy(), 'voxelSize': floats[10:13] / np.where(sampling, sampling, 1),
+            'origin': floats[49:52].copy(), 'dtype': np.dtype(MODES[words[3]]).newbyteorder('<'),
+            'offset': HEADER_SIZE + int(words[23])}
+
+
+def loadMap(fileName, header=None):
+    """ Memory mapped voxels of an MRC map, with shape (Z, Y, X), and its header """
+    header = header or readMapHeader(fileName)
+    nx, ny, nz = header['dims']
+    data = np.memmap(fileName, dtype=header['dtype'], mode='r', offset=header['offset'], shape=(nz, ny, nx))
+    return data, header
+
+
+def getCropBox(header, coords, margin):
+    """ Voxel box (first and last + 1, X Y Z) of a map that contains the coordinates (N x 3, Angstrom) plus a margin
+    (Angstrom), clipped to the map """
+    coords = np.asarray(coords, dtype=float)
+    low = (coords.min(axis=0) - margin - header['origin']) / header['voxelSize'] - header['start']
+    high = (coords.max(axis=0) + margin - header['origin']) / header['voxelSize'] - header['start']
+    low = np.clip(np.floor(low).astype(int), 0, header['dims'])
+    high = np.clip(np.ceil(high).astype(int) + 1, low, header['dims'])
+    return low, high
+
+
+def cropMap(inFile, outFile, low, high):
+    """ Write the box (low, high: X Y Z voxels) of an MRC map into a new map keeping its coordinates (the start is
+    shifted by the first voxel of the box). Returns the start of the new map """
+    data, header = loadMap(inFile)
+    box = np.ascontiguousarray(data[low[2]:high[2], low[1]:high[1], low[0]:high[0]])
+    raw = np.fromfile(inFile, dtype=np.uint8, count=HEADER_SIZE).copy()
+    words, floats = raw.view('<i4'), raw.view('<f4')
+    dims, start = np.asarray(high) - np.asarray(low), header['start'] + np.asarray(low)
+    words[0:3], words[4:7], words[7:10] = dims, start, dims
+    floats[10:13] = dims * header['voxelSize']
+    if box.size:
+        floats[19:22] = box.min(), box.max(), box.mean(dtype=np.float64)
+    words[23] = 0  # The extended header is not copied
+    with open(outFile, 'wb') as f:
+        f.write(raw.tobytes())
+        f.write(box.astype(header['dtype'], copy=False).tobytes())
+    return start
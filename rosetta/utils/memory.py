@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+# **************************************************************************
+# *
+# * Authors:  Scipion-chem team (scipion@cnb.csic.es)
+# *
+# * Biocomputing Unit, CNB-CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+"""
+Memory-aware admission of concurrent jobs.
+
+Jobs (i.e: DARC dockings) ask for admission with the size of their ligand and are started only while the memory
+reserved by the running ones plus their own estimate fits in the budget. The estimates are learned from the
+peak memory sampled from the running processes, so small ligands get more concurrent jobs and big ones fewer.
+"""
+
+import threading
+
+from .process import getAvailableMemory
+
+GB = 1024 ** 3
+
+
+class MemoryGovernor:
+    """ Admission control of jobs under a memory budget (bytes, None for no limit).
+    - defaultEstimate: memory (bytes) expected for a job until some of them are measured
+    - safetyFactor: multiplies the learned estimates and the sampled memory of the running jobs
+    - reserveFree: memory (bytes) that must remain available in the node to admit a new job
+    """
+    def __init__(self, budget=None, defaultEstimate=GB, safetyFactor=1.2, reserveFree=GB):
+        self.budget, self.defaultEstimate = budget, defaultEstimate
+        self.safetyFactor, self.reserveFree = safetyFactor, reserveFree
+        self.condition = threading.Condition()
+        self.reserved = {}
+        self.observations = []  # (size, peak memory)
+
+    def estimate(self, size=1):
+        """ Expected peak memory of a job of a given size (i.e: number of ligand conformers).
+        A linear model (base + rate * size) is fitted once there are measures for different sizes """
+        with self.condition:
+            observations = list(self.observations)
+        if not observations:
+            return self.defaultEstimate
+
+        sizes, peaks = [o[0] for o in observations], [o[1] for o in observations]
+        meanSize, meanPeak = sum(sizes) / len(sizes), sum(peaks) / len(peaks)
+        varSize = sum((s - meanSize) ** 2 for s in sizes)
+        if len(observations) < 3 or varSize == 0:
+            return meanPeak * self.safetyFactor
+
+        rate = max(0, sum((s - meanSize) * (p - meanPeak) for s, p in zip(sizes, peaks)) / varSize)
+        base = meanPeak - rate * meanSize
+        return max(base + rate * size, min(peaks)) * self.safetyFactor
+
+    def admit(self, key, size=1):
+        """ Block until the job fits in the budget. At least one job is always admitted.
+        Returns a MemoryTicket (context manager) to update the sampled memory and release it """
+        estimate = self.estimate(size)
+        with self.condition:
+            while self.reserved and not self.fits(estimate):
+                self.condition.wait(5)
+            self.reserved[key] = estimate
+        return MemoryTicket(self, key, size, estimate)
+
+    def fits(self, estimate):
+        if self.budget is None:
+            return True
+        if sum(self.reserved.values()) + estimate > self.budget:
+            return False
+        available = getAvailableMemory()
+        return available is None or available - estimate > self.reserveFree
+
+    def update(self, key, memory):
+        """ Update the reserved memory of a running job with its sampled memory """
+        with self.condition:
+            if key in self.reserved and memory * self.safetyFactor > self.reserved[key]:
+                self.reserved[key] = memory * self.safetyFactor
+
+    def release(self, key, size, peak=None):
+        with self.condition:
+            self.reserved.pop(key, None)
+            if peak:
+                self.observations.append((size, peak))
+            self.condition.notify_all()
+
+
+class MemoryTicket:
+    """ Admission of a job in a MemoryGovernor, that keeps track of its peak memory """
+    def __init__(self, governor, key, size, estimate):
+        self.governor, self.key, self.size, self.estimate = governor, key, size, estimate
+        self.peak = 0
+
+    def update(self, memory):
+        self.peak = max(self.peak, memory)
+        self.governor.update(self.key, memory)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.governor.release(self.key, self.size, self.peak)
+        return False
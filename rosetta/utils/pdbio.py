@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+# **************************************************************************
+# *
+# * Authors:  Scipion-chem team (scipion@cnb.csic.es)
+# *
+# * Biocomputing Unit, CNB-CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+"""
+Fast processing of PDB files with numpy.
+
+A file is read in a single pass into an array of fixed-width byte strings (one per line), whose columns are sliced
+as a character matrix, so selecting, renaming and writing records does not loop over the lines in Python.
+readAtoms parses the coordinate records into a structured array.
+
+This module only depends on numpy, so that it can also be imported by the standalone scripts of the plugin.
+"""
+
+import numpy as np
+
+LINE_WIDTH = 80
+LF = ord('\n')
+# Columns (start, end) of the fields of the ATOM / HETATM records
+ATOM_FIELDS = [('record', 0, 6), ('serial', 6, 11), ('name', 12, 16), ('altLoc', 16, 17), ('resName', 17, 20),
+               ('chain', 21, 22), ('resSeq', 22, 26), ('iCode', 26, 27), ('x', 30, 38), ('y', 38, 46),
+               ('z', 46, 54), ('occupancy', 54, 60), ('tempFactor', 60, 66), ('element', 76, 78)]
+COORDINATES = ('x', 'y', 'z')
+
+
+def readLines(fileName):
+    """ Lines of a file (without the line ends) as an array of fixed-width byte strings, padded with nulls """
+    with open(fileName, 'rb') as f:
+        data = f.read().replace(b'\r', b'')
+    if data and not data.endswith(b'\n'):
+        data += b'\n'
+    ends = np.flatnonzero(np.frombuffer(data, dtype=np.uint8) == LF)
+    lengths = np.diff(ends, prepend=-1) - 1
+    width = max(LINE_WIDTH, int(lengths.max(initial=0)))
+    if len(ends) and (lengths == width).all():
+        # All the lines of the same width: rows of the buffer without the line ends
+        chars = np.frombuffer(data, dtype=np.uint8).reshape(len(ends), width + 1)[:, :width].copy()
+    else:
+        # Each line fills the beginning of its row
+        chars = np.zeros((len(ends), width), dtype=np.uint8)
+        chars[np.arange(width) < lengths[:, None]] = np.frombuffer(data.replace(b'\n', b''), dtype=np.uint8)
+    return chars.view('S%d' % width).ravel()
+
+
+def writeLines(fileName, lines, strip=False):
+    """ Write the lines (optionally without their trailing whitespace) """
+    lines = np.char.rstrip(lines) if strip else np.ascontiguousarray(lines)
+    chars = np.zeros((len(lines), lines.dtype.itemsize + 1), dtype=np.uint8)
+    chars[:, :-1] = getChars(lines).view(np.uint8)
+    chars[np.arange(len(lines)), np.char.str_len(lines)] = LF
+    chars[chars != 0].tofile(fileName)
+
+
+def getChars(lines):
+    """ View of the lines as a character matrix (lines x width). Changes in it modify the lines """
+    return lines.view('S1').reshape(len(lines), lines.dtype.itemsize)
+
+
+def getColumn(lines, start, end):
+    """ Field of each line in the columns [start, end) """
+    return np.ascontiguousarray(getChars(lines)[:, start:end]).view('S%d' % (end - start)).ravel()
+
+
+def setColumn(lines, start, end, value, mask=None):
+    """ Set the columns [start, end) of the lines (all or the ones in a mask) to a value of that width """
+    value = value.encode() if isinstance(value, str) else value
+    if len(value) != end - start:
+        raise ValueError('The value %s does not fit in the columns %d-%d' % (value, start, end))
+    chars = getChars(lines)
+    chars[slice(None) if mask is None else mask, start:end] = np.frombuffer(value, dtype='S1')
+
+
+def isRecord(lines, *records):
+    """ Mask of the lines starting with any of the records (i.e: 'ATOM', 'HETATM') """
+    mask = np.zeros(len(lines), dtype=bool)
+    for record in records:
+        mask |= np.char.startswith(lines, record.encode())
+    return mask
+
+
+def readAtoms(fileName, records=('ATOM', 'HETATM'), fields=None):
+    """ Structured array with the fields (all ATOM_FIELDS or the ones given, stripped byte strings except the float
+    coordinates) and the line of each atom record of a PDB file """
+    lines = readLines(fileName)
+    return parseAtoms(lines[isRecord(lines, *records)], fields)
+
+
+def parseAtoms(lines, fields=None):
+    columns = [field for field in ATOM_FIELDS if fields is None or field[0] in fields]
+    dtype = [(name, np.float64 if name in COORDINATES else 'S%d' % (end - start)) for name, start, end in columns]
+    atoms = np.empty(len(lines), dtype=dtype + [('line', lines.dtype)])
+    for name, start, end in columns:
+        column = getColumn(lines, start, end)
+        atoms[name] = column.astype(np.float64) if name in COORDINATES else np.char.strip(column)
+    atoms['line'] = lines
+    return atoms
+
+
+def getCoordinates(atoms):
+    """ Coordinates of the atoms, (N x 3) """
+    return np.stack([atoms[name] for name in COORDINATES], axis=1)
+
+
+def getResidues(atoms):
+    """ Residues (residue number, chain) of the atoms in order of appearance, as 'resSeq.chain' strings """
+    keys = np.char.add(np.char.add(atoms['resSeq'], b'.'), atoms['chain'])
+    _, first = np.unique(keys, return_index=True)
+    return [key.decode() for key in keys[np.sort(first)]]
+
+
+def getChains(atoms):
+    """ Chains of the atoms in order of appearance """
+    _, first = np.unique(atoms['chain'], return_index=True)
+    return [chain.decode() for chain in atoms['chain'][np.sort(first)]]
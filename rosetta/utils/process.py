@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+# **************************************************************************
+# *
+# * Authors:  Scipion-chem team (scipion@cnb.csic.es)
+# *
+# * Biocomputing Unit, CNB-CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+"""
+Execution of external programs with resource monitoring.
+"""
+
+import os, time, subprocess, resource
+
+PAGE_SIZE = resource.getpagesize()
+
+
+def runProcess(program, args=None, env=None, cwd=None, onSample=None, sampleTime=1.0, check=True):
+    """ Run a program (through the shell, as pwutils.runJob) and wait for it, calling onSample with the resident
+    memory (bytes) of its process tree every sampleTime seconds.
+    Returns the exit status, the resource usage (os.wait4) of the process and its children and the bytes read and
+    written by its process tree (see getTreeIO).
+    If check, raises subprocess.CalledProcessError if the program fails """
+    cmd = '%s %s' % (program, args) if args else program
+    print('** Running command: %s' % cmd)
+    process = subprocess.Popen(cmd, shell=True, env=env, cwd=cwd)
+    ioBytes = (0, 0)
+    while True:
+        # The finished process is not reaped yet, so the I/O of the whole tree is still in its counters
+        exited = os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOHANG | os.WNOWAIT) is not None
+        ioBytes = tuple(max(old, new) for old, new in zip(ioBytes, getTreeIO(process.pid)))
+        if exited:
+            break
+        if onSample is not None:
+            onSample(getTreeRSS(process.pid))
+        time.sleep(sampleTime)
+    _, status, rusage = os.wait4(process.pid, 0)
+
+    # Avoid Popen waiting again for the already reaped process
+    process.returncode = getExitCode(status)
+    if check and process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, cmd)
+    return process.returncode, rusage, ioBytes
+
+
+def getExitCode(status):
+    """ Exit code of a wait status, negative signal number if the process was killed (as Popen.returncode).
+    os.waitstatus_to_exitcode is only available from Python 3.9 """
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    if os.WIFEXITED(status):
+        return os.WEXITSTATUS(status)
+    return status
+
+
+def getTree(rootPid):
+    """ Pids of a process and all its descendants, read from /proc """
+    children = {}
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open('/proc/%s/stat' % entry) as f:
+                    ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            children.setdefault(ppid, []).append(int(entry))
+
+    tree, pids = [], [rootPid]
+    while pids:
+        pid = pids.pop()
+        tree.append(pid)
+        pids.extend(children.get(pid, []))
+    return tree
+
+
+def getTreeRSS(rootPid):
+    """ Resident memory (bytes) of a process and all its descendants, read from /proc """
+    rss = 0
+    for pid in getTree(rootPid):
+        try:
+            with open('/proc/%d/statm' % pid) as f:
+                rss += int(f.read().split()[1]) * PAGE_SIZE
+        except (OSError, IndexError, ValueError):
+            pass
+    return rss
+
+
+def getTreeIO(rootPid):
+    """ Bytes read and written (rchar, wchar of /proc/<pid>/io) by a process and all its descendants. They count the
+    read and write calls, so unlike the block I/O of the resource usage they also account network filesystems
+    (NFS, Lustre). The counters of the finished children are added to their parent once it reaps them """
+    read, written = 0, 0
+    for pid in getTree(rootPid):
+        try:
+            with open('/proc/%d/io' % pid) as f:
+                counters = dict(line.split(':') for line in f if ':' in line)
+            read += int(counters['rchar'])
+            written += int(counters['wchar'])
+        except (OSError, KeyError, ValueError):
+            pass
+    return read, written
+
+
+def getAvailableMemory():
+    """ Memory (bytes) available in the node for new processes, from /proc/meminfo. None if unknown """
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
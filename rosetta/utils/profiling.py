@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+# **************************************************************************
+# *
+# * Authors:  Scipion-chem team (scipion@cnb.csic.es)
+# *
+# * Biocomputing Unit, CNB-CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+"""
+Opt-in profiling of the Python side of the protocol steps.
+
+Steps decorated with profileStep are run under cProfile and a stack sampler when the ROSETTA_PROFILE variable
+is set or the protocol has its profileSteps parameter (addProfilingParams) enabled. For each execution, the logs
+folder of the protocol gets:
+- profile_<step>_<n>.pstats: cProfile statistics (pstats / snakeviz / gprof2dot)
+- profile_<step>_<n>.folded: collapsed stacks of the sampler (flamegraph.pl / speedscope)
+Only one cProfile profiler can be active in the process (Python >= 3.12), so the steps running in parallel with a
+profiled one only get the stack sampler.
+The run log gets the share of the step time spent waiting for external programs (Rosetta, OpenBabel...).
+"""
+
+import os, sys, time, cProfile, threading, functools
+from collections import Counter
+
+# Frames that mean that the step is waiting for an external program
+EXTERNAL_FRAMES = ('runJob', 'runProcess', 'runOpenBabel')
+
+PROFILE_HELP = 'Profile the Python side of each step (cProfile and stack sampling). The profiles are saved in ' \
+               'the "logs" folder of the protocol in pstats and collapsed stacks (flamegraph) formats. The steps ' \
+               'running in parallel with a profiled one only get the stack sampling.\n' \
+               'It can also be enabled for every protocol with the ROSETTA_PROFILE variable'
+
+_local = threading.local()
+_countLock = threading.Lock()
+# Held by the step running under cProfile
+_profilerLock = threading.Lock()
+
+
+def addProfilingParams(form):
+    """ Add the Profiling group with the profileSteps parameter to the form of a protocol """
+    from pyworkflow.protocol import params
+    group = form.addGroup('Profiling', expertLevel=params.LEVEL_ADVANCED)
+    group.addParam('profileSteps', params.BooleanParam, default=False, label='Profile steps: ', help=PROFILE_HELP)
+
+
+def profileStep(func):
+    """ Decorator of the protocol steps to profile them when enabled """
+    @functools.wraps(func)
+    def wrapper(protocol, *args, **kwargs):
+        if getattr(_local, 'active', False) or not isProfilingEnabled(protocol):
+            return func(protocol, *args, **kwargs)
+
+        _local.active = True
+        # cProfile only if no other step is using it, the stack sampler in any case
+        profiler = cProfile.Profile() if _profilerLock.acquire(blocking=False) else None
+        sampler = StackSampler(threading.get_ident())
+        start = time.time()
+        sampler.start()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            return func(protocol, *args, **kwargs)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                _profilerLock.release()
+            sampler.stop()
+            _local.active = False
+            prefix = getProfilePrefix(protocol, func.__name__)
+            if profiler is not None:
+                profiler.dump_stats(prefix + '.pstats')
+            sampler.write(prefix + '.folded')
+            print('Profile of %s: %.2f s, %.1f%% waiting for external programs (%s%s)' %
+                  (func.__name__, time.time() - start, 100 * sampler.externalFraction(), prefix,
+                   '.pstats/.folded' if profiler is not None else '.folded'))
+            sys.stdout.flush()
+    return wrapper
+
+
+def isProfilingEnabled(protocol):
+    from rosetta import Plugin
+    from rosetta.constants import ROSETTA_PROFILE
+    profileParam = getattr(protocol, 'profileSteps', None)
+    return bool(Plugin.getVar(ROSETTA_PROFILE)) or (profileParam is not None and bool(profileParam.get()))
+
+
+def getProfilePrefix(protocol, stepName):
+    """ Unique prefix for the profile files of a step execution """
+    with _countLock:
+        n = 1
+        while os.path.exists(protocol._getLogsPath('profile_{}_{}.folded'.format(stepName, n))):
+            n += 1
+        prefix = protocol._getLogsPath('profile_{}_{}'.format(stepName, n))
+        open(prefix + '.folded', 'w').close()
+    return prefix
+
+
+class StackSampler:
+    """ Samples the stack of a thread at a fixed interval, counting the collapsed stacks """
+    def __init__(self, threadId, interval=0.01):
+        self.threadId, self.interval = threadId, interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.threadId)
+            if frame is not None:
+                self.stacks[self.collapse(frame)] += 1
+
+    @staticmethod
+    def collapse(frame):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append('%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+    def externalFraction(self):
+        total = sum(self.stacks.values())
+        if total == 0:
+            return 0.0
+        external = sum(count for stack, count in self.stacks.items()
+                       if any(name.split(' ')[0] in EXTERNAL_FRAMES for name in stack.split(';')))
+        return external / total
+
+    def write(self, foldedFile):
+        with open(foldedFile, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write('%s %d\n' % (stack, count))
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+# **************************************************************************
+# *
+# * Authors:  Scipion-chem team (scipion@cnb.csic.es)
+# *
+# * Biocomputing Unit, CNB-CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+"""
+Incremental progress of a screen (ligands x pockets), updated from the step completions and persisted in a
+small JSON status file that the protocol summary (or any external tool) can read.
+"""
+
+import os, json, time, threading
+
+SLOWEST = 10
+
+
+class ProgressTracker:
+    """ Thread-safe progress of the docking steps of a protocol.
+    - statusFile: JSON file where the status is written after each update (and loaded from when resuming)
+    - window: number of last completions used for the current throughput
+    """
+    def __init__(self, statusFile, window=50):
+        self.statusFile, self.window = statusFile, window
+        self.lock = threading.Lock()
+        self.status = loadStatus(statusFile)
+        if self.status is None:
+            self.status = {'start': time.time(), 'pockets': {}, 'completions': [], 'slowest': []}
+
+    def setTotals(self, totals):
+        """ Set the number of ligands to dock in each pocket {pocketName: nLigands} """
+        with self.lock:
+            for pocket, total in totals.items():
+                self._getPocket(pocket)['total'] = total
+            self._write()
+
+    def addTotals(self, totals):
+        with self.lock:
+            for pocket, total in totals.items():
+                self._getPocket(pocket)['total'] += total
+            self._write()
+
+    def stepFinished(self, ligand, pocket, runtime, success=True):
+        """ Register a finished docking with its runtime in seconds """
+        with self.lock:
+            pocketStatus = self._getPocket(pocket)
+            pocketStatus['done'] += 1
+            pocketStatus['failed'] += not success
+
+            now = time.time()
+            self.status['completions'] = (self.status['completions'] + [now])[-self.window:]
+            slowest = self.status['slowest'] + [[round(runtime, 2), ligand, pocket]]
+            self.status['slowest'] = sorted(slowest, reverse=True)[:SLOWEST]
+            self.status.update(self.getRates(now))
+            self._write()
+
+    def getRates(self, now=None):
+        return getRates(self.status, now)
+
+    def _getPocket(self, pocket):
+        return self.status['pockets'].setdefault(pocket, {'total': 0, 'done': 0, 'failed': 0})
+
+    def _write(self):
+        self.status['updated'] = time.time()
+        tmpFile = self.statusFile + '.tmp'
+        with open(tmpFile, 'w') as f:
+            json.dump(self.status, f, indent=1)
+        os.replace(tmpFile, self.statusFile)
+
+
+def loadStatus(statusFile):
+    if statusFile and os.path.exists(statusFile):
+        with open(statusFile) as f:
+            return json.load(f)
+    return None
+
+
+def getRates(status, now=None):
+    """ Current throughput (ligands per hour, over the last completions) and estimated remaining time (s) """
+    now = time.time() if now is None else now
+    completions = status['completions']
+    total = sum(p['total'] for p in status['pockets'].values())
+    done = sum(p['done'] for p in status['pockets'].values())
+
+    rate = None
+    if len(completions) > 1 and completions[-1] > completions[0]:
+        rate = 3600 * (len(completions) - 1) / (completions[-1] - completions[0])
+    elif done and now > status['start']:
+        rate = 3600 * done / (now - status['start'])
+    eta = 3600 * (total - done) / rate if rate else None
+    return {'ligandsPerHour': rate, 'eta': eta}
+
+
+def formatStatus(status):
+    """ Lines describing the progress status, for the protocol summary """
+    if not status:
+        return []
+    pockets = status['pockets']
+    done, total = sum(p['done'] for p in pockets.values()), sum(p['total'] for p in pockets.values())
+    failed = sum(p['failed'] for p in pockets.values())
+    lines = ['Docked %d of %d ligand-pocket pairs (%d failed)' % (done, total, failed)]
+    for pocket in sorted(pockets):
+        p = pockets[pocket]
+        lines.append('  - %s: %d/%d docked, %d failed' % (pocket, p['done'], p['total'], p['failed']))
+
+    if done < total:
+        rates = getRates(status, status.get('updated'))
+        if rates['ligandsPerHour']:
+            lines.append('Current throughput: %.1f ligands/h. Estimated remaining time: %s' %
+                         (rates['ligandsPerHour'], time.strftime('%H:%M:%S', time.gmtime(rates['eta']))
+                         if rates['eta'] < 86400 else '%.1f days' % (rates['eta'] / 86400)))
+    if status['slowest']:
+        lines.append('Slowest dockings: ' +
+                     ', '.join('%s in %s (%.0f s)' % (lig, pocket, runtime) for runtime, lig, pocket in status['slowest']))
+    return lines
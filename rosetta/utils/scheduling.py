@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+# **************************************************************************
+# *
+# * Authors:  Scipion-chem team (scipion@cnb.csic.es)
+# *
+# * Biocomputing Unit, CNB-CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+"""
+Predicted cost of the dockings, used to start the most expensive ones first and shorten the tail of a screen.
+
+The runtime of a docking per PSO evaluation (runs x particles) is modelled as a linear function of the ligand
+size and number of conformers. The prior coefficients give a relative cost and, once enough dockings of a run
+have been measured (telemetry records with the descriptors in their tags), they are fitted to the observed
+runtimes by least squares.
+"""
+
+import numpy as np
+
+# Coefficients of (1, heavyAtoms, heavyAtoms * conformers), in relative units
+PRIOR = (0.0, 1.0, 0.1)
+
+
+class CostModel:
+    """ Runtime of a docking from its ligand descriptors and PSO budget.
+    - minObservations: measured dockings needed to fit the coefficients
+    """
+    def __init__(self, prior=PRIOR, minObservations=5):
+        self.coefs, self.minObservations = np.array(prior, dtype=float), minObservations
+        self.fitted = False
+
+    @staticmethod
+    def getFeatures(heavyAtoms, conformers):
+        return [1.0, heavyAtoms, heavyAtoms * conformers]
+
+    def fit(self, records, key='wall'):
+        """ Fit the coefficients to the successful records with heavyAtoms, conformers, runs and particles tags.
+        The key is the measure to predict: wall time or cpu (user + sys) time.
+        The prior is kept if there are not enough of them or the fit is not physical (negative coefficients) """
+        X, y = [], []
+        for rec in records:
+            if rec.get('status') == 0 and all(tag in rec for tag in ('heavyAtoms', 'conformers', 'runs', 'particles')):
+                value = rec['wall'] if key == 'wall' else rec.get('user', 0) + rec.get('sys', 0)
+                X.append(self.getFeatures(rec['heavyAtoms'], rec['conformers']))
+                y.append(value / max(1, rec['runs'] * rec['particles']))
+        if len(y) < self.minObservations:
+            return self
+        coefs = np.linalg.lstsq(np.array(X), np.array(y), rcond=None)[0]
+        # Round-off of the terms that do not take part in the runtimes (i.e: no overhead) is not negative
+        coefs[np.abs(coefs) <= 1e-9 * np.abs(coefs).max()] = 0.0
+        if np.all(coefs >= 0) and np.any(coefs > 0):
+            self.coefs, self.fitted = coefs, True
+        return self
+
+    def predict(self, heavyAtoms, conformers, runs, particles, factor=1.0):
+        """ Predicted runtime (seconds if fitted, relative units otherwise). The factor accounts for the docking
+        flags (conformer search, minimization) """
+        return factor * runs * particles * float(np.dot(self.coefs, self.getFeatures(heavyAtoms, conformers)))
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+# **************************************************************************
+# *
+# * Authors:  Scipion-chem team (scipion@cnb.csic.es)
+# *
+# * Biocomputing Unit, CNB-CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+"""
+Node-local scratch execution of Rosetta programs.
+
+The inputs of a program are staged into a private directory inside the scratch root (node-local disk or tmpfs),
+the program runs there and only the declared result files are copied back to the working directory of the
+protocol, so the temporary files of the program never touch the shared filesystem.
+"""
+
+import os, glob, shutil, tempfile, fcntl
+
+
+class ScratchRun:
+    """ Context manager that prepares a scratch directory for a single program execution.
+    - inputs: list of files (absolute or relative to cwd) that are copied into the scratch directory
+    - outputs: list of glob patterns (relative to the run directory) of the files to copy back to cwd
+    - appendOutputs: list of file names whose content is appended to the file with the same name in cwd
+    (i.e: score files shared by several runs)
+    """
+    def __init__(self, root, cwd, inputs=None, outputs=None, appendOutputs=None, prefix='rosetta_'):
+        self.root, self.cwd = os.path.abspath(root), os.path.abspath(cwd) if cwd else os.getcwd()
+        self.inputs = inputs if inputs else []
+        self.outputs = outputs if outputs else []
+        self.appendOutputs = appendOutputs if appendOutputs else []
+        self.prefix = prefix
+        self.path, self.staged = None, {}
+
+    def __enter__(self):
+        os.makedirs(self.root, exist_ok=True)
+        self.path = tempfile.mkdtemp(prefix=self.prefix, dir=self.root)
+        for i, inFile in enumerate(self.inputs):
+            self.stageFile(inFile, i)
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        try:
+            if excType is None:
+                self.collectOutputs()
+        finally:
+            shutil.rmtree(self.path, ignore_errors=True)
+        return False
+
+    def stageFile(self, inFile, idx=0):
+        """ Copy an input file into the scratch directory, keeping its basename so relative references
+        between inputs (i.e: PDB_ROTAMERS in params files) are still valid """
+        srcFile = os.path.abspath(os.path.join(self.cwd, inFile))
+        if srcFile in self.staged:
+            return self.staged[srcFile]
+
+        localFile = os.path.join(self.path, os.path.basename(srcFile))
+        if os.path.exists(localFile):
+            localDir = os.path.join(self.path, 'input_{}'.format(idx))
+            os.makedirs(localDir, exist_ok=True)
+            localFile = os.path.join(localDir, os.path.basename(srcFile))
+        shutil.copy(srcFile, localFile)
+        self.staged[srcFile] = localFile
+        return localFile
+
+    def localizeArgs(self, args):
+        """ Replace the absolute paths of the staged inputs in the program arguments by their local copies """
+        if not args:
+            return args
+        for srcFile in sorted(self.staged, key=len, reverse=True):
+            args = args.replace(srcFile, self.staged[srcFile])
+        return args
+
+    def collectOutputs(self):
+        """ Copy the declared outputs back to cwd. Each file is written into a temporary name in the destination
+        directory and then renamed, so readers never see half copied files """
+        stagedFiles = set(self.staged.values())
+        for pattern in self.outputs:
+            for localFile in glob.glob(os.path.join(self.path, pattern)):
+                if localFile in stagedFiles or not os.path.isfile(localFile) or \
+                        os.path.basename(localFile) in self.appendOutputs:
+                    continue
+                copyAtomic(localFile, os.path.join(self.cwd, os.path.relpath(localFile, self.path)))
+
+        for appendFile in self.appendOutputs:
+            localFile = os.path.join(self.path, appendFile)
+            if os.path.exists(localFile):
+                appendLocked(localFile, os.path.join(self.cwd, appendFile))
+
+
+def copyAtomic(srcFile, dstFile):
+    """ Copy a file to its destination through a temporary file and an atomic rename """
+    os.makedirs(os.path.dirname(dstFile), exist_ok=True)
+    tmpFile = '{}.tmp{}'.format(dstFile, os.getpid())
+    shutil.copy(srcFile, tmpFile)
+    os.replace(tmpFile, dstFile)
+
+
+def appendLocked(srcFile, dstFile):
+    """ Append the content of a file to another one holding an exclusive lock on the destination """
+    with open(srcFile) as fIn:
+        content = fIn.read()
+    with open(dstFile, 'a') as fOut:
+        fcntl.flock(fOut, fcntl.LOCK_EX)
+        try:
+            fOut.write(content)
+            fOut.flush()
+        finally:
+            fcntl.flock(fOut, fcntl.LOCK_UN)
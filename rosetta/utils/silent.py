@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+# **************************************************************************
+# *
+# * Authors:  Scipion-chem team (scipion@cnb.csic.es)
+# *
+# * Biocomputing Unit, CNB-CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+"""
+Scores and silent files written by Rosetta.
+
+The score files (.sc) and the silent files share the SCORE lines: a header with the names of the terms (the last
+one is the description, the tag of the model) followed by the values of each model. In a silent file, the SCORE
+line of a model starts its section, so the index of a silent file also keeps the offset and size (bytes) of each
+model, to copy them into other silent files without decoding them.
+"""
+
+import json
+
+SCORE_PREFIX = b'SCORE:'
+
+
+def readScores(fileName):
+    """ Models of a score or silent file: one dict per model with its terms (floats when possible), its tag and,
+    for silent files, the offset and size of its section """
+    header, models, offset = None, [], 0
+    with open(fileName, 'rb') as f:
+        for line in f:
+            if line.startswith(SCORE_PREFIX):
+                fields = line.decode().split()[1:]
+                if fields and fields[-1] == 'description':
+                    header = fields
+                elif header and len(fields) == len(header):
+                    model = {key: toNumber(value) for key, value in zip(header[:-1], fields[:-1])}
+                    model.update({'tag': fields[-1], 'offset': offset})
+                    models.append(model)
+            offset += len(line)
+    for model, nextModel in zip(models, models[1:] + [{'offset': offset}]):
+        model['size'] = nextModel['offset'] - model['offset']
+    return models
+
+
+def getScoreTerms(model):
+    """ Numeric score terms of a model read by readScores. The total score, 'total_score' in the score files and
+    'score' in the silent files, is always returned as 'total_score' """
+    terms = {term: value for term, value in model.items()
+             if term not in ('tag', 'offset', 'size') and isinstance(value, float)}
+    if 'score' in terms and 'total_score' not in terms:
+        terms['total_score'] = terms.pop('score')
+    return terms
+
+
+def toNumber(value):
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+def writeIndex(silentFile, indexFile):
+    """ Index (JSON) of the models of a silent file. Returns the models """
+    models = readScores(silentFile)
+    with open(indexFile, 'w') as f:
+        json.dump({'silent': silentFile, 'models': models}, f, indent=1)
+    return models
+
+
+def readIndex(indexFile):
+    with open(indexFile) as f:
+        return json.load(f)
+
+
+def copyModels(silentFile, models, outFile):
+    """ Write the models (from the index of the silent file) in a new silent file, with the header of the former """
+    with open(silentFile, 'rb') as fIn, open(outFile, 'wb') as fOut:
+        # Header: lines before the first model
+        for line in fIn:
+            if line.startswith(SCORE_PREFIX) and not line.rstrip().endswith(b'description'):
+                break
+            fOut.write(line)
+        for model in models:
+            fIn.seek(model['offset'])
+            fOut.write(fIn.read(model['size']))
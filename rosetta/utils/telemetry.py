@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+# **************************************************************************
+# *
+# * Authors:  Scipion-chem team (scipion@cnb.csic.es)
+# *
+# * Biocomputing Unit, CNB-CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+"""
+Resource telemetry of the external programs launched by the protocols.
+
+One JSON record per invocation is appended to a per-protocol metrics file (JSONL) with the wall time, user and
+system CPU, peak resident memory, bytes read and written and the exit status, tagged with the protocol, step,
+ligand and pocket it belongs to. The bytes are sampled from /proc/<pid>/io of the process tree (process.getTreeIO),
+since the block I/O of the resource usage is about 0 in network filesystems (NFS, Lustre).
+"""
+
+import os, json, time, fcntl, resource, threading
+from contextlib import contextmanager
+
+METRICS_FILE = 'metrics.jsonl'
+
+_fileLock = threading.Lock()
+
+
+def getProtocolTags(protocol, step, **kwargs):
+    """ Tags identifying an invocation: protocol, step and any extra (ligand, pocket...) """
+    tags = {'protocol': '{}.{}'.format(protocol.getClassName(), protocol.getObjId()), 'step': step}
+    tags.update({key: value for key, value in kwargs.items() if value is not None})
+    return tags
+
+
+def getMetricsKwargs(protocol, step, **kwargs):
+    """ Keyword arguments of Plugin.runRosettaProgram to record an invocation in the protocol metrics file """
+    return {'metricsFile': getMetricsFile(protocol), 'tags': getProtocolTags(protocol, step, **kwargs)}
+
+
+def getMetricsFile(protocol):
+    return protocol._getLogsPath(METRICS_FILE)
+
+
+def makeRecord(program, tags, start, wallTime, status, rusage=None, queueWait=0.0, ioBytes=None):
+    """ Build the record of an invocation from its os.wait4 resource usage and the (read, written) bytes of its
+    process tree """
+    record = {'program': os.path.basename(program.split()[0]), 'start': round(start, 3),
+              'wall': round(wallTime, 3), 'queueWait': round(queueWait, 3), 'status': status}
+    record.update(tags if tags else {})
+    if rusage is not None:
+        record.update({'user': round(rusage.ru_utime, 3), 'sys': round(rusage.ru_stime, 3),
+                       'maxRSS': rusage.ru_maxrss * 1024})
+    if ioBytes is not None:
+        record.update({'readBytes': ioBytes[0], 'writtenBytes': ioBytes[1]})
+    return record
+
+
+def appendRecord(metricsFile, record):
+    """ Append a record to a JSONL metrics file. Safe for concurrent threads and processes """
+    line = json.dumps(record) + '\n'
+    with _fileLock:
+        with open(metricsFile, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.write(line)
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def readRecords(metricsFile):
+    records = []
+    if os.path.exists(metricsFile):
+        with open(metricsFile) as f:
+            for line in f:
+                if line.strip():
+                    records.append(json.loads(line))
+    return records
+
+
+@contextmanager
+def measureChildren(metricsFile, program, tags=None):
+    """ Record an invocation launched by third party code (i.e: runOpenBabel) from the difference in the resource
+    usage of the finished children of this process. If other children finish at the same time (parallel steps),
+    their CPU is also accounted. The peak memory and the I/O cannot be told apart, so they are not recorded """
+    before, start, status = resource.getrusage(resource.RUSAGE_CHILDREN), time.time(), 1
+    try:
+        yield
+        status = 0
+    finally:
+        after = resource.getrusage(resource.RUSAGE_CHILDREN)
+        record = makeRecord(program, tags, start, time.time() - start, status)
+        record.update({'user': round(after.ru_utime - before.ru_utime, 3),
+                       'sys': round(after.ru_stime - before.ru_stime, 3)})
+        appendRecord(metricsFile, record)
+
+
+def summarizeRecords(records, key='program'):
+    """ Aggregate the records by a key (program, step...) """
+    summary = {}
+    for rec in records:
+        row = summary.setdefault(rec.get(key), {'calls': 0, 'failed': 0, 'wall': 0.0, 'cpu': 0.0, 'queueWait': 0.0,
+                                                'maxRSS': 0, 'readBytes': 0, 'writtenBytes': 0})
+        row['calls'] += 1
+        row['failed'] += rec.get('status') != 0
+        row['wall'] += rec.get('wall', 0)
+        row['cpu'] += rec.get('user', 0) + rec.get('sys', 0)
+        row['queueWait'] += rec.get('queueWait', 0)
+        row['maxRSS'] = max(row['maxRSS'], rec.get('maxRSS') or 0)
+        row['readBytes'] += rec.get('readBytes', 0)
+        row['writtenBytes'] += rec.get('writtenBytes', 0)
+    return summary
+
+
+def formatSummary(records, key='program'):
+    """ Lines of a summary table of the records, for the _summary of the protocols """
+    if not records:
+        return []
+    lines = ['Resources of the external programs (%s in the logs folder):' % METRICS_FILE,
+             '%-35s %7s %7s %10s %10s %10s %10s %12s' %
+             (key, 'calls', 'failed', 'wall (h)', 'CPU (h)', 'wait (h)', 'RSS (GB)', 'R/W (GB)')]
+    for name, row in sorted(summarizeRecords(records, key).items(), key=lambda x: -x[1]['wall']):
+        lines.append('%-35s %7d %7d %10.3f %10.3f %10.3f %10.2f %5.1f/%-5.1f' %
+                     (name, row['calls'], row['failed'], row['wall'] / 3600, row['cpu'] / 3600,
+                      row['queueWait'] / 3600, row['maxRSS'] / 1024 ** 3,
+                      row['readBytes'] / 1024 ** 3, row['writtenBytes'] / 1024 ** 3))
+    return lines
+
+
+def getTailIdle(records, slots):
+    """ Tail of a set of parallel jobs: time from the start of the last one to the end of all of them and the
+    idle slot-seconds during it (slots not running any job) """
+    if not records:
+        return None
+    tailStart = max(rec['start'] for rec in records)
+    end = max(rec['start'] + rec['wall'] for rec in records)
+    busy = sum(max(0.0, rec['start'] + rec['wall'] - max(rec['start'], tailStart)) for rec in records)
+    return {'tail': end - tailStart, 'idle': max(0.0, slots * (end - tailStart) - busy)}